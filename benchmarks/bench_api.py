@@ -0,0 +1,33 @@
+'''In-process latency of api endpoints through the ASGI stack, middleware included.
+Tasks are published to the broker stand-in and never executed.'''
+
+import uuid
+
+from common import latency_stats, measure_ms
+
+
+def run(ctx: dict, quick: bool = False) -> dict:
+    from celery import states
+    from fastapi.testclient import TestClient
+    from vinda.api.app import app
+    from vinda.api.worker.celery_app import celery_app
+
+    task_ids = [uuid.uuid4().hex for _ in range(100)]
+    for task_id in task_ids:
+        celery_app.backend.store_result(task_id, {'best_model_path': '/data/output/model.ckpt'}, states.SUCCESS)
+
+    requests = {
+        'metrics': lambda c: c.get('/metrics'),
+        'list_datasets': lambda c: c.get('/list_datasets'),
+        'task_state': lambda c: c.get(f'/task_state/{task_ids[0]}'),
+        'task_states_100': lambda c: c.post('/task_states', json={'task_ids': task_ids}),
+        'train_cls_model': lambda c: c.post('/train_cls_model', json={'dataset': 'benchmark', 'epochs': 1}),
+    }
+
+    repeat = 20 if quick else 200
+    results = {}
+    with TestClient(app) as client:
+        for name, request in requests.items():
+            samples = measure_ms(lambda: request(client).raise_for_status(), warmup=5, repeat=repeat)
+            results.update(latency_stats(f'api.{name}', samples))
+    return results
@@ -0,0 +1,132 @@
+'''DataLoader throughput of SimpleData over a synthetic dataset, as files and packed, the
+decode + preprocessing cost of a phone photo with full and reduced-resolution JPEG decode,
+and the accuracy parity of the two decodes.'''
+
+import os
+import time
+
+import numpy as np
+
+from common import IMG_SIZE, MODEL_NAME, latency_stats, make_checkpoint, make_image_dataset, make_photos, measure_ms
+
+## common network input, the draft scale depends on it
+DECODE_SIZE = 224
+## accuracy parity of the reduced-resolution decode, the suite fails beyond these
+MAX_TOP1_DISAGREEMENT = 0.02
+MAX_VAL_ACC_DROP = 0.02
+## val_acc (full decode) the parity model must reach, parity of a model that learned nothing says nothing
+MIN_VAL_ACC = 0.9
+
+
+def _samples_per_s(root: str, num_workers: int, batch_size: int, epochs: int) -> float:
+    from vinda.api.trainer import SimpleData
+
+    data = SimpleData(root, img_size=IMG_SIZE, batch_size=batch_size, num_workers=num_workers)
+    loader = data.train_dataloader()
+    # the first epoch pays for worker startup and a cold page cache
+    for _ in loader:
+        pass
+    start, count = time.perf_counter(), 0
+    for _ in range(epochs):
+        for batch in loader:
+            count += len(batch[0])
+    return count / (time.perf_counter() - start)
+
+
+def _pack(root: str, packed: str) -> str:
+    from vinda.api.ingest import Split, write_packed
+    from torchvision.datasets import ImageFolder
+
+    if os.path.isdir(packed):
+        return packed
+    splits = {}
+    for split in ('train', 'val'):
+        folder = ImageFolder(os.path.join(root, split))
+        splits[split] = Split([y for _, y in folder.samples], files=[x for x, _ in folder.samples])
+    write_packed(packed, folder.classes, splits, num_workers=1)
+    return packed
+
+
+def _decode(photos: list[str], quick: bool) -> dict:
+    from vinda.api.transforms import EvalTransform, decode_image
+
+    transform = EvalTransform(DECODE_SIZE)
+    results = {}
+    for name, draft in (('full', False), ('draft', True)):
+        samples = []
+        for path in photos:
+            decode = lambda: transform(decode_image(path, DECODE_SIZE, draft))
+            samples += measure_ms(decode, warmup=1, repeat=2 if quick else 5)
+        results.update(latency_stats(f'data.decode.{name}', samples))
+    # parity of the network inputs, in units of the normalized tensor
+    diff = np.concatenate([
+        np.abs(transform(decode_image(x, DECODE_SIZE, False)) - transform(decode_image(x, DECODE_SIZE, True))).ravel()
+        for x in photos
+    ])
+    results['data.decode.mean_abs_diff'] = float(diff.mean())
+    results['data.decode.max_abs_diff'] = float(diff.max())
+    return results
+
+
+def _predict(model, root: str, draft: bool) -> tuple[np.ndarray, np.ndarray]:
+    import torch
+    from vinda.api.trainer import SimpleData
+
+    data = SimpleData(root, img_size=IMG_SIZE, batch_size=32, num_workers=0, draft_decode=draft)
+    preds, labels = [], []
+    with torch.no_grad():
+        for x, y in data.val_dataloader():
+            preds.append(model(x).argmax(1).numpy())
+            labels.append(y.numpy())
+    return np.concatenate(preds), np.concatenate(labels)
+
+
+def _parity(ctx: dict) -> dict:
+    '''Train on full decodes of large JPEGs, then validate the checkpoint with draft decode off and on.'''
+    from vinda.api import schemas
+    from vinda.api.trainer import load_cls_model
+    from vinda.api.worker.celery_tasks import train_cls_model
+
+    # 8x the network input, validation images are decoded at the 1/8 scale
+    root = make_image_dataset(
+        os.path.join(ctx['workdir'], 'dataset-large'), train_per_class=256, val_per_class=64, size=IMG_SIZE * 8
+    )
+    # the same epochs with --quick, the predictions of an undertrained model flip on any change
+    config = schemas.TrainingConfig(
+        dataset=root, name_model=MODEL_NAME, img_size=IMG_SIZE, batch_size=16, num_workers=0,
+        pretrain_model=make_checkpoint(os.path.join(ctx['workdir'], 'untrained.ckpt')),
+        epochs=3, draft_decode=False,
+    )
+    result = train_cls_model.apply(args=(config.model_dump(),), throw=True).result
+    if 'best_model_path' not in result:
+        raise RuntimeError(f"training failed: {result.get('message')}")
+
+    model = load_cls_model(result['best_model_path'])
+    model.eval()
+    full, labels = _predict(model, root, draft=False)
+    draft, _ = _predict(model, root, draft=True)
+    val_acc = float((full == labels).mean())
+    if val_acc < MIN_VAL_ACC:
+        raise RuntimeError(f'the parity model reached val_acc {val_acc:.1%}, under {MIN_VAL_ACC:.0%}')
+    # lower is better, as the baseline comparison expects of metrics not ending in _per_s
+    disagreement = float((full != draft).mean())
+    drop = val_acc - float((draft == labels).mean())
+    if disagreement > MAX_TOP1_DISAGREEMENT or drop > MAX_VAL_ACC_DROP:
+        raise RuntimeError(
+            f'draft decode changes {disagreement:.1%} of the top-1 predictions and val_acc by {-drop:+.1%}, '
+            f'allowed {MAX_TOP1_DISAGREEMENT:.0%} and {-MAX_VAL_ACC_DROP:+.0%}'
+        )
+    return {'data.decode.top1_disagreement': disagreement, 'data.decode.val_acc_drop': drop}
+
+
+def run(ctx: dict, quick: bool = False) -> dict:
+    root = make_image_dataset(os.path.join(ctx['workdir'], 'dataset'))
+    packed = _pack(root, os.path.join(ctx['workdir'], 'dataset-packed'))
+    epochs = 1 if quick else 3
+    results = {}
+    for name, path in (('files', root), ('packed', packed)):
+        for num_workers in (0, 2):
+            results[f'data.{name}.workers{num_workers}.samples_per_s'] = _samples_per_s(path, num_workers, 32, epochs)
+    results.update(_decode(make_photos(os.path.join(ctx['workdir'], 'photos'), count=4 if quick else 8), quick))
+    results.update(_parity(ctx))
+    return results
@@ -0,0 +1,28 @@
+'''Time of the export_cls_model task (eager) on a checkpoint of the benchmark model, with the .ort artifact.'''
+
+import os
+import time
+
+from common import make_checkpoint
+
+
+def run(ctx: dict, quick: bool = False) -> dict:
+    from vinda.api import schemas
+    from vinda.api.worker.celery_tasks import export_cls_model
+
+    checkpoint = ctx.get('checkpoint') or make_checkpoint(os.path.join(ctx['workdir'], 'untrained.ckpt'))
+    save_path = os.path.join(ctx['workdir'], 'model.onnx')
+    config = schemas.ExportConfig(path_model=checkpoint, path_param='', ort=True).model_dump()
+
+    times = []
+    for _ in range(1 if quick else 3):
+        start = time.perf_counter()
+        export_cls_model.apply(args=(config, save_path), throw=True)
+        times.append(time.perf_counter() - start)
+
+    ctx['onnx'] = save_path
+    return {
+        'export.min_s': min(times),
+        'export.size_mb': os.path.getsize(save_path) / 1024 ** 2,
+        'export.ort_size_mb': os.path.getsize(os.path.splitext(save_path)[0] + '.ort') / 1024 ** 2,
+    }
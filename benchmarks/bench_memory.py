@@ -0,0 +1,69 @@
+'''Memory of api processes serving one model: proportional set size (PSS, shared pages divided
+among the processes mapping them) and private memory per process while several processes hold
+an engine, for weights embedded in the onnx file and for memory-mapped external data.'''
+
+import os
+import multiprocessing
+
+import numpy as np
+
+from PIL import Image
+
+from common import IMG_SIZE, make_checkpoint
+
+
+## large enough for the weights to dominate the runtime's own memory
+MEMORY_MODEL = 'resnet18'
+PROCESSES = 3
+
+
+def _serve(model: str, kwargs: dict, barrier, queue):
+    from vinda.api.onnxinfer import OrtClsInfer
+    from vinda.api.utils import memory_usage
+
+    before = memory_usage()
+    engine = OrtClsInfer(model, prefer_ort=False, **kwargs)
+    engine(Image.fromarray(np.zeros((IMG_SIZE, IMG_SIZE, 3), dtype=np.uint8)), IMG_SIZE)
+    # measure once every process holds the model, PSS splits the pages they share
+    barrier.wait()
+    after = memory_usage()
+    queue.put({k: after[k] - before[k] for k in after})
+    barrier.wait()
+
+
+def measure(model: str, kwargs: dict, processes: int = PROCESSES) -> dict:
+    # spawn, forked children would share the parent's pages copy-on-write
+    context = multiprocessing.get_context('spawn')
+    barrier, queue = context.Barrier(processes), context.Queue()
+    workers = [context.Process(target=_serve, args=(model, kwargs, barrier, queue)) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    usage = [queue.get(timeout=300) for _ in workers]
+    for worker in workers:
+        worker.join()
+    return {k: float(np.mean([x[k] for x in usage])) for k in usage[0]}
+
+
+def run(ctx: dict, quick: bool = False) -> dict:
+    from vinda.api import schemas
+    from vinda.api.utils import memory_usage
+    from vinda.api.worker.celery_tasks import export_cls_model
+
+    if memory_usage() is None:
+        return {}
+    checkpoint = make_checkpoint(os.path.join(ctx['workdir'], f'{MEMORY_MODEL}.ckpt'), model_name=MEMORY_MODEL)
+    results = {}
+    for name, external_data, kwargs in (
+        ('embedded', False, {}),
+        ('external', True, {'share_weights': True}),
+        ('external_optimized', True, {'share_weights': False}),
+    ):
+        save_path = os.path.join(ctx['workdir'], 'memory', name, 'model.onnx')
+        os.makedirs(os.path.dirname(save_path), exist_ok=True)
+        config = schemas.ExportConfig(path_model=checkpoint, path_param='', external_data=external_data)
+        export_cls_model.apply(args=(config.model_dump(), save_path), throw=True)
+        usage = measure(save_path, kwargs)
+        results[f'memory.{name}.pss_mb'] = usage['pss_mb']
+        results[f'memory.{name}.private_mb'] = usage['private_mb']
+    results['memory.weights_mb'] = os.path.getsize(save_path + '.data') / 1024 ** 2
+    return results
@@ -0,0 +1,55 @@
+'''onnxruntime latency and throughput of the exported model over batch sizes and thread counts,
+engine load time and memory from the onnx and the ORT format model, the end-to-end
+OrtClsInfer call used by /infer_cls_engine, and the agreement of its predictions on phone
+photos between full and reduced-resolution JPEG decode.'''
+
+import os
+
+import numpy as np
+
+from PIL import Image
+
+from common import IMG_SIZE, latency_stats, make_photos, measure_ms
+
+
+def run(ctx: dict, quick: bool = False) -> dict:
+    import onnxruntime
+    from vinda.api.onnxinfer import OrtClsInfer
+    from vinda.api.transforms import decode_image
+
+    if not ctx.get('onnx'):
+        import bench_export
+        bench_export.run(ctx, quick=True)
+
+    repeat = 10 if quick else 50
+    results = {}
+    for num_threads in sorted({1, os.cpu_count() or 1}):
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        sess = onnxruntime.InferenceSession(ctx['onnx'], options, providers=['CPUExecutionProvider'])
+        name = sess.get_inputs()[0].name
+        for batch_size in (1, 8, 32):
+            x = np.random.rand(batch_size, 3, IMG_SIZE, IMG_SIZE).astype(np.float32)
+            samples = measure_ms(lambda: sess.run(None, {name: x}), repeat=repeat)
+            prefix = f'ort.threads{num_threads}.bs{batch_size}'
+            results.update(latency_stats(prefix, samples))
+            results[f'{prefix}.images_per_s'] = batch_size * 1000 / results[f'{prefix}.p50_ms']
+
+    for fmt, prefer_ort in (('onnx', False), ('ort', True)):
+        engines = [OrtClsInfer(ctx['onnx'], prefer_ort=prefer_ort) for _ in range(3 if quick else 10)]
+        results[f'ort.load_{fmt}_ms'] = min(x._load_ms for x in engines)
+        if engines[0]._load_peak_mb is not None:
+            results[f'ort.load_{fmt}_peak_mb'] = min(x._load_peak_mb for x in engines)
+        del engines
+
+    engine = OrtClsInfer(ctx['onnx'])
+    image = Image.fromarray(np.random.default_rng(0).integers(0, 255, (480, 640, 3), dtype=np.uint8))
+    results.update(latency_stats('ort.cls_infer', measure_ms(lambda: engine(image, IMG_SIZE), repeat=repeat)))
+    for stage in ('PreProcess', 'Forward', 'PostProcess'):
+        results[f'ort.cls_infer.{stage.lower()}_ms'] = engine._timer[stage].average_time * 1000
+
+    photos = make_photos(os.path.join(ctx['workdir'], 'photos'), count=4 if quick else 8)
+    full, draft = (engine.predict_batch([decode_image(x, IMG_SIZE, d) for x in photos], IMG_SIZE) for d in (False, True))
+    results['ort.draft_decode.top1_mismatch'] = float(np.mean(full.argmax(axis=1) != draft.argmax(axis=1)))
+    results['ort.draft_decode.max_prob_diff'] = float(np.abs(full - draft).max())
+    return results
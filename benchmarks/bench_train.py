@@ -0,0 +1,35 @@
+'''Training speed of the train_cls_model task (eager), broken down by StepProfiler.'''
+
+import os
+import time
+
+from common import IMG_SIZE, MODEL_NAME, make_checkpoint, make_image_dataset
+
+
+def run(ctx: dict, quick: bool = False) -> dict:
+    from vinda.api import schemas
+    from vinda.api.worker.celery_tasks import train_cls_model
+
+    root = make_image_dataset(os.path.join(ctx['workdir'], 'dataset'))
+    config = schemas.TrainingConfig(
+        dataset=root, name_model=MODEL_NAME, img_size=IMG_SIZE, batch_size=16, num_workers=0,
+        pretrain_model=make_checkpoint(os.path.join(ctx['workdir'], 'untrained.ckpt')),
+        epochs=1 if quick else 2, profile=True, profile_skip=3, profile_steps=10 if quick else 25,
+    )
+
+    start = time.perf_counter()
+    result = train_cls_model.apply(args=(config.model_dump(),), throw=True).result
+    task_s = time.perf_counter() - start
+    if 'profile' not in result:
+        raise RuntimeError(f"training failed: {result.get('message')}")
+
+    ctx['checkpoint'] = result['best_model_path']
+    profile = result['profile']
+    results = {
+        'train.task_s': task_s,
+        'train.step_ms': profile['step_time_ms'],
+        'train.steps_per_s': 1000 / profile['step_time_ms'],
+        'train.samples_per_s': config.batch_size * 1000 / profile['step_time_ms'],
+    }
+    results.update({f'train.{k}_ms': v for k, v in profile['phases_ms'].items()})
+    return results
@@ -0,0 +1,173 @@
+import os
+import sys
+import json
+import time
+import statistics
+
+import numpy as np
+
+from PIL import Image
+
+# the entry points (run.py, loadgen.py) import vinda from the checkout, installed or not
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+## architecture used by every suite, small enough for a CPU-only box and built without weights
+MODEL_NAME = 'mobilenetv3_small_050'
+IMG_SIZE = 64
+
+
+def make_image_dataset(root: str, num_classes: int = 4, train_per_class: int = 64, val_per_class: int = 16,
+                       size: int = 96) -> str:
+    '''Synthetic ImageFolder dataset of JPEG noise with a per-class tint, created once per root.'''
+    if os.path.isdir(os.path.join(root, 'train')):
+        return root
+    rng = np.random.default_rng(0)
+    # shared by the splits, so what is learned on train holds on val
+    tints = rng.integers(0, 255, (num_classes, 3))
+    for split, count in (('train', train_per_class), ('val', val_per_class)):
+        for c in range(num_classes):
+            os.makedirs(os.path.join(root, split, f'class_{c}'))
+            for i in range(count):
+                x = (rng.integers(0, 128, (size, size, 3)) + tints[c] // 2).astype(np.uint8)
+                Image.fromarray(x).save(os.path.join(root, split, f'class_{c}', f'{i:05d}.jpg'), quality=90)
+    return root
+
+
+def make_photos(root: str, count: int = 8, size: tuple = (4032, 3024)) -> list[str]:
+    '''Phone-photo sized JPEGs of smooth gradients and sensor-like noise, created once per root.'''
+    paths = [os.path.join(root, f'{i:03d}.jpg') for i in range(count)]
+    if all(os.path.isfile(x) for x in paths):
+        return paths
+    os.makedirs(root, exist_ok=True)
+    rng = np.random.default_rng(0)
+    w, h = size
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    for i, path in enumerate(paths):
+        fx, fy = rng.uniform(100, 600, 2)
+        phase = rng.uniform(0, np.pi, 3).astype(np.float32)
+        x = 128 + 100 * np.sin(xx[..., None] / fx + phase) * np.cos(yy[..., None] / fy)
+        x += 12 * rng.standard_normal((h, w, 3), dtype=np.float32)
+        Image.fromarray(np.clip(x, 0, 255).astype(np.uint8)).save(path, quality=90)
+    return paths
+
+
+def make_checkpoint(path: str, num_classes: int = 4, model_name: str = MODEL_NAME) -> str:
+    '''Untrained SimpleModel checkpoint, the starting point of training so no weights are downloaded.'''
+    if os.path.isfile(path):
+        return path
+    import torch
+    from vinda.api import schemas
+    from vinda.api.trainer import SimpleModel
+
+    model = SimpleModel(
+        solver_config=schemas.SolverConfig(), model_name=model_name, pretrained=False, num_classes=num_classes
+    )
+    torch.save({'state_dict': model.state_dict(), 'hyper_parameters': dict(model.hparams)}, path)
+    return path
+
+
+def measure_ms(fn, warmup: int = 3, repeat: int = 20) -> list[float]:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def latency_stats(prefix: str, samples: list[float]) -> dict:
+    samples = sorted(samples)
+    return {
+        f'{prefix}.p50_ms': statistics.median(samples),
+        f'{prefix}.p95_ms': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+    }
+
+
+def higher_is_better(metric: str) -> bool:
+    # throughputs end in _per_s, everything else is a duration or a size
+    return metric.endswith('_per_s')
+
+
+def gates(metric: str) -> bool:
+    # tail latencies of short runs are too noisy to fail a build on, they are reported only
+    return not metric.endswith('p95_ms')
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[dict]:
+    """Compare metrics with a baseline run.
+
+    Args:
+        results (dict): `{metric: value}` of this run
+        baseline (dict): `{metric: value}` of the baseline run
+        tolerance (float): relative change allowed in the bad direction, e.g. 0.2 for 20%
+
+    Returns:
+        list[dict]: one row per metric found in both runs, with `change` (relative,
+            positive is better) and `regression` (p95 latencies never regress)
+    """
+    rows = []
+    for metric, value in sorted(results.items()):
+        base = baseline.get(metric)
+        if not isinstance(base, (int, float)) or not isinstance(value, (int, float)) or base == 0:
+            continue
+        change = (value - base) / base
+        if not higher_is_better(metric):
+            change = -change
+        rows.append({
+            'metric': metric, 'baseline': base, 'value': value, 'change': change,
+            'regression': gates(metric) and change < -tolerance,
+        })
+    return rows
+
+
+def save_json(path: str, data: dict):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as fp:
+        json.dump(data, fp, indent=4)
+
+
+def install_fake_redis() -> bool:
+    """Point the celery broker and result backend at an in-process fakeredis server,
+    so the api runs its redis code paths (MGET, Lua, priorities) without a server.
+
+    Must run before the celery app creates its clients.
+
+    Returns:
+        bool: False when fakeredis is not installed
+    """
+    try:
+        import fakeredis
+    except ImportError:
+        return False
+    import kombu.transport.redis
+    import celery.backends.redis
+
+    server = fakeredis.FakeServer()
+    kombu.transport.redis.Channel._create_client = lambda self, asynchronous=False: fakeredis.FakeRedis(server=server)
+    celery.backends.redis.RedisBackend._create_client = lambda self, **params: fakeredis.FakeRedis(server=server)
+    return True
+
+
+def setup_environment(workdir: str) -> bool:
+    """Configure vinda for an offline run under `workdir`: OUTDIR, fakeredis (or the
+    in-memory broker and cache backend) and quiet logs. Call before importing vinda.
+
+    Returns:
+        bool: whether fakeredis stands in for redis
+    """
+    os.environ['OUTDIR'] = os.path.join(workdir, 'output')
+    fake_redis = install_fake_redis()
+    os.environ['CELERY_BROKER_URL'] = 'redis://127.0.0.1:6379/0' if fake_redis else 'memory://'
+    os.environ['CELERY_RESULT_BACKEND'] = 'redis://127.0.0.1:6379/1' if fake_redis else 'cache+memory://'
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+    from loguru import logger
+    from vinda.api.worker.celery_app import celery_app
+
+    logger.remove()
+    logger.add(sys.stderr, level=os.environ['LOG_LEVEL'])
+    celery_app.conf.task_always_eager = True
+    return fake_redis
@@ -0,0 +1,279 @@
+'''
+Usage:
+
+python benchmarks/loadgen.py task_state --concurrency 64 --duration 30
+python benchmarks/loadgen.py task_states --qps 200 --duration 60 --out benchmarks/results/poll.json
+python benchmarks/loadgen.py infer_batch --batch 16 --concurrency 4
+python benchmarks/loadgen.py infer --url http://127.0.0.1:8081 --model /data/output/exported/cls_model.onnx \
+    --images /data/output/images --qps 20
+
+Drives the api with concurrent clients and reports throughput, error rate and latency
+percentiles for every `--interval` window and for the whole run.
+
+`--concurrency N` runs N clients that send their next request when the previous one
+returns (closed loop). `--qps R` starts requests on a fixed schedule whether or not
+earlier ones returned (open loop). Latency is then measured from the scheduled start,
+so queueing inside the server is not hidden when it falls behind.
+
+Without `--url` the app runs in this process through httpx's ASGI transport, set up like
+benchmarks/run.py, and shares the event loop and the CPU with the load generator.
+Against a server the scenarios only use files the server can read (`--model`, `--images`).
+'''
+
+import os
+import sys
+import glob
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+
+import numpy as np
+
+from PIL import Image
+
+from common import save_json, setup_environment
+
+
+class Recorder:
+    '''Latencies and errors of finished requests, per reporting window and overall.'''
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.start = self.window_start = time.perf_counter()
+        self.window, self.total = [], []
+        self.window_requests, self.total_requests = 0, 0
+        self.window_errors, self.total_errors = 0, 0
+        self.errors: dict[str, int] = {}
+        self.timeline = []
+
+    def record(self, latency_ms: float | None, error: str | None):
+        '''A finished request, or with no latency a slot that never became one (counted as an error).'''
+        self.window_requests += 1
+        self.total_requests += 1
+        if latency_ms is not None:
+            self.window.append(latency_ms)
+            self.total.append(latency_ms)
+        if error is not None:
+            self.window_errors += 1
+            self.total_errors += 1
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+    @staticmethod
+    def summarize(latencies: list[float], requests: int, errors: int, seconds: float) -> dict:
+        summary = {
+            'requests': requests,
+            'throughput_per_s': len(latencies) / seconds if seconds else 0.,
+            'error_rate': errors / requests if requests else 0.,
+        }
+        if latencies:
+            p = np.percentile(latencies, [50, 90, 95, 99])
+            summary.update({'p50_ms': p[0], 'p90_ms': p[1], 'p95_ms': p[2], 'p99_ms': p[3], 'max_ms': max(latencies)})
+        return summary
+
+    def flush(self, in_flight: int):
+        now = time.perf_counter()
+        summary = self.summarize(self.window, self.window_requests, self.window_errors, now - self.window_start)
+        summary['t'] = round(now - self.start, 1)
+        summary['in_flight'] = in_flight
+        self.timeline.append(summary)
+        self.window, self.window_requests, self.window_errors, self.window_start = [], 0, 0, now
+        print(
+            f"t={summary['t']:6.1f}s rps={summary['throughput_per_s']:8.1f} err={summary['error_rate']:6.2%} "
+            f"p50={summary.get('p50_ms', 0):8.1f}ms p95={summary.get('p95_ms', 0):8.1f}ms "
+            f"p99={summary.get('p99_ms', 0):8.1f}ms in_flight={in_flight}",
+            file=sys.stderr,
+        )
+
+
+async def send(client, request, recorder: Recorder, scheduled: float):
+    error = None
+    try:
+        response = await request(client)
+        if response.status_code >= 400:
+            error = f'http {response.status_code}'
+        elif response.headers.get('content-type', '').startswith('application/json'):
+            body = response.json()
+            # the hand-rolled endpoints report failures in the body with a 200
+            if isinstance(body, dict) and body.get('code', 0) not in (0, 200):
+                error = f"code {body['code']}"
+    except Exception as e:
+        error = type(e).__name__
+    recorder.record((time.perf_counter() - scheduled) * 1000, error)
+
+
+async def closed_loop(client, request, recorder: Recorder, concurrency: int, deadline: float, in_flight: list):
+    async def worker():
+        while time.perf_counter() < deadline:
+            in_flight[0] += 1
+            await send(client, request, recorder, time.perf_counter())
+            in_flight[0] -= 1
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+
+async def open_loop(client, request, recorder: Recorder, qps: float, deadline: float, in_flight: list,
+                    max_in_flight: int):
+    tasks = set()
+    next_start = time.perf_counter()
+    while next_start < deadline:
+        await asyncio.sleep(max(0., next_start - time.perf_counter()))
+        if in_flight[0] >= max_in_flight:
+            # the client is saturated, count the slot as failed instead of queueing without bound;
+            # no latency sample, a 0 would pull the percentiles down when latency is at its worst
+            recorder.record(None, 'client saturated')
+        else:
+            in_flight[0] += 1
+            task = asyncio.create_task(send(client, request, recorder, next_start))
+            task.add_done_callback(lambda t: in_flight.__setitem__(0, in_flight[0] - 1))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        next_start += 1 / qps
+    if tasks:
+        await asyncio.wait(tasks)
+
+
+def make_images(directory: str, count: int = 16) -> list[str]:
+    '''Camera-sized JPEGs, the payloads of the inference scenario.'''
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        h, w = random.Random(i).choice([(480, 640), (720, 1280), (1080, 1920)])
+        base = rng.integers(0, 255, (h // 16, w // 16, 3), dtype=np.uint8)
+        path = os.path.join(directory, f'{i:03d}.jpg')
+        Image.fromarray(base).resize((w, h), Image.BILINEAR).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+async def prepare(args, workdir: str):
+    '''Return the request factory of the scenario, creating what it needs in-process.'''
+    in_process = args.url is None
+    if args.scenario in ('task_state', 'task_states'):
+        task_ids = [f'loadgen-{i:06d}' for i in range(args.tasks)]
+        if in_process:
+            from celery import states
+            from vinda.api.worker.celery_app import celery_app
+
+            for i, task_id in enumerate(task_ids):
+                state = states.SUCCESS if i % 4 else 'PROGRESS'
+                celery_app.backend.store_result(task_id, {'current': i, 'total': args.tasks}, state)
+        if args.scenario == 'task_state':
+            return lambda c: c.get(f'/task_state/{random.choice(task_ids)}')
+        # a dashboard refreshing the tasks on its page
+        return lambda c: c.post('/task_states', json={'task_ids': random.sample(task_ids, min(args.page, len(task_ids)))})
+
+    if args.scenario == 'metrics':
+        return lambda c: c.get('/metrics')
+
+    if args.scenario in ('infer', 'infer_batch'):
+        images = sorted(glob.glob(os.path.join(args.images, '*'))) if args.images else []
+        if not images:
+            if not in_process:
+                raise SystemExit('--images is required against a server')
+            images = make_images(os.path.join(workdir, 'images'))
+        model = args.model
+        if model is None:
+            if not in_process:
+                raise SystemExit('--model is required against a server')
+            import bench_export
+            ctx = {'workdir': workdir}
+            bench_export.run(ctx, quick=True)
+            model = ctx['onnx']
+        if args.scenario == 'infer':
+            return lambda c: c.post('/infer_cls_engine', json={
+                'path_model': model, 'path_image': random.choice(images), 'img_size': args.img_size,
+            })
+        # predictions are returned, so the latency includes the forward pass unlike /infer_cls_engine
+        return lambda c: c.post('/infer_cls_batch', json={
+            'path_model': model, 'path_images': random.choices(images, k=args.batch), 'img_size': args.img_size,
+        })
+
+    raise SystemExit(f'unknown scenario {args.scenario}')
+
+
+async def main_async(args, workdir: str) -> dict:
+    import httpx
+
+    if args.url is None:
+        from vinda.api.app import app
+        await app.router.startup()
+        transport = httpx.ASGITransport(app=app)
+        base_url = 'http://loadgen'
+    else:
+        transport, base_url = None, args.url
+
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, limits=limits, timeout=args.timeout) as client:
+        request = await prepare(args, workdir)
+        # warm up connections, engine loading and caches outside the measured run
+        for _ in range(args.warmup):
+            await request(client)
+
+        recorder = Recorder(args.interval)
+        in_flight = [0]
+        deadline = time.perf_counter() + args.duration
+
+        async def reporter():
+            while True:
+                await asyncio.sleep(args.interval)
+                recorder.flush(in_flight[0])
+
+        report_task = asyncio.create_task(reporter())
+        if args.qps:
+            await open_loop(client, request, recorder, args.qps, deadline, in_flight, args.max_in_flight)
+        else:
+            await closed_loop(client, request, recorder, args.concurrency, deadline, in_flight)
+        report_task.cancel()
+        if recorder.window_requests:
+            # the partial window since the last report
+            recorder.flush(in_flight[0])
+        elapsed = time.perf_counter() - recorder.start
+
+    summary = Recorder.summarize(recorder.total, recorder.total_requests, recorder.total_errors, elapsed)
+    summary['errors'] = recorder.errors
+    return {
+        'scenario': args.scenario,
+        'target': args.url or 'in-process',
+        'mode': {'qps': args.qps} if args.qps else {'concurrency': args.concurrency},
+        'duration_s': elapsed,
+        'summary': summary,
+        'timeline': recorder.timeline,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='http load generator for the vinda api')
+    parser.add_argument('scenario', choices=['task_state', 'task_states', 'infer', 'infer_batch', 'metrics'])
+    parser.add_argument('--url', default=None, help='server to load, e.g. http://127.0.0.1:8081; in-process when omitted')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--concurrency', type=int, default=16, help='closed loop: clients in parallel')
+    mode.add_argument('--qps', type=float, default=0., help='open loop: requests started per second')
+    parser.add_argument('--duration', type=float, default=20., help='seconds of measured load')
+    parser.add_argument('--warmup', type=int, default=5, help='requests sent before measuring')
+    parser.add_argument('--interval', type=float, default=2., help='seconds per timeline window')
+    parser.add_argument('--max-in-flight', type=int, default=512, help='open loop: connection pool and in-flight cap')
+    parser.add_argument('--timeout', type=float, default=30.)
+    parser.add_argument('--tasks', type=int, default=1000, help='task ids polled by the task_state scenarios')
+    parser.add_argument('--page', type=int, default=50, help='task ids per /task_states request')
+    parser.add_argument('--model', default=None, help='onnx model for the infer scenario')
+    parser.add_argument('--images', default=None, help='directory of images for the infer scenario')
+    parser.add_argument('--img-size', type=int, default=224)
+    parser.add_argument('--batch', type=int, default=8, help='images per request of the infer_batch scenario')
+    parser.add_argument('--out', default=None, help='write the report as json')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='vinda-loadgen-')
+    if args.url is None:
+        setup_environment(workdir)
+    report = asyncio.run(main_async(args, workdir))
+    print(json.dumps(report['summary'], indent=4))
+    if args.out:
+        save_json(args.out, report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+'''
+Usage:
+
+python benchmarks/run.py --out benchmarks/results/latest.json
+python benchmarks/run.py --suites data,ort --quick --baseline benchmarks/baseline.json
+python benchmarks/run.py --save-baseline benchmarks/baseline.json
+
+Runs offline on a CPU-only box: synthetic datasets, a small timm architecture without
+pretrained weights, celery tasks called eagerly and fakeredis (when installed) in place
+of the redis broker and result backend. Everything is written to a temporary OUTDIR.
+
+Results are a flat `{metric: value}` map. Metrics ending in `_per_s` are throughputs,
+the others durations or sizes. With `--baseline` every metric that got worse by more than
+`--tolerance` is reported and the exit code is 1. Baselines are per machine: record one
+on the box (or CI runner class) that runs the comparison.
+'''
+
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import importlib
+import subprocess
+
+from common import compare, save_json, setup_environment
+
+
+SUITES = ('data', 'train', 'export', 'ort', 'memory', 'api')
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='training, export, inference and api benchmarks')
+    parser.add_argument('--suites', default=','.join(SUITES), help=f"comma separated, of {','.join(SUITES)}")
+    parser.add_argument('--out', default='benchmarks/results/latest.json')
+    parser.add_argument('--baseline', default=None, help='results file to compare with')
+    parser.add_argument('--save-baseline', default=None, help='also write the results as a new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression')
+    parser.add_argument('--quick', action='store_true', help='fewer repetitions, for smoke tests')
+    parser.add_argument('--threads', type=int, default=0, help='torch threads, 0 keeps the default')
+    args = parser.parse_args()
+
+    suites = [x for x in args.suites.split(',') if x]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f'unknown suites: {sorted(unknown)}')
+
+    workdir = tempfile.mkdtemp(prefix='vinda-bench-')
+    fake_redis = setup_environment(workdir)
+
+    import torch
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    ctx = {'workdir': workdir}
+    results, timings = {}, {}
+    try:
+        for name in suites:
+            start = time.perf_counter()
+            results.update(importlib.import_module(f'bench_{name}').run(ctx, quick=args.quick))
+            timings[name] = time.perf_counter() - start
+            print(f'{name}: {timings[name]:.1f}s', file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    import onnxruntime
+    from vinda.api.catalog import host_info
+    report = {
+        'meta': {
+            'timestamp': time.time(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'onnxruntime': onnxruntime.__version__,
+            'torch_threads': torch.get_num_threads(),
+            'broker': 'fakeredis' if fake_redis else 'memory',
+            'quick': args.quick,
+            'suite_seconds': timings,
+            'host': host_info(),
+        },
+        'results': results,
+    }
+    save_json(args.out, report)
+    if args.save_baseline:
+        save_json(args.save_baseline, report)
+
+    for metric, value in sorted(results.items()):
+        print(f'{metric:<48} {value:12.3f}')
+
+    if args.baseline:
+        with open(args.baseline, 'r') as fp:
+            baseline = json.load(fp)
+        rows = compare(results, baseline['results'], args.tolerance)
+        report['comparison'] = {'baseline': args.baseline, 'tolerance': args.tolerance, 'metrics': rows}
+        save_json(args.out, report)
+
+        print(f"\ncompared with {args.baseline} ({baseline['meta'].get('commit', '')[:10]})")
+        for row in rows:
+            flag = 'REGRESSION' if row['regression'] else ''
+            print(f"{row['metric']:<48} {row['baseline']:12.3f} -> {row['value']:12.3f} {row['change']:+8.1%} {flag}")
+        regressions = [x['metric'] for x in rows if x['regression']]
+        if regressions:
+            print(f'FAIL: {len(regressions)} metrics regressed by more than {args.tolerance:.0%}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
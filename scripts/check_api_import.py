@@ -0,0 +1,57 @@
+'''
+Usage:
+
+python scripts/check_api_import.py --max-seconds 2.5 --max-rss-mb 300
+
+Imports `vinda.api.app` in a fresh interpreter and fails when the training stack
+is loaded or the import time / peak RSS goes over budget. Run it in CI next to
+the api image build.
+'''
+
+import sys
+import json
+import argparse
+import subprocess
+
+
+# training and export dependencies, only the worker may import them
+FORBIDDEN = ('torch', 'torchvision', 'timm', 'pytorch_lightning', 'lightning', 'torchmetrics')
+
+PROBE = '''
+import sys, time, json, resource
+start = time.perf_counter()
+import vinda.api.app
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    'seconds': elapsed,
+    'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'loaded': [m for m in %r if m in sys.modules],
+}))
+''' % (FORBIDDEN,)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='import-time and memory budget of the api process')
+    parser.add_argument('--max-seconds', type=float, default=2.5)
+    parser.add_argument('--max-rss-mb', type=float, default=300)
+    args = parser.parse_args()
+
+    out = subprocess.run([sys.executable, '-c', PROBE], capture_output=True, text=True, check=True)
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    print(json.dumps(result, indent=4))
+
+    errors = []
+    if result['loaded']:
+        errors.append(f"heavy modules imported by the api: {result['loaded']}")
+    if result['seconds'] > args.max_seconds:
+        errors.append(f"import took {result['seconds']:.2f}s > {args.max_seconds}s")
+    if result['rss_mb'] > args.max_rss_mb:
+        errors.append(f"peak rss {result['rss_mb']:.0f}MB > {args.max_rss_mb}MB")
+
+    for error in errors:
+        print(f'FAIL: {error}')
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,32 @@
+'''
+Usage:
 
+python scripts/get_tiny_image_net.py [output] [--format packed]
 
-# url: https://cs231n.stanford.edu/tiny-imagenet-200.zip
+Downloads Tiny ImageNet next to the output directory, then runs
+`vinda ingest tinyimagenet` on it.
+'''
 
+import os
+import sys
+import zipfile
+import urllib.request
 
+from vinda.cli import main
+
+
+URL = 'https://cs231n.stanford.edu/tiny-imagenet-200.zip'
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:] or ['../data/tiny-imagenet']
+    out, options = args[0], args[1:]
+    archive = os.path.join(os.path.dirname(os.path.abspath(out)), 'tiny-imagenet-200.zip')
+    if not os.path.isfile(archive):
+        urllib.request.urlretrieve(URL, archive + '.tmp')
+        os.replace(archive + '.tmp', archive)
+    src = os.path.splitext(archive)[0]
+    if not os.path.isdir(src):
+        with zipfile.ZipFile(archive) as zip_ref:
+            zip_ref.extractall(os.path.dirname(src))
+    main(['ingest', 'tinyimagenet', src, out] + options)
@@ -1,2 +1,5 @@
 cd ..
-celery -A vinda.api.worker.celery_tasks worker -E --pool=solo --loglevel=info --logfile=/tmp/celery.log
\ No newline at end of file
+# training: one task per process, admission packs several train workers per node by resources
+celery -A vinda.api.worker.celery_tasks worker -E -Q train --pool=solo -n train@%h --loglevel=info --logfile=/tmp/celery.log &
+# short jobs: exports, benchmarks and dataset processing, never queued behind training
+celery -A vinda.api.worker.celery_tasks worker -E -Q export,inference,dataset,celery --pool=threads --concurrency=4 -n light@%h --loglevel=info --logfile=/tmp/celery-light.log
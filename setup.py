@@ -173,6 +173,7 @@ if __name__ == "__main__":
             entry_points={
                 'console_scripts': [
                     # 'vinda=uvicorn vinda.api.app:app'
+                    'vinda=vinda.cli:main',
                 ],
                 # 'celery.commands': [
                 #     'flower = flower.command.FlowerCommand',
@@ -1,77 +1,32 @@
-import requests
 import streamlit as st
 from tempfile import NamedTemporaryFile
 from loguru import logger
 import traceback
-from pydantic import BaseModel, Field
-from typing import Union, Optional, Dict, List
 import json
 
-from streamlit_autorefresh import st_autorefresh
-
 import streamlit.components.v1 as components
 
+from vinda.api.schemas import TrainingConfig
+from vinda.client.sync import Client
+
 
 api_url = 'http://127.0.0.1:8081'
 tb_url = 'http://139.9.129.3:8062'
 
 
-class SolverConfig(BaseModel):
-    opt: str = Field('adam', description="优化器类型，可以是 'adam' 或 'sgd'")
-    weight_decay: float = Field(0.0001, description="正则化权重衰减")
-    momentum: float = Field(0.9, description="SGD优化器的动量")
-    base_lr: float = Field(0.001, description="基础学习率")
-    lr_scheduler: str = Field('step', description="学习率调度器类型，可以是'step'、'multistep'、'reduce_on_plateau'")
-    lr_decay_rate: float = Field(0.1, description="学习率衰减率")
-    lr_step_size: int = Field(5, description="步进学习率调度器的步长", gt=0)
-    lr_step_milestones: list = Field([10, 15], description="多步学习率调度器的里程碑")
-
-    def __init__(self, **data):
-        super().__init__(**data)
-        # 验证动量参数是否仅在使用'sgd'优化器时设置
-        if self.opt != 'sgd' and self.momentum != 0.9:
-            raise ValueError("Momentum should only be used when optimizer is set to 'sgd'")
-
-        # 验证学习率调度器设置
-        if self.lr_scheduler == 'step' and self.lr_step_size <= 0:
-            raise ValueError("Step size for step learning rate scheduler must be greater than 0")
-        elif self.lr_scheduler == 'multistep' and not self.lr_step_milestones:
-            raise ValueError("Milestones must be provided for multistep learning rate scheduler")
-        
-
-class TrainingConfig(BaseModel):
-    dataset: str = Field(..., description='数据集名称')
-    name_model: str = Field('hf_hub:timm/mobilenetv4_conv_small.e2400_r224_in1k', description='模型名称')
-    pretrain_model: str = Field('', description='预训练模型')
-    img_size: int = Field(224, description='输入网络的图像尺寸（自动resize）')
-    epochs: int = Field(100, description='训练周期数')
-    save_interval: int = Field(1, description='保存模型的间隔（按周期计算）')
-    batch_size: int = Field(8, description='每批处理的样本数量')
-    num_workers: int = Field(0, description='工作进程数')
-    # gpu_ids: Optional[list] = Field(default=None, description='使用的GPU编号列表')
-    n_gpu: Optional[int] = Field(default=None, description='使用的GPU数量')
-    seed: int = Field(42, description='随机种子，用于结果的可复现性')
-    solver: SolverConfig = Field(default_factory=SolverConfig, description='训练过程中使用的优化器配置')
-
-    # # 你需要在初始化时手动检查 gpu_ids 和 n_gpu 的互斥性。
-    # def __init__(self, **data):
-    #     super().__init__(**data)
-    #     if self.gpu_ids is not None and self.n_gpu is not None:
-    #         raise ValueError("Only one of 'gpu_ids' or 'n_gpu' should be set.")
-
-    #     if 'solver' not in data:
-    #         self.solver = SolverConfig()
+@st.cache_resource
+def get_client() -> Client:
+    # one pooled client for every session and rerun, so calls reuse keep-alive connections
+    return Client(api_url)
 
 
 @st.cache_data
 def list_trained_models():
     ret = []
     try:
-        response = requests.get(api_url + '//list_trained_models')
-        data : dict = response.json()['data']
-        for v in data.values():
-            for ckpt in v['checkpoints']:
-                ret.append(ckpt)
+        data = get_client().list_trained_models(page_size=1000)
+        for ckpt in data['checkpoints']:
+            ret.append(ckpt['path'])
 
     except Exception as e:
         logger.error(traceback.format_exc())
@@ -87,8 +42,7 @@ def list_models():
         "models_available": []
     }
     try:
-        response = requests.get(api_url + '/list_models')
-        data = response.json()['data']
+        data = get_client().list_models()
         ret['models_supported'] = data['models_supported']
         ret['models_available'] = data['models_available']
     except Exception as e:
@@ -101,9 +55,7 @@ def list_models():
 def list_datasets():
     ret = []
     try:
-        response = requests.get(api_url + '/list_datasets')
-        data = response.json()['data']
-        ret = data['datasets']
+        ret = get_client().list_datasets()
     except Exception as e:
         logger.error(traceback.format_exc())
 
@@ -184,10 +136,9 @@ with st.sidebar:
         )
         uploaded_file = st.file_uploader("选择一个文件", type=["zip"])
         if uploaded_file is not None:
-            response = requests.post(
-                api_url + '/upload_datasets', 
-                files={'file': (uploaded_file.name, uploaded_file, uploaded_file.type)}
-            )
+            task = get_client().upload_fileobj(uploaded_file, uploaded_file.name)
+            with st.spinner('extracting...'):
+                get_client().wait_task(task['task_id'])
             st.session_state['dataset'] = list_datasets()
     
     train_config.dataset = st.selectbox(
@@ -206,34 +157,29 @@ with st.sidebar:
 
         # st.write(f'## {train_config.model_dump()}')
         td = json.dumps(train_config.model_dump(), indent=4)
-        response = requests.post(
-            api_url + '/train_cls_model',
-            data=td
-        )
+        task = get_client().train(train_config)
         st.write('### train config')
         st.code(td)
         st.write('### train response')
-        response_json = response.json()
-        st.code(json.dumps(response_json, indent=4))
+        st.code(json.dumps(task, indent=4))
         st.session_state['training'] = True
-        st.session_state['training_task_id'] = response_json['data']['task_id']
+        st.session_state['training_task_id'] = task['task_id']
 
 
-count = st_autorefresh()
-
 st.info(f"### best_model_path: {st.session_state['training_best_model']}")
 
 if st.session_state['training'] and 'training_task_id' in st.session_state:
-    response = requests.get(
-        api_url + f"/task_state/{st.session_state['training_task_id']}",
-    )
-    ret = response.json()
-
-    if ret['code'] == 0 and ret['data']['task_result'] != None:
-        results = ret['data']['task_result']
+    # the click reruns the script, the loop below then follows the task until it is cancelled
+    if st.button('CANCEL'):
+        get_client().cancel_task(st.session_state['training_task_id'])
+    progress = st.empty()
+    for state in get_client().follow_task(st.session_state['training_task_id']):
+        results = state['task_result']
+        if results is None:
+            continue
 
         if 'stage' in results:
-            with st.container():
+            with progress.container():
                 max_epochs = results['max_epochs']
                 num_batches = results['num_batches']
                 current_epoch = results['current_epoch']
@@ -248,7 +194,9 @@ if st.session_state['training'] and 'training_task_id' in st.session_state:
     
         elif 'best_model_path' in results:
             st.session_state['training_best_model'] = results['best_model_path']
-            st.session_state['training'] = False
+
+    st.session_state['training'] = False
+    st.rerun()
 
 
 style = """
@@ -0,0 +1,239 @@
+import io
+import os
+import json
+import time
+import hashlib
+import multiprocessing
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable
+
+from PIL import Image
+from loguru import logger
+
+from vinda.api.config import cfg
+
+
+## the extensions torchvision's ImageFolder loads, other files are ignored by training
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.ppm', '.bmp', '.pgm', '.tif', '.tiff', '.webp')
+
+_DCT_SIZE = 32
+_DCT = np.sqrt(2 / _DCT_SIZE) * np.cos(
+    np.pi * (2 * np.arange(_DCT_SIZE)[None, :] + 1) * np.arange(_DCT_SIZE)[:, None] / (2 * _DCT_SIZE)
+)
+_DCT[0] /= np.sqrt(2)
+
+## hashes compared at once in a near-duplicate bucket, bounds the memory of the distance matrix
+_BLOCK = 256
+
+
+def stats_path(root: str) -> str:
+    return os.path.join(root, '.vinda', 'stats.json')
+
+
+def load_stats(root: str) -> dict | None:
+    path = stats_path(root)
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r') as fp:
+        return json.load(fp)
+
+
+def phash(img: Image.Image) -> int:
+    '''64-bit perceptual hash: signs of the 8x8 low-frequency DCT of a 32x32 grayscale image.'''
+    x = np.asarray(img.convert('L').resize((_DCT_SIZE, _DCT_SIZE), Image.BILINEAR), dtype=np.float32)
+    low = (_DCT @ x @ _DCT.T)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def _scan_file(root: str, relpath: str) -> dict:
+    path = os.path.join(root, relpath)
+    with open(path, 'rb') as fp:
+        content = fp.read()
+    entry = {'path': relpath, 'bytes': len(content), 'sha1': hashlib.sha1(content).hexdigest()}
+    try:
+        # decoded from the bytes already read for the checksum, each file is read once
+        with Image.open(io.BytesIO(content)) as img:
+            # verify() only checks the container, load() decodes and catches truncated files
+            img.load()
+            entry['width'], entry['height'] = img.size
+            img = img.convert('RGB')
+            entry['phash'] = phash(img)
+            img.thumbnail((128, 128))
+            x = np.asarray(img, dtype=np.float64).reshape(-1, 3) / 255.0
+            entry['pixels'] = len(x)
+            entry['sum'] = x.sum(axis=0).tolist()
+            entry['sum_sq'] = (x ** 2).sum(axis=0).tolist()
+    except Exception as e:
+        entry['error'] = f'{type(e).__name__}: {e}'
+    return entry
+
+
+def _scan_chunk(root: str, relpaths: list[str]) -> list[dict]:
+    return [_scan_file(root, x) for x in relpaths]
+
+
+def list_images(root: str) -> list[str]:
+    images = []
+    for split in ('train', 'val'):
+        for dirpath, _, filenames in os.walk(os.path.join(root, split)):
+            for filename in filenames:
+                if filename.lower().endswith(IMG_EXTENSIONS):
+                    images.append(os.path.relpath(os.path.join(dirpath, filename), root).replace(os.sep, '/'))
+    return sorted(images)
+
+
+def _popcount(x: np.ndarray) -> np.ndarray:
+    '''Set bits of each uint64 (SWAR), np.bitwise_count needs numpy >= 2.'''
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(x)
+    x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0f0f0f0f0f0f0f0f)
+    return (x * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+
+def near_duplicates(hashes: dict[str, int], max_distance: int) -> list[list[str]]:
+    """Group images whose perceptual hashes differ by at most `max_distance` bits.
+
+    Candidates are found by bucketing on `max_distance + 1` bands of the hash: two hashes
+    at most `max_distance` bits apart agree on at least one band (pigeonhole), so every
+    such pair is compared without an all-pairs scan. Buckets hold about N / 2^(64 / bands)
+    hashes, buckets over `cfg.datasets.max_hash_bucket` are skipped with a warning.
+    """
+    parent = {x: x for x in hashes}
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    # identical hashes are grouped directly, only distinct values are compared
+    by_hash = {}
+    for path, h in hashes.items():
+        if h in by_hash:
+            parent[find(path)] = find(by_hash[h])
+        else:
+            by_hash[h] = path
+
+    paths = list(by_hash.values())
+    values = np.fromiter(by_hash, dtype=np.uint64, count=len(by_hash))
+    # at distance 0 only identical hashes match, grouped above
+    num_bands = max_distance + 1 if max_distance else 0
+    skipped = 0
+    for band in range(num_bands):
+        lo, hi = 64 * band // num_bands, 64 * (band + 1) // num_bands
+        keys = (values >> np.uint64(lo)) & np.uint64((1 << (hi - lo)) - 1)
+        order = np.argsort(keys, kind='stable')
+        for bucket in np.split(order, np.flatnonzero(np.diff(keys[order])) + 1):
+            if len(bucket) < 2:
+                continue
+            if len(bucket) > cfg.datasets.max_hash_bucket:
+                skipped += 1
+                continue
+            bucket_values = values[bucket]
+            for i in range(0, len(bucket), _BLOCK):
+                # each hash of the block against itself and the later ones of the bucket
+                distances = _popcount(bucket_values[i:i + _BLOCK, None] ^ bucket_values[None, i:])
+                for row, col in zip(*np.nonzero(distances <= max_distance)):
+                    if col > row:
+                        parent[find(paths[bucket[i + row]])] = find(paths[bucket[i + col]])
+    if skipped:
+        logger.warning(
+            f'{skipped} near-duplicate buckets over {cfg.datasets.max_hash_bucket} hashes were not compared, '
+            f'some near-duplicates may be missed; lower max_distance to use narrower buckets'
+        )
+
+    groups = {}
+    for path in hashes:
+        groups.setdefault(find(path), []).append(path)
+    return sorted(sorted(x) for x in groups.values() if len(x) > 1)
+
+
+def _distribution(values: list[int]) -> dict:
+    if not values:
+        return {}
+    p = np.percentile(values, [0, 5, 50, 95, 100])
+    return {'min': int(p[0]), 'p5': float(p[1]), 'p50': float(p[2]), 'p95': float(p[3]), 'max': int(p[4]),
+            'mean': float(np.mean(values))}
+
+
+def analyze_dataset(
+    root: str,
+    num_workers: int = 0,
+    max_distance: int = 4,
+    progress: Callable[[int, int], None] | None = None,
+) -> dict:
+    """Scan every image of a dataset in parallel and store the report in `<root>/.vinda/stats.json`.
+
+    Args:
+        root (str): dataset with `train/` and `val/`
+        num_workers (int): scanning processes, 0 uses cfg.datasets.analyze_workers
+        max_distance (int): perceptual hash distance (bits) under which images are near-duplicates
+        progress (Callable[[int, int], None] | None): called with (done, total) files
+
+    Returns:
+        dict: corrupt files, duplicates, class counts, size distributions and the
+            per-channel mean/std of the train split
+    """
+    relpaths = list_images(root)
+    num_workers = num_workers or cfg.datasets.analyze_workers
+    chunk_size = max(1, min(256, len(relpaths) // (num_workers * 4) or 1))
+    chunks = [relpaths[i:i + chunk_size] for i in range(0, len(relpaths), chunk_size)]
+
+    # daemonic processes (e.g. a prefork celery child) cannot fork a pool
+    executor_cls = ThreadPoolExecutor if multiprocessing.current_process().daemon else ProcessPoolExecutor
+    entries = []
+    with executor_cls(max_workers=num_workers) as executor:
+        for result in executor.map(_scan_chunk, [root] * len(chunks), chunks):
+            entries.extend(result)
+            if progress is not None:
+                progress(len(entries), len(relpaths))
+
+    corrupt = [{'path': x['path'], 'error': x['error']} for x in entries if 'error' in x]
+    valid = [x for x in entries if 'error' not in x]
+
+    by_sha1 = {}
+    for x in valid:
+        by_sha1.setdefault(x['sha1'], []).append(x['path'])
+    exact = sorted(x for x in by_sha1.values() if len(x) > 1)
+    # one representative per exact duplicate group
+    first = {x[0] for x in by_sha1.values()}
+    hashes = {x['path']: x['phash'] for x in valid if x['path'] in first}
+
+    classes = {}
+    for x in entries:
+        split, cls = x['path'].split('/')[:2]
+        classes.setdefault(split, {}).setdefault(cls, 0)
+        classes[split][cls] += 1
+
+    train = [x for x in valid if x['path'].startswith('train/')]
+    pixels = sum(x['pixels'] for x in train)
+    mean = np.sum([x['sum'] for x in train], axis=0) / max(pixels, 1)
+    std = np.sqrt(np.sum([x['sum_sq'] for x in train], axis=0) / max(pixels, 1) - mean ** 2)
+
+    stats = {
+        'created_at': time.time(),
+        'num_files': len(entries),
+        'classes': classes,
+        'corrupt': corrupt,
+        'exact_duplicates': exact,
+        'near_duplicates': near_duplicates(hashes, max_distance),
+        'width': _distribution([x['width'] for x in valid]),
+        'height': _distribution([x['height'] for x in valid]),
+        'bytes': _distribution([x['bytes'] for x in entries]),
+        'mean': mean.tolist() if train else None,
+        'std': std.tolist() if train else None,
+    }
+
+    path = stats_path(root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as fp:
+        json.dump(stats, fp)
+    os.replace(tmp, path)
+    return stats
@@ -2,24 +2,44 @@
 import os
 import time
 import uvicorn
-import timm
+import contextlib
+import threading
 
 from vinda.api.config import cfg
-from vinda.api.onnxinfer import OnnxGlobalInfer, OrtClsInfer
-from fastapi import Depends, FastAPI, BackgroundTasks, File, UploadFile
+from vinda.api.onnxinfer import OnnxGlobalInfer, OrtClsInfer, external_data_path, ort_model_path
+from vinda.api.executor import InferenceExecutor
+from fastapi import Depends, FastAPI, BackgroundTasks, File, UploadFile, Request, Response, Query, HTTPException
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.cors import CORSMiddleware
 from vinda.api import schemas
+from vinda.api import db
+from vinda.api import datasets
+from vinda.api.analysis import load_stats
+from vinda.api.events import TERMINAL_STATES, TaskEventHub, get_task_states, summarize, to_sse
 from vinda.api.worker.celery_app import celery_app
-from vinda.api.worker import celery_tasks as tasks
-from celery.result import AsyncResult
+from vinda.api.worker.control import DEFAULT_PRIORITY, request_cancel, to_broker_priority
 from typing import Optional, Tuple
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from loguru import logger
 from traceback import format_exception
 from vinda.api.pattern import response_handle
-from PIL import Image
+from vinda.api.middleware import TimingMiddleware, snapshot
+from vinda.api.catalog import LatencyCatalog, ModelCatalog
+from vinda.api.transforms import decode_image
 
-import zipfile
+
+def send_task(name: str, *args, priority: int = DEFAULT_PRIORITY):
+    # by name, so the api never imports the training stack behind celery_tasks;
+    # send_task skips task_default_priority, and redis would run unprioritized messages first
+    return celery_app.send_task(
+        f'vinda.api.worker.celery_tasks.{name}', args=args, priority=to_broker_priority(priority)
+    )
+
+
+## guards the InferenceExecutor of /infer_cls_batch, created on the first request for a model,
+## and the number of requests using each executor
+_executor_lock = threading.Lock()
+_executor_users: dict[InferenceExecutor, int] = {}
 
 
 # fix windows platform
@@ -42,12 +62,43 @@ app.add_middleware(
 )
 
 
+app.add_middleware(TimingMiddleware)
+
+
+@app.on_event("startup")
+async def init_registry():
+    await run_in_threadpool(db.init_db)
+    await run_in_threadpool(db.backfill)
+
+
+def _retire_executor(executor: InferenceExecutor):
+    # under _executor_lock: an executor no longer current closes once its last request is done
+    if executor is not None and executor is not OnnxGlobalInfer().cls_executor and not _executor_users.get(executor):
+        _executor_users.pop(executor, None)
+        executor.close()
+
+
+def _close_executor():
+    with _executor_lock:
+        executor, OnnxGlobalInfer().cls_executor = OnnxGlobalInfer().cls_executor, None
+        _retire_executor(executor)
+
+
+@app.on_event("shutdown")
+async def stop_executor():
+    await run_in_threadpool(_close_executor)
+
+
+latency_catalog = LatencyCatalog()
+timm_catalog = ModelCatalog()
+
+
 @app.post("/train_cls_model", status_code=201)
 async def train_cls_model(training_config: schemas.TrainingConfig, background_task: BackgroundTasks) -> Optional[dict]:
     ret = {'code': 0, 'message': 'OK'}
 
     try:
-        task = tasks.train_cls_model.apply_async(args=(training_config.model_dump(),))
+        task = send_task('train_cls_model', training_config.model_dump(), priority=training_config.priority)
         ret['data'] = {"task_state": task.state, "task_id": task.task_id}
     except Exception as e:
         error = {'code': -1, 'message': str(e), 'traceback': format_exception(e)}
@@ -58,15 +109,92 @@ async def train_cls_model(training_config: schemas.TrainingConfig, background_ta
         return ret
 
 
+def _start_extraction(upload: dict) -> dict:
+    task = send_task('extract_dataset', upload['path'], upload['name'], upload['filename'])
+    return {"task_state": task.state, "task_id": task.task_id}
+
+
+async def _iter_upload(file: UploadFile):
+    while contents := await file.read(1024 * 1024):
+        yield contents
+
+
 @app.post("/upload_datasets")
 @response_handle
-async def upload_datasets(file: UploadFile = File(...)) -> Optional[dict]:
-    zip_file = os.path.join(cfg.trainer.output, 'datasets', file.filename)
-    with open(zip_file, 'wb') as f:
-        while contents := await file.read(1024 * 1024):
-            f.write(contents)
-    with zipfile.ZipFile(zip_file, 'r') as zip_ref:
-        zip_ref.extractall(os.path.join(cfg.trainer.output, 'datasets'))
+async def upload_datasets(file: UploadFile = File(...), name: str = '') -> Optional[dict]:
+    upload = datasets.create_upload(file.filename, file.size, name)
+    await datasets.append_upload(upload['upload_id'], 0, _iter_upload(file))
+    upload = await run_in_threadpool(datasets.finish_upload, upload['upload_id'])
+    return _start_extraction(upload)
+
+
+@app.post("/uploads", status_code=201)
+@response_handle
+async def create_upload(upload_config: schemas.UploadConfig) -> Optional[dict]:
+    return datasets.create_upload(upload_config.filename, upload_config.size, upload_config.name)
+
+
+@app.put("/uploads/{upload_id}")
+@response_handle
+async def upload_chunk(upload_id: str, request: Request, offset: int = 0) -> Optional[dict]:
+    upload = await datasets.append_upload(upload_id, offset, request.stream())
+    return {'upload_id': upload_id, 'offset': upload['offset'], 'size': upload['size']}
+
+
+@app.get("/uploads/{upload_id}")
+@response_handle
+async def get_upload(upload_id: str) -> Optional[dict]:
+    upload = datasets.upload_state(upload_id)
+    return {'upload_id': upload_id, 'offset': upload['offset'], 'size': upload['size']}
+
+
+@app.post("/uploads/{upload_id}/complete", status_code=201)
+@response_handle
+async def complete_upload(upload_id: str) -> Optional[dict]:
+    upload = await run_in_threadpool(datasets.finish_upload, upload_id)
+    return _start_extraction(upload)
+
+
+@app.post("/datasets/{name}/sync", status_code=201)
+@response_handle
+async def plan_dataset_sync(name: str, sync_config: schemas.SyncConfig) -> Optional[dict]:
+    files = [x.model_dump() for x in sync_config.files]
+    return await run_in_threadpool(datasets.plan_sync, name, files, sync_config.delete)
+
+
+@app.put("/datasets/sync/{sync_id}")
+@response_handle
+async def put_dataset_file(sync_id: str, path: str, request: Request) -> Optional[dict]:
+    return await datasets.put_sync_file(sync_id, path, request.stream())
+
+
+@app.post("/datasets/sync/{sync_id}/commit")
+@response_handle
+async def commit_dataset_sync(sync_id: str) -> Optional[dict]:
+    return await run_in_threadpool(datasets.commit_sync, sync_id)
+
+
+@app.post("/store/gc", status_code=201)
+@response_handle
+async def gc_store(dry_run: bool = False) -> Optional[dict]:
+    task = send_task('gc_store', dry_run)
+    return {"task_state": task.state, "task_id": task.task_id}
+
+
+@app.post("/analyze_dataset", status_code=201)
+@response_handle
+async def analyze_dataset(analyze_config: schemas.AnalyzeConfig) -> Optional[dict]:
+    task = send_task('analyze_dataset', analyze_config.model_dump())
+    return {"task_state": task.state, "task_id": task.task_id}
+
+
+@app.get("/dataset_stats")
+@response_handle
+async def dataset_stats(dataset: str) -> Optional[dict]:
+    stats = await run_in_threadpool(load_stats, dataset)
+    if stats is None:
+        raise FileNotFoundError(f'no stats for {dataset}, run /analyze_dataset first')
+    return stats
 
 
 @app.get("/list_datasets")
@@ -74,33 +202,56 @@ async def upload_datasets(file: UploadFile = File(...)) -> Optional[dict]:
 async def list_datasets() -> Optional[dict]:
     path = os.path.join(cfg.trainer.output, 'datasets')
     datasets = [os.path.join(cfg.trainer.output, 'datasets', x) for x in os.listdir(path)]
-    return {'datasets': [x for x in datasets if os.path.isdir(x)]}
+    return {'datasets': [x for x in datasets if os.path.isdir(x) and not os.path.basename(x).startswith('.')]}
 
 
 @app.get("/list_models")
 @response_handle
-async def list_models() -> Optional[dict]:
-    return {
-        "models_supported": os.listdir('/root/.cache/huggingface/hub/'),
-        "models_available": timm.list_models()
-    }
+async def list_models(
+    request: Request,
+    response: Response,
+    pattern: str = '*',
+    pretrained: bool = False,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(0, ge=0),
+) -> Optional[dict]:
+    etag = await run_in_threadpool(timm_catalog.etag, pattern, pretrained, page, page_size)
+    if etag in request.headers.get('if-none-match', '').replace('W/', '').split(', '):
+        return Response(status_code=304, headers={'ETag': etag})
+    response.headers['ETag'] = etag
+    return timm_catalog.query(pattern, pretrained, page, page_size)
+
+
+@app.get("/model_catalog")
+@response_handle
+async def model_catalog(
+    img_size: int = 224,
+    batch_size: int = 1,
+    backend: str = 'ort',
+    max_latency_ms: Optional[float] = None,
+    sort_by: str = 'latency',
+) -> Optional[dict]:
+    return {'models': latency_catalog.query(img_size, batch_size, backend, max_latency_ms, sort_by)}
+
+
+@app.post("/benchmark_models", status_code=201)
+@response_handle
+async def benchmark_models(benchmark_config: schemas.BenchmarkConfig) -> Optional[dict]:
+    task = send_task('benchmark_models', benchmark_config.model_dump())
+    return {"task_state": task.state, "task_id": task.task_id}
 
 
 @app.get("/list_trained_models")
 @response_handle
-async def list_trained_models() -> Optional[dict]:
-    lml = os.path.join(cfg.trainer.output, 'lightning_logs')
-    weights = {}
-    for ver in os.listdir(lml):
-        weights[ver] = {
-            'param': os.path.join(lml, ver, 'hparams.yaml'),
-            'checkpoints': []
-        }
-        ckpts_dir = os.path.join(lml, ver, 'checkpoints')
-        if os.path.isdir(ckpts_dir):
-            for ckpt in os.listdir(ckpts_dir):
-                weights[ver]['checkpoints'].append(os.path.join(ckpts_dir, ckpt))
-    return weights
+async def list_trained_models(
+    model_name: Optional[str] = None,
+    run: Optional[str] = None,
+    order_by: str = 'val_acc',
+    top_k: Optional[int] = None,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(50, ge=1),
+) -> Optional[dict]:
+    return await db.list_checkpoints(model_name, run, order_by, top_k, page, page_size)
 
 
 @app.post("/export_model")
@@ -118,9 +269,13 @@ async def export_model(export_config: schemas.ExportConfig, background_task: Bac
         basename = os.path.splitext(basename)[0] + f'.{export_config.format}'
         save_path = os.path.join(cfg.trainer.output, 'exported', f'{export_config.tag}{basename}')
         
-        background_task.add_task(tasks.export_cls_model, export_config, save_path)
+        task = send_task('export_cls_model', export_config.model_dump(), save_path)
 
-        ret['data'] = {'exported_path': save_path}
+        ret['data'] = {'exported_path': save_path, 'task_id': task.task_id}
+        if export_config.ort:
+            ret['data']['ort_path'] = ort_model_path(save_path)
+        if export_config.external_data:
+            ret['data']['data_path'] = external_data_path(save_path)
         
     except Exception as e:
         error = {'code': -1, 'message': str(e), 'traceback': format_exception(e)}
@@ -138,13 +293,16 @@ async def infer_cls_model(infer_config: schemas.InferenceConfig, background_task
         assert os.path.exists(infer_config.path_image)
         assert os.path.isfile(infer_config.path_image)
     
+        # cfg is shadowed by the request in background
+        draft = cfg.infer.draft_decode
+
         def background(cfg: schemas.InferenceConfig):
             try:
                 if OnnxGlobalInfer().cls_engine is None:
                     OnnxGlobalInfer().cls_engine = OrtClsInfer(cfg.path_model)
                     logger.info(f'first load cls engine: {cfg.path_model}.')
 
-                image = Image.open(cfg.path_image)
+                image = decode_image(cfg.path_image, cfg.img_size, draft)
                 preds = OnnxGlobalInfer().cls_engine(image, cfg.img_size)
                 for k, v in OnnxGlobalInfer().cls_engine.computation_metrics().items():
                     logger.debug(f'{k}: {v}')
@@ -163,17 +321,69 @@ async def infer_cls_model(infer_config: schemas.InferenceConfig, background_task
         ret.update(error)
     finally:
         return ret
-    
+
+
+@contextlib.contextmanager
+def _cls_executor(path_model: str):
+    with _executor_lock:
+        executor = OnnxGlobalInfer().cls_executor
+        if executor is None or executor.model != path_model:
+            OnnxGlobalInfer().cls_executor = InferenceExecutor(path_model)
+            _retire_executor(executor)
+            executor = OnnxGlobalInfer().cls_executor
+        _executor_users[executor] = _executor_users.get(executor, 0) + 1
+    try:
+        yield executor
+    finally:
+        with _executor_lock:
+            _executor_users[executor] -= 1
+            _retire_executor(executor)
+
+
+def _predict_batch(config: schemas.BatchInferenceConfig) -> list[dict]:
+    if cfg.executor.workers > 0:
+        # decode, preprocessing and forward in the worker processes, outside the GIL of the api
+        with _cls_executor(config.path_model) as executor:
+            probs = executor.predict(config.path_images, config.img_size)
+    else:
+        engine = OnnxGlobalInfer().cls_engine
+        if engine is None or engine._file != config.path_model:
+            engine = OnnxGlobalInfer().cls_engine = OrtClsInfer(config.path_model)
+            logger.info(f'load cls engine: {config.path_model}.')
+
+        images = [decode_image(x, config.img_size, cfg.infer.draft_decode) for x in config.path_images]
+        probs = engine.predict_batch(images, config.img_size)
+
+    predictions = []
+    for path, p in zip(config.path_images, probs):
+        top = p.argsort()[::-1][:config.top_k]
+        predictions.append({'path': path, 'classes': top.tolist(), 'scores': p[top].tolist()})
+    return predictions
+
+
+@app.post("/infer_cls_batch")
+@response_handle
+async def infer_cls_batch(infer_config: schemas.BatchInferenceConfig) -> Optional[dict]:
+    # unlike /infer_cls_engine the predictions are returned, one forward pass for all images
+    try:
+        predictions = await run_in_threadpool(_predict_batch, infer_config)
+    except TimeoutError as e:
+        # every inference worker stayed busy, the client may retry later
+        logger.warning(f'infer_cls_batch: {e}')
+        raise HTTPException(status_code=503, detail=str(e))
+    return {'predictions': predictions}
+
 
 @app.get("/free_cls_engine")
 async def free_cls_engine() -> Optional[dict]:
     ret = {'code': 0, 'message': 'OK'}
     try:
-        if OnnxGlobalInfer().cls_engine is None:
+        if OnnxGlobalInfer().cls_engine is None and OnnxGlobalInfer().cls_executor is None:
             warn = {'code': 404, 'message': 'cls engine not exists.'}
             logger.warning(warn)
             ret.update(warn)
         OnnxGlobalInfer().cls_engine = None
+        _close_executor()
     except Exception as e:
         error = {'code': -1, 'message': str(e), 'traceback': format_exception(e)}
         logger.error(error)
@@ -182,18 +392,48 @@ async def free_cls_engine() -> Optional[dict]:
         return ret
 
 
+@app.get("/metrics")
+@response_handle
+async def metrics() -> Optional[dict]:
+    return {'routes': snapshot()}
+
+
+@app.get("/task_events/{task_id}")
+async def task_events(task_id: str) -> StreamingResponse:
+    async def stream():
+        async for summary in TaskEventHub().subscribe(task_id):
+            yield ': keep-alive\n\n' if summary is None else to_sse('task_state', summary)
+
+    return StreamingResponse(
+        stream(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.post("/task_states")
+@response_handle
+async def task_states(query: schemas.TaskStatesQuery) -> Optional[dict]:
+    return {'tasks': await run_in_threadpool(get_task_states, query.task_ids, query.include_result)}
+
+
+@app.post("/cancel_task/{task_id}")
+@response_handle
+async def cancel_task(task_id: str) -> Optional[dict]:
+    meta = await run_in_threadpool(celery_app.backend.get_task_meta, task_id)
+    if meta.get('status') in TERMINAL_STATES:
+        return {'task_id': task_id, 'task_state': meta['status'], 'cancelled': False}
+    # running jobs stop at their next step, queued ones are dropped by the workers
+    await run_in_threadpool(request_cancel, task_id)
+    await run_in_threadpool(celery_app.control.revoke, task_id)
+    return {'task_id': task_id, 'task_state': meta.get('status'), 'cancelled': True}
+
+
 @app.get("/task_state/{task_id}")
 async def get_task_state(task_id: str) -> Optional[dict]:    
     ret = {'code': 0, 'message': 'OK'}
 
     try:
-        task = AsyncResult(task_id, backend=celery_app.backend)
-        ret['data'] = {
-            "task_id": task_id,
-            "task_state": task.state,
-            "task_result": task.result,
-            'date_done': str(task.date_done)
-        }
+        meta = await run_in_threadpool(celery_app.backend.get_task_meta, task_id)
+        ret['data'] = summarize(task_id, meta)
 
     except Exception as e:
         error = {'code': -1, 'message': str(e), 'traceback': format_exception(e)}
@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import fcntl
+import fnmatch
+import hashlib
+import platform
+import tempfile
+import statistics
+
+from vinda.api.config import cfg
+
+
+def _measure_ms(fn, warmup: int, repeat: int) -> float:
+    for _ in range(warmup):
+        fn()
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed.append((time.perf_counter() - start) * 1000)
+    return statistics.median(elapsed)
+
+
+def host_info() -> dict:
+    return {
+        'node': platform.node(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def benchmark_model(
+    model_name: str,
+    img_sizes: list[int],
+    batch_sizes: list[int],
+    num_threads: int = 0,
+    warmup: int = 3,
+    repeat: int = 10,
+) -> dict:
+    """Measure params, FLOPs and torch / onnxruntime CPU latency of a timm architecture.
+
+    Args:
+        model_name (str): timm model name, weights are not needed
+        img_sizes (list[int]): square input sizes to measure
+        batch_sizes (list[int]): batch sizes to measure
+        num_threads (int): intra-op threads for both backends, 0 means all cores
+        warmup (int): untimed runs before measuring
+        repeat (int): timed runs, the median is reported
+
+    Returns:
+        dict: catalog entry
+    """
+    # training deps are only needed where the benchmark runs (the worker)
+    import timm
+    import torch
+    import onnxruntime
+    from torch.utils.flop_counter import FlopCounterMode
+
+    num_threads = num_threads or os.cpu_count()
+    torch.set_num_threads(num_threads)
+
+    model = timm.create_model(model_name, pretrained=False).eval()
+    entry = {
+        'model': model_name,
+        'params': sum(p.numel() for p in model.parameters()),
+        'flops': {},
+        'latency': [],
+        'num_threads': num_threads,
+        'host': host_info(),
+        'timestamp': time.time(),
+    }
+
+    sess_options = onnxruntime.SessionOptions()
+    sess_options.intra_op_num_threads = num_threads
+
+    with tempfile.TemporaryDirectory() as tmp, torch.no_grad():
+        for img_size in img_sizes:
+            x = torch.randn(1, 3, img_size, img_size)
+            with FlopCounterMode(display=False) as flop_counter:
+                model(x)
+            entry['flops'][str(img_size)] = flop_counter.get_total_flops()
+
+            onnx_file = os.path.join(tmp, f'{img_size}.onnx')
+            torch.onnx.export(
+                model, x, onnx_file, opset_version=13, do_constant_folding=True,
+                input_names=['input'], output_names=['output'],
+                dynamic_axes={'input': {0: 'N'}, 'output': {0: 'N'}},
+            )
+            sess = onnxruntime.InferenceSession(
+                onnx_file, sess_options, providers=['CPUExecutionProvider']
+            )
+
+            for batch_size in batch_sizes:
+                xb = torch.randn(batch_size, 3, img_size, img_size)
+                feed = {'input': xb.numpy()}
+                entry['latency'].append({
+                    'img_size': img_size,
+                    'batch_size': batch_size,
+                    'torch_ms': _measure_ms(lambda: model(xb), warmup, repeat),
+                    'ort_ms': _measure_ms(lambda: sess.run(None, feed), warmup, repeat),
+                })
+
+    return entry
+
+
+class LatencyCatalog:
+    '''Persistent benchmark results, one entry per model, stored as a json file.
+
+    The worker writes entries as they are measured, the API only reads them.
+    '''
+
+    def __init__(self, path: str = None):
+        self.path = path or cfg.catalog.path
+        self._mtime = None
+        self._models = {}
+
+    def load(self) -> dict:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except FileNotFoundError:
+            return {}
+        if mtime != self._mtime:
+            with open(self.path, 'r') as fp:
+                self._models = json.load(fp)['models']
+            self._mtime = mtime
+        return self._models
+
+    def update(self, entry: dict):
+        # concurrent benchmark tasks each merge into the latest file instead of saving a stale copy
+        with open(f'{self.path}.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._mtime = None
+            models = dict(self.load())
+            models[entry['model']] = entry
+            tmp = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp, 'w') as fp:
+                json.dump({'models': models}, fp)
+            os.replace(tmp, self.path)
+
+    def is_fresh(self, model_name: str, img_sizes: list[int], batch_sizes: list[int], max_age: float) -> bool:
+        entry = self.load().get(model_name)
+        if entry is None or 'error' in entry or time.time() - entry['timestamp'] > max_age:
+            return False
+        measured = {(x['img_size'], x['batch_size']) for x in entry['latency']}
+        return all((s, b) in measured for s in img_sizes for b in batch_sizes)
+
+    def query(
+        self,
+        img_size: int = 224,
+        batch_size: int = 1,
+        backend: str = 'ort',
+        max_latency_ms: float | None = None,
+        sort_by: str = 'latency',
+    ) -> list[dict]:
+        if backend not in ('ort', 'torch'):
+            raise ValueError(f"backend should be 'ort' or 'torch', got {backend}")
+        if sort_by not in ('latency', 'params', 'flops'):
+            raise ValueError(f"sort_by should be 'latency', 'params' or 'flops', got {sort_by}")
+
+        rows = []
+        for entry in self.load().values():
+            latency = [
+                x for x in entry.get('latency', [])
+                if x['img_size'] == img_size and x['batch_size'] == batch_size
+            ]
+            if not latency:
+                continue
+            latency_ms = latency[0][f'{backend}_ms']
+            if max_latency_ms is not None and latency_ms > max_latency_ms:
+                continue
+            rows.append({
+                'model': entry['model'],
+                'params': entry['params'],
+                'flops': entry['flops'].get(str(img_size)),
+                'latency_ms': latency_ms,
+                'num_threads': entry['num_threads'],
+                'benchmarked_at': entry['timestamp'],
+            })
+        rows.sort(key=lambda x: x['latency_ms'] if sort_by == 'latency' else x[sort_by])
+        return rows
+
+
+class ModelCatalog:
+    '''timm model names plus the models cached in the HuggingFace hub directory.
+
+    Listed once per process; only the hub listing is refreshed, when the directory changes.
+    '''
+
+    def __init__(self, hub_dir: str = None):
+        self.hub_dir = hub_dir or cfg.catalog.hf_hub_dir
+        self._hub_mtime = None
+        self._supported = []
+        self._available = None
+        self._pretrained = None
+        self.version = None
+
+    def _refresh(self):
+        try:
+            mtime = os.stat(self.hub_dir).st_mtime_ns
+        except FileNotFoundError:
+            mtime = 0
+        if self._available is not None and mtime == self._hub_mtime:
+            return
+
+        if self._available is None:
+            import timm
+            self._available = timm.list_models()
+            self._pretrained = timm.list_models(pretrained=True)
+        self._supported = sorted(os.listdir(self.hub_dir)) if mtime else []
+        self._hub_mtime = mtime
+        self.version = hashlib.sha1(
+            json.dumps([self._supported, len(self._available), len(self._pretrained)]).encode()
+        ).hexdigest()[:16]
+
+    def etag(self, *query) -> str:
+        self._refresh()
+        return '"{}"'.format(hashlib.sha1(repr((self.version, query)).encode()).hexdigest()[:16])
+
+    def query(self, pattern: str = '*', pretrained: bool = False, page: int = 1, page_size: int = 0) -> dict:
+        """Filter the catalog by a glob pattern and page through the matches.
+
+        Args:
+            pattern (str): glob on model names, e.g. 'mobilenetv4*' or '*.e2400_r224_in1k'
+            pretrained (bool): list pretrained tags ('arch.tag') instead of architectures
+            page (int): 1-based page number
+            page_size (int): names per page, 0 returns all matches
+
+        Returns:
+            dict: the matching page
+        """
+        self._refresh()
+        names = self._pretrained if pretrained else self._available
+        matched = fnmatch.filter(names, pattern) if pattern != '*' else names
+        if page_size > 0:
+            start = (page - 1) * page_size
+            models = matched[start:start + page_size]
+        else:
+            models = matched
+        return {
+            'models_supported': fnmatch.filter(self._supported, f'*{pattern}*') if pattern != '*' else self._supported,
+            'models_available': models,
+            'total': len(matched),
+            'page': page,
+            'page_size': page_size,
+        }
@@ -27,16 +27,133 @@ cfg.celery.broker_url = os.getenv('CELERY_BROKER_URL', 'redis://:vinda1234@127.0
 ## Using the database to store task state and results.
 cfg.celery.result_backend = os.getenv('CELERY_RESULT_BACKEND', 'redis://:vinda1234@127.0.0.1:6379/1')
 
-cfg.db = EasyDict()
-cfg.db.db_url = ''
+cfg.metrics = EasyDict()
+## Requests slower than this are logged with their timing breakdown.
+cfg.metrics.slow_ms = float(os.getenv('SLOW_REQUEST_MS', 1000))
+## Upper bounds of the latency histogram buckets.
+cfg.metrics.buckets_ms = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+cfg.events = EasyDict()
+## Maximum task updates per second pushed to each /task_events client, faster updates are coalesced.
+cfg.events.max_rate = float(os.getenv('EVENTS_MAX_RATE', 2))
+## Seconds between keep-alive comments on idle event streams.
+cfg.events.keepalive = float(os.getenv('EVENTS_KEEPALIVE', 15))
 
 cfg.trainer = EasyDict()
 cfg.trainer.output = os.getenv('OUTDIR', '/data/output')
 
+cfg.catalog = EasyDict()
+## Pretrained weights available offline, listed by /list_models.
+cfg.catalog.hf_hub_dir = os.getenv('HF_HUB_CACHE', os.path.expanduser('~/.cache/huggingface/hub'))
+## Candidate architectures benchmarked by the latency catalog, timm names or wildcards.
+cfg.catalog.candidates = os.getenv(
+    'CATALOG_CANDIDATES',
+    'resnet18,resnet50,mobilenetv3_small_100,mobilenetv3_large_100,mobilenetv4_conv_small,'
+    'mobilenetv4_conv_medium,efficientnet_b0,efficientnet_b2,convnext_atto,regnety_008'
+).split(',')
+cfg.catalog.img_sizes = [int(x) for x in os.getenv('CATALOG_IMG_SIZES', '128,224').split(',')]
+cfg.catalog.batch_sizes = [int(x) for x in os.getenv('CATALOG_BATCH_SIZES', '1,8').split(',')]
+## Entries older than this are re-benchmarked by the periodic refresh.
+cfg.catalog.refresh_hours = float(os.getenv('CATALOG_REFRESH_HOURS', 24))
+## Benchmark results, written by the worker and read by /model_catalog.
+cfg.catalog.path = f"{cfg.trainer.output}/catalog/latency.json"
+
+cfg.export = EasyDict()
+## Graph optimizations baked into .ort artifacts (basic, extended, all). `all` keeps the CPU
+## layout optimizations but ties the artifact to the CPU type of the export worker.
+cfg.export.ort_optimization = os.getenv('ORT_OPTIMIZATION', 'all')
+
+cfg.infer = EasyDict()
+## Keep the memory-mapped weights of external data models shared between api processes: no NCHWc
+## layout transform and no prepacking, which would copy them into private buffers. Costs 20-40%
+## CPU latency; 0 optimizes as usual and only saves the protobuf copy of the weights.
+cfg.infer.share_weights = os.getenv('ORT_SHARE_WEIGHTS', '1') == '1'
+## Decode JPEGs directly near the input size (DCT scaling) before the resize, several times cheaper
+## for large photos; match TrainingConfig.draft_decode of the model.
+cfg.infer.draft_decode = os.getenv('DRAFT_DECODE', '1') == '1'
+
+cfg.executor = EasyDict()
+## Inference processes per api process behind /infer_cls_batch, each with an equal share of the
+## cores as onnxruntime threads; 0 runs inference in the api process. Every process holds its own
+## session, so with several uvicorn workers keep workers x uvicorn workers within the cores.
+cfg.executor.workers = int(os.getenv('INFER_WORKERS', 0))
+## Images per job of one worker, larger requests are split across the workers.
+cfg.executor.max_batch = int(os.getenv('INFER_MAX_BATCH', 32))
+## Seconds a job may wait for an idle worker, and then take, before the request fails.
+cfg.executor.timeout = float(os.getenv('INFER_TIMEOUT', 60))
+
+cfg.datasets = EasyDict()
+## Partial and completed uploads, extracted into {output}/datasets by the worker.
+cfg.datasets.uploads = f"{cfg.trainer.output}/uploads"
+## Threads used to extract an uploaded archive.
+cfg.datasets.extract_workers = int(os.getenv('EXTRACT_WORKERS', min(8, os.cpu_count() or 1)))
+## Processes used by the dataset analysis job.
+cfg.datasets.analyze_workers = int(os.getenv('ANALYZE_WORKERS', os.cpu_count() or 1))
+## Largest bucket of perceptual hashes compared pairwise by the near-duplicate search.
+cfg.datasets.max_hash_bucket = int(os.getenv('ANALYZE_MAX_BUCKET', 16384))
+
+cfg.store = EasyDict()
+## Content-addressed blobs of dataset files, datasets are hardlink trees into it (same filesystem as datasets).
+cfg.store.blobs = os.getenv('STORE_BLOBS', f"{cfg.trainer.output}/store/blobs")
+## Deduplicate extracted and synced datasets through the blob store.
+cfg.store.enabled = os.getenv('DATASET_STORE', '1') == '1'
+
+cfg.db = EasyDict()
+## Run registry, checkpoints are recorded here as they are saved.
+cfg.db.db_url = os.getenv('DB_URL', f"sqlite+aiosqlite:///{cfg.trainer.output}/vinda.db")
+
+## One queue per workload, so short exports and dataset jobs never wait behind training.
+cfg.celery.task_routes = {
+    'vinda.api.worker.celery_tasks.train_cls_model': {'queue': 'train'},
+    'vinda.api.worker.celery_tasks.export_cls_model': {'queue': 'export'},
+    'vinda.api.worker.celery_tasks.benchmark_models': {'queue': 'inference'},
+    'vinda.api.worker.celery_tasks.extract_dataset': {'queue': 'dataset'},
+    'vinda.api.worker.celery_tasks.analyze_dataset': {'queue': 'dataset'},
+    'vinda.api.worker.celery_tasks.gc_store': {'queue': 'dataset'},
+}
+## Long tasks: a worker only takes the next message when it is free, and acks it when done.
+cfg.celery.worker_prefetch_multiplier = 1
+cfg.celery.task_acks_late = True
+## Ten priority levels per queue on redis, where 0 runs first (see TrainingConfig.priority).
+cfg.celery.broker_transport_options = {'priority_steps': list(range(10))}
+## Tasks queued with apply_async (e.g. retries) without a priority take the middle level.
+cfg.celery.task_default_priority = 4
+
+cfg.control = EasyDict()
+## Seconds between two reads of the cancel flag during training.
+cfg.control.check_seconds = float(os.getenv('CANCEL_CHECK_SECONDS', 2))
+
+cfg.resources = EasyDict()
+## Resource request per task class; training adds its processes, dataloader workers and GPUs.
+cfg.resources.requests = {
+    'default': {'cpu': 1, 'memory_gb': 1, 'gpu': 0},
+    'train': {'cpu': 2, 'memory_gb': float(os.getenv('TRAIN_MEMORY_GB', 4)), 'gpu': 0},
+    'export': {'cpu': 1, 'memory_gb': 4, 'gpu': 0},
+    'inference': {'cpu': 1, 'memory_gb': 2, 'gpu': 0},
+    'dataset': {'cpu': 2, 'memory_gb': 2, 'gpu': 0},
+}
+## Seconds before a task that does not fit the node is retried.
+cfg.resources.retry_seconds = int(os.getenv('RESOURCE_RETRY_SECONDS', 30))
+
+## Periodic background jobs, run by `celery beat`.
+cfg.celery.beat_schedule = {
+    'refresh-latency-catalog': {
+        'task': 'vinda.api.worker.celery_tasks.benchmark_models',
+        'schedule': cfg.catalog.refresh_hours * 3600,
+    },
+    'gc-dataset-store': {
+        'task': 'vinda.api.worker.celery_tasks.gc_store',
+        'schedule': 24 * 3600,
+    },
+}
+
 ## make dirs
 os.makedirs(f"{cfg.trainer.output}/logs", exist_ok=True)
 os.makedirs(f"{cfg.trainer.output}/exported", exist_ok=True)
 os.makedirs(f"{cfg.trainer.output}/datasets", exist_ok=True)
+os.makedirs(f"{cfg.trainer.output}/catalog", exist_ok=True)
+os.makedirs(cfg.datasets.uploads, exist_ok=True)
+os.makedirs(cfg.store.blobs, exist_ok=True)
 
 ## Log settings.
 logger.level(os.getenv('LOG_LEVEL', 'INFO'))
@@ -0,0 +1,442 @@
+import os
+import re
+import glob
+import json
+import uuid
+import hashlib
+import shutil
+import zipfile
+import posixpath
+
+import aiofiles
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import AsyncIterator, Callable
+
+from vinda.api import store
+from vinda.api.config import cfg
+
+
+_UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+def _upload_files(upload_id: str) -> tuple[str, str]:
+    if not _UPLOAD_ID.match(upload_id):
+        raise ValueError(f'invalid upload id: {upload_id}')
+    base = os.path.join(cfg.datasets.uploads, upload_id)
+    return f'{base}.part', f'{base}.json'
+
+
+def create_upload(filename: str, size: int, name: str = '') -> dict:
+    if os.path.basename(name) != name or name.startswith('.'):
+        raise ValueError(f'invalid dataset name: {name}')
+    upload_id = uuid.uuid4().hex
+    part, meta = _upload_files(upload_id)
+    with open(meta, 'w') as fp:
+        json.dump({'filename': os.path.basename(filename), 'size': size, 'name': name}, fp)
+    open(part, 'wb').close()
+    return {'upload_id': upload_id, 'offset': 0, 'size': size}
+
+
+def upload_state(upload_id: str) -> dict:
+    part, meta = _upload_files(upload_id)
+    if not os.path.isfile(meta):
+        raise FileNotFoundError(f'upload not found: {upload_id}')
+    with open(meta, 'r') as fp:
+        state = json.load(fp)
+    state.update({'upload_id': upload_id, 'offset': os.path.getsize(part), 'path': part})
+    return state
+
+
+async def write_stream(
+    path: str, stream: AsyncIterator[bytes], offset: int | None = None, limit: int | None = None
+) -> int:
+    """Write an async byte stream to `path` without blocking the event loop.
+
+    Args:
+        path (str): destination file
+        stream (AsyncIterator[bytes]): request body chunks
+        offset (int | None): append at this offset (resumable uploads), None truncates
+        limit (int | None): most bytes the stream may hold, beyond it nothing of the stream is kept
+
+    Returns:
+        int: file size after writing
+    """
+    mode = 'wb' if offset is None else 'r+b'
+    async with aiofiles.open(path, mode) as f:
+        if offset is not None:
+            await f.seek(offset)
+        written = 0
+        async for chunk in stream:
+            written += len(chunk)
+            if limit is not None and written > limit:
+                await f.truncate(offset or 0)
+                raise ValueError(f'stream over {limit} bytes')
+            await f.write(chunk)
+        await f.truncate()
+        return await f.tell()
+
+
+async def append_upload(upload_id: str, offset: int, stream: AsyncIterator[bytes]) -> dict:
+    state = upload_state(upload_id)
+    if offset != state['offset']:
+        raise ValueError(f"offset mismatch: expected {state['offset']}, got {offset}")
+    try:
+        state['offset'] = await write_stream(state['path'], stream, offset, limit=state['size'] - offset)
+    except ValueError:
+        # the file is back at `offset`, the client can resume from there
+        raise ValueError(f"upload exceeds declared size {state['size']}") from None
+    return state
+
+
+def finish_upload(upload_id: str) -> dict:
+    '''Rename a completed upload to `<upload_id>.zip`, the returned state points at it.'''
+    state = upload_state(upload_id)
+    if state['offset'] != state['size']:
+        raise ValueError(f"upload incomplete: {state['offset']}/{state['size']} bytes")
+    if not zipfile.is_zipfile(state['path']):
+        raise ValueError(f"{state['filename']} is not a zip archive")
+    state['path'] = os.path.join(cfg.datasets.uploads, f'{upload_id}.zip')
+    os.replace(_upload_files(upload_id)[0], state['path'])
+    os.remove(_upload_files(upload_id)[1])
+    return state
+
+
+def _extract_members(zip_file: str, members: list[zipfile.ZipInfo], dest: str) -> int:
+    # one handle per thread, zlib releases the GIL while inflating
+    with zipfile.ZipFile(zip_file, 'r') as zip_ref:
+        for member in members:
+            zip_ref.extract(member, dest)
+    return len(members)
+
+
+def extract_zip(
+    zip_file: str,
+    dest: str,
+    num_workers: int = 0,
+    progress: Callable[[int, int], None] | None = None,
+) -> int:
+    """Extract a zip archive with several threads, each on its own share of the files.
+
+    Args:
+        zip_file (str): archive path
+        dest (str): output directory
+        num_workers (int): extraction threads, 0 uses cfg.datasets.extract_workers
+        progress (Callable[[int, int], None] | None): called with (done, total) members
+
+    Returns:
+        int: number of extracted members
+    """
+    with zipfile.ZipFile(zip_file, 'r') as zip_ref:
+        members = zip_ref.infolist()
+        # every directory first, in this thread: ZipFile.extract creates missing parents without
+        # exist_ok, threads extracting files of the same directory would race on it
+        dirs = {x.filename for x in members if x.is_dir()}
+        dirs |= {posixpath.dirname(x.filename) + '/' for x in members if not x.is_dir() and '/' in x.filename}
+        for name in sorted(dirs):
+            zip_ref.extract(zipfile.ZipInfo(name), dest)
+    files = [x for x in members if not x.is_dir()]
+
+    num_workers = num_workers or cfg.datasets.extract_workers
+    # balance the chunks by uncompressed size, several chunks per thread for progress
+    num_chunks = max(1, min(len(files), num_workers * 8))
+    chunks, loads = [[] for _ in range(num_chunks)], [0] * num_chunks
+    for member in sorted(files, key=lambda x: x.file_size, reverse=True):
+        i = loads.index(min(loads))
+        chunks[i].append(member)
+        loads[i] += member.file_size
+
+    done = len(members) - len(files)
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(_extract_members, zip_file, x, dest) for x in chunks if x]
+        for future in as_completed(futures):
+            done += future.result()
+            if progress is not None:
+                progress(done, len(members))
+    return len(members)
+
+
+def find_dataset_root(path: str) -> str:
+    '''Return the directory holding `train/` and `val/`, either `path` or its only subdirectory.'''
+    if os.path.isdir(os.path.join(path, 'train')):
+        return path
+    subdirs = [x for x in os.listdir(path) if os.path.isdir(os.path.join(path, x)) and x != '__MACOSX']
+    if len(subdirs) == 1 and os.path.isdir(os.path.join(path, subdirs[0], 'train')):
+        return os.path.join(path, subdirs[0])
+    raise ValueError("dataset should contain 'train/' and 'val/' directories")
+
+
+def validate_layout(root: str) -> dict:
+    """Check the ImageFolder layout: `train/<class>/*` and `val/<class>/*`.
+
+    Returns:
+        dict: classes and sample counts per split
+    """
+    info = {}
+    for split in ('train', 'val'):
+        split_dir = os.path.join(root, split)
+        if not os.path.isdir(split_dir):
+            raise ValueError(f"missing '{split}/' directory")
+        classes = sorted(x.name for x in os.scandir(split_dir) if x.is_dir())
+        if not classes:
+            raise ValueError(f"'{split}/' has no class directories")
+        info[split] = sum(
+            sum(1 for x in os.scandir(os.path.join(split_dir, c)) if x.is_file()) for c in classes
+        )
+        info[f'{split}_classes'] = classes
+
+    missing = set(info['val_classes']) - set(info['train_classes'])
+    if missing:
+        raise ValueError(f"classes in 'val/' but not in 'train/': {sorted(missing)}")
+    return {'classes': info['train_classes'], 'train': info['train'], 'val': info['val']}
+
+
+def install_dataset(
+    zip_file: str,
+    name: str | None = None,
+    filename: str | None = None,
+    progress: Callable[[int, int], None] | None = None,
+) -> dict:
+    """Extract an uploaded archive into a staging directory, validate it, and move it
+    to `<output>/datasets/<name>` so half-extracted datasets are never listed.
+
+    Args:
+        zip_file (str): archive path
+        name (str | None): dataset name, defaults to the top-level directory of the archive
+        filename (str | None): original archive name, used when the archive has no top-level directory
+        progress (Callable[[int, int], None] | None): extraction progress callback
+
+    Returns:
+        dict: dataset path and layout summary
+    """
+    datasets_dir = os.path.join(cfg.trainer.output, 'datasets')
+    staging = os.path.join(datasets_dir, '.staging', uuid.uuid4().hex)
+    try:
+        extract_zip(zip_file, staging, progress=progress)
+        root = find_dataset_root(staging)
+        info = validate_layout(root)
+
+        if not name:
+            name = os.path.basename(root) if root != staging else os.path.splitext(filename or os.path.basename(zip_file))[0]
+        dataset = os.path.join(datasets_dir, name)
+        if os.path.exists(dataset):
+            raise FileExistsError(f'dataset already exists: {dataset}')
+        os.replace(root, dataset)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    info['dataset'] = dataset
+    if cfg.store.enabled:
+        info['store'] = dedupe_dataset(dataset)
+    return info
+
+
+## caches derived from the dataset, relative to `<dataset>/.vinda`; `{split}` ones only depend on that split
+_DERIVED_CACHES = ('teacher_logits/{split}-*', 'stats.json')
+
+
+def hash_file(path: str, chunk_size: int = 1 << 20) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        while chunk := fp.read(chunk_size):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _check_relpath(path: str) -> str:
+    norm = os.path.normpath(path).replace(os.sep, '/')
+    if os.path.isabs(path) or norm.startswith('../') or norm == '..' or norm.split('/')[0] == '.vinda':
+        raise ValueError(f'invalid dataset path: {path}')
+    return norm
+
+
+def build_manifest(root: str) -> dict:
+    """Hash every file of a dataset, `{relpath: {'size', 'sha256'}}`.
+
+    Hashes are cached in `<root>/.vinda/manifest.json` and only recomputed for
+    files whose size or mtime changed.
+    """
+    cache_file = os.path.join(root, '.vinda', 'manifest.json')
+    cached = {}
+    if os.path.isfile(cache_file):
+        with open(cache_file, 'r') as fp:
+            cached = json.load(fp)
+
+    manifest = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        if dirpath == root:
+            dirnames[:] = [x for x in dirnames if x != '.vinda']
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            relpath = os.path.relpath(path, root).replace(os.sep, '/')
+            stat = os.stat(path)
+            entry = cached.get(relpath)
+            if entry is None or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+                entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': hash_file(path)}
+            manifest[relpath] = entry
+
+    _save_manifest(root, manifest)
+    return manifest
+
+
+def _save_manifest(root: str, manifest: dict):
+    cache_file = os.path.join(root, '.vinda', 'manifest.json')
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    tmp = f'{cache_file}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as fp:
+        json.dump(manifest, fp)
+    os.replace(tmp, cache_file)
+
+
+def dedupe_dataset(root: str, num_workers: int = 0) -> dict:
+    """Turn a dataset into a hardlink tree of the blob store, files already stored by
+    other datasets are replaced by links to the stored copy.
+
+    Args:
+        root (str): dataset directory
+        num_workers (int): threads, 0 uses cfg.datasets.extract_workers
+
+    Returns:
+        dict: file counts per outcome of `store.put_file` and the bytes shared with other datasets
+    """
+    manifest = build_manifest(root)
+    paths = sorted(manifest)
+
+    def put(relpath):
+        return store.put_file(os.path.join(root, relpath), manifest[relpath]['sha256'])
+
+    with ThreadPoolExecutor(max_workers=num_workers or cfg.datasets.extract_workers) as executor:
+        results = list(executor.map(put, paths))
+
+    summary = {'stored': 0, 'linked': 0, 'copied': 0, 'shared_bytes': 0}
+    for relpath, result in zip(paths, results):
+        summary[result] += 1
+        if result != 'stored':
+            summary['shared_bytes'] += manifest[relpath]['size']
+            # replaced by the stored file, same content under a new mtime
+            manifest[relpath]['mtime_ns'] = os.stat(os.path.join(root, relpath)).st_mtime_ns
+    _save_manifest(root, manifest)
+    return summary
+
+
+def invalidate_derived(root: str, paths: list[str]) -> list[str]:
+    '''Remove the caches derived from the splits touched by `paths`, return the removed files.'''
+    removed = []
+    for split in sorted({x.split('/')[0] for x in paths}):
+        for pattern in _DERIVED_CACHES:
+            for cache in glob.glob(os.path.join(root, '.vinda', pattern.format(split=split))):
+                os.remove(cache)
+                removed.append(cache)
+    return removed
+
+
+def _sync_dir(sync_id: str) -> str:
+    if not _UPLOAD_ID.match(sync_id):
+        raise ValueError(f'invalid sync id: {sync_id}')
+    path = os.path.join(cfg.datasets.uploads, f'sync-{sync_id}')
+    if not os.path.isdir(path):
+        raise FileNotFoundError(f'sync not found: {sync_id}')
+    return path
+
+
+def plan_sync(name: str, files: list[dict], delete: bool = True) -> dict:
+    """Compare a client manifest with a dataset and open a sync session.
+
+    Args:
+        name (str): dataset name under `<output>/datasets`, created on commit if missing
+        files (list[dict]): client manifest, `path`, `size` and `sha256` of every file
+        delete (bool): remove server files that are not in the client manifest
+
+    Returns:
+        dict: sync id, paths to upload and paths that will be deleted
+    """
+    if os.path.basename(name) != name or name.startswith('.'):
+        raise ValueError(f'invalid dataset name: {name}')
+    root = os.path.join(cfg.trainer.output, 'datasets', name)
+    server = build_manifest(root) if os.path.isdir(root) else {}
+
+    wanted = {_check_relpath(x['path']): x for x in files}
+    changed = sorted(
+        path for path, x in wanted.items()
+        if path not in server or server[path]['size'] != x['size'] or server[path]['sha256'] != x['sha256']
+    )
+    # content already in the store, e.g. from another version of the dataset, is linked instead of uploaded
+    link = [x for x in changed if cfg.store.enabled and store.has_blob(wanted[x]['sha256'])]
+    upload = sorted(set(changed) - set(link))
+    removed = sorted(set(server) - set(wanted)) if delete else []
+
+    sync_id = uuid.uuid4().hex
+    sync_dir = os.path.join(cfg.datasets.uploads, f'sync-{sync_id}')
+    os.makedirs(os.path.join(sync_dir, 'files'))
+    with open(os.path.join(sync_dir, 'plan.json'), 'w') as fp:
+        json.dump({
+            'dataset': root,
+            'upload': {x: wanted[x]['sha256'] for x in upload},
+            'link': {x: wanted[x]['sha256'] for x in link},
+            'delete': removed,
+        }, fp)
+    return {'sync_id': sync_id, 'dataset': root, 'upload': upload, 'link': link, 'delete': removed}
+
+
+async def put_sync_file(sync_id: str, path: str, stream: AsyncIterator[bytes]) -> dict:
+    sync_dir = _sync_dir(sync_id)
+    with open(os.path.join(sync_dir, 'plan.json'), 'r') as fp:
+        plan = json.load(fp)
+    path = _check_relpath(path)
+    if path not in plan['upload']:
+        raise ValueError(f'{path} is not part of sync {sync_id}')
+    staged = os.path.join(sync_dir, 'files', path)
+    os.makedirs(os.path.dirname(staged), exist_ok=True)
+    size = await write_stream(staged, stream)
+    return {'path': path, 'size': size}
+
+
+def commit_sync(sync_id: str) -> dict:
+    """Verify the staged files against the plan, move them into the dataset, apply
+    deletions and drop the derived caches of the splits that changed.
+
+    Returns:
+        dict: counts of applied changes and the invalidated caches
+    """
+    sync_dir = _sync_dir(sync_id)
+    with open(os.path.join(sync_dir, 'plan.json'), 'r') as fp:
+        plan = json.load(fp)
+
+    root = plan['dataset']
+    link = plan.get('link', {})
+    missing = []
+    for path, sha256 in plan['upload'].items():
+        staged = os.path.join(sync_dir, 'files', path)
+        if not os.path.isfile(staged) or hash_file(staged) != sha256:
+            missing.append(path)
+    # collected from the store since the plan, the client plans again and uploads them
+    missing += [path for path, sha256 in link.items() if not store.has_blob(sha256)]
+    if missing:
+        raise ValueError(f'{len(missing)} files missing or corrupted, e.g. {missing[:5]}')
+
+    for path in plan['upload']:
+        dest = os.path.join(root, path)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(os.path.join(sync_dir, 'files', path), dest)
+    for path, sha256 in link.items():
+        store.materialize(sha256, os.path.join(root, path))
+    for path in plan['delete']:
+        try:
+            os.remove(os.path.join(root, path))
+        except FileNotFoundError:
+            pass
+    shutil.rmtree(sync_dir, ignore_errors=True)
+
+    changed = list(plan['upload']) + list(link) + plan['delete']
+    invalidated = invalidate_derived(root, changed) if changed else []
+    if changed and cfg.store.enabled:
+        dedupe_dataset(root)
+    elif changed:
+        build_manifest(root)
+    return {
+        'dataset': root,
+        'uploaded': len(plan['upload']),
+        'linked': len(link),
+        'deleted': len(plan['delete']),
+        'invalidated': [os.path.relpath(x, root) for x in invalidated],
+    }
@@ -1,10 +1,179 @@
-# from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-# from sqlalchemy.orm import sessionmaker
-# from vinda.api.config import cfg
-
-# engine = create_async_engine(cfg.SQLALCHEMY_DATABASE_URL, echo=True)
-# SessionLocal = sessionmaker(
-#     expire_on_commit=False,
-#     class_=AsyncSession,
-#     bind=engine,
-# )
\ No newline at end of file
+import os
+import re
+import json
+import yaml
+from datetime import datetime
+
+from sqlalchemy import Index, String, Text, create_engine, event, func, select, delete
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, sessionmaker
+from loguru import logger
+
+from vinda.api.config import cfg
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    # the worker writes while the api reads
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+
+## async engine for the api, sync engine for the training callbacks and backfill
+engine = create_async_engine(cfg.db.db_url)
+SessionLocal = sessionmaker(
+    expire_on_commit=False,
+    class_=AsyncSession,
+    bind=engine,
+)
+
+_url = make_url(cfg.db.db_url)
+sync_engine = create_engine(_url.set(drivername=_url.drivername.split('+')[0]))
+SyncSessionLocal = sessionmaker(expire_on_commit=False, bind=sync_engine)
+
+if _url.drivername.startswith('sqlite'):
+    event.listen(engine.sync_engine, 'connect', _sqlite_pragmas)
+    event.listen(sync_engine, 'connect', _sqlite_pragmas)
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class CheckpointRecord(Base):
+    __tablename__ = 'checkpoints'
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    run: Mapped[str] = mapped_column(String(64), index=True)
+    model_name: Mapped[str] = mapped_column(String(256), index=True)
+    hparams: Mapped[str] = mapped_column(Text)
+    epoch: Mapped[int]
+    val_acc: Mapped[float | None] = mapped_column(index=True)
+    path: Mapped[str] = mapped_column(String(1024), unique=True)
+    created_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
+
+    __table_args__ = (Index('ix_checkpoints_run_epoch', 'run', 'epoch'),)
+
+    def to_dict(self) -> dict:
+        return {
+            'run': self.run,
+            'model_name': self.model_name,
+            'hparams': json.loads(self.hparams),
+            'epoch': self.epoch,
+            'val_acc': self.val_acc,
+            'path': self.path,
+            'param': os.path.join(os.path.dirname(os.path.dirname(self.path)), 'hparams.yaml'),
+            'created_at': self.created_at.isoformat(),
+        }
+
+
+class RegistryMeta(Base):
+    __tablename__ = 'registry_meta'
+
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    value: Mapped[str] = mapped_column(Text)
+
+
+_CKPT_NAME = re.compile(r'model-(\d+)-(\d+\.\d+)')
+
+
+def _dump_hparams(hparams: dict) -> str:
+    return json.dumps(
+        dict(hparams), default=lambda x: x.model_dump() if hasattr(x, 'model_dump') else str(x)
+    )
+
+
+def init_db():
+    Base.metadata.create_all(sync_engine)
+
+
+def _upsert_checkpoint(session, run: str, hparams: dict, epoch: int, val_acc: float | None, path: str):
+    record = session.scalar(select(CheckpointRecord).where(CheckpointRecord.path == path))
+    if record is None:
+        record = CheckpointRecord(path=path)
+        session.add(record)
+    record.run = run
+    record.model_name = hparams.get('model_name', '')
+    record.hparams = _dump_hparams(hparams)
+    record.epoch = epoch
+    record.val_acc = val_acc
+
+
+def record_checkpoint(run: str, hparams: dict, epoch: int, val_acc: float | None, path: str):
+    with SyncSessionLocal.begin() as session:
+        _upsert_checkpoint(session, run, hparams, epoch, val_acc, path)
+
+
+def remove_checkpoint(path: str):
+    with SyncSessionLocal.begin() as session:
+        session.execute(delete(CheckpointRecord).where(CheckpointRecord.path == path))
+
+
+def backfill(lightning_logs: str = None) -> int:
+    """Import checkpoints saved before the registry existed, once per database.
+
+    Returns:
+        int: number of checkpoints imported
+    """
+    lightning_logs = lightning_logs or os.path.join(cfg.trainer.output, 'lightning_logs')
+    with SyncSessionLocal() as session:
+        if session.get(RegistryMeta, 'backfilled') is not None:
+            return 0
+
+    count = 0
+    with SyncSessionLocal.begin() as session:
+        for run in os.listdir(lightning_logs) if os.path.isdir(lightning_logs) else []:
+            ckpts_dir = os.path.join(lightning_logs, run, 'checkpoints')
+            if not os.path.isdir(ckpts_dir):
+                continue
+            hparams = {}
+            param = os.path.join(lightning_logs, run, 'hparams.yaml')
+            if os.path.isfile(param):
+                with open(param, 'r') as fp:
+                    hparams = yaml.unsafe_load(fp) or {}
+            for ckpt in os.listdir(ckpts_dir):
+                matched = _CKPT_NAME.match(ckpt)
+                epoch, val_acc = (int(matched[1]), float(matched[2])) if matched else (-1, None)
+                _upsert_checkpoint(session, run, hparams, epoch, val_acc, os.path.join(ckpts_dir, ckpt))
+                count += 1
+        session.add(RegistryMeta(key='backfilled', value=datetime.utcnow().isoformat()))
+    logger.info(f'registry backfill: {count} checkpoints from {lightning_logs}')
+    return count
+
+
+async def list_checkpoints(
+    model_name: str | None = None,
+    run: str | None = None,
+    order_by: str = 'val_acc',
+    top_k: int | None = None,
+    page: int = 1,
+    page_size: int = 50,
+) -> dict:
+    order = {
+        'val_acc': CheckpointRecord.val_acc.desc(),
+        'created_at': CheckpointRecord.created_at.desc(),
+        'epoch': CheckpointRecord.epoch.desc(),
+    }
+    if order_by not in order:
+        raise ValueError(f'order_by should be one of {list(order)}, got {order_by}')
+
+    query = select(CheckpointRecord)
+    if model_name:
+        query = query.where(CheckpointRecord.model_name == model_name)
+    if run:
+        query = query.where(CheckpointRecord.run == run)
+
+    async with SessionLocal() as session:
+        total = await session.scalar(select(func.count()).select_from(query.subquery()))
+        if top_k:
+            query = query.order_by(order[order_by]).limit(top_k)
+        else:
+            query = query.order_by(order[order_by]).offset((page - 1) * page_size).limit(page_size)
+        records = (await session.scalars(query)).all()
+
+    return {
+        'total': total if not top_k else min(total, top_k),
+        'checkpoints': [x.to_dict() for x in records],
+    }
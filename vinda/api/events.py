@@ -0,0 +1,160 @@
+import json
+import asyncio
+
+from collections import defaultdict
+from typing import AsyncIterator
+
+from celery import states
+from loguru import logger
+
+from vinda.api.config import cfg
+from vinda.api.pattern import SingletonBase
+from vinda.api.worker.celery_app import celery_app
+from vinda.api.worker.control import CANCELLED
+
+
+## states after which a task never changes again
+TERMINAL_STATES = states.READY_STATES | {CANCELLED}
+
+
+def summarize(task_id: str, meta: dict) -> dict:
+    '''The shape returned by /task_state, built from a backend meta dict.'''
+    state, result = meta.get('status', states.PENDING), meta.get('result')
+    if isinstance(result, BaseException):
+        result = repr(result)
+    return {
+        'task_id': task_id,
+        'task_state': state,
+        'task_result': result,
+        'date_done': str(meta.get('date_done')),
+    }
+
+
+def get_task_states(task_ids: list[str], include_result: bool = False) -> list[dict]:
+    """Read the states of many tasks in one round-trip (MGET on key-value backends).
+
+    Args:
+        task_ids (list[str]): task ids, unknown ids are reported as PENDING
+        include_result (bool): include the full task result, not only the state
+
+    Returns:
+        list[dict]: one summary per task id, in the same order
+    """
+    if not task_ids:
+        # an empty MGET is an error on redis
+        return []
+    backend = celery_app.backend
+    if hasattr(backend, 'mget') and hasattr(backend, 'get_key_for_task'):
+        keys = [backend.get_key_for_task(x) for x in task_ids]
+        values = backend.mget(keys)
+        # redis returns a list, memcached-like clients a mapping
+        if hasattr(values, 'items'):
+            values = [values.get(x) for x in keys]
+        metas = [backend.decode_result(x) if x else {'status': states.PENDING} for x in values]
+    else:
+        metas = [backend.get_task_meta(x) for x in task_ids]
+
+    summaries = []
+    for task_id, meta in zip(task_ids, metas):
+        summary = summarize(task_id, meta)
+        if summary['task_state'] == states.FAILURE:
+            summary['error'] = summary['task_result']
+        if not include_result:
+            del summary['task_result']
+        summaries.append(summary)
+    return summaries
+
+
+def to_sse(event: str, data: dict) -> str:
+    return f'event: {event}\ndata: {json.dumps(data, default=str)}\n\n'
+
+
+class TaskEventHub(metaclass=SingletonBase):
+    '''Fans task state changes out to every streaming client.
+
+    The Redis result backend publishes every stored state on the task's meta key,
+    so one pattern subscription per API process serves all clients; other
+    backends fall back to polling, once per task for all of its clients.
+    '''
+
+    def __init__(self):
+        self.backend = celery_app.backend
+        self.prefix = getattr(self.backend, 'task_keyprefix', 'celery-task-meta-')
+        self.use_pubsub = self.backend.url is not None and self.backend.url.startswith(('redis://', 'rediss://'))
+        self._latest: dict[str, dict] = {}
+        self._waiters: dict[str, set[asyncio.Event]] = defaultdict(set)
+        self._listener: asyncio.Task | None = None
+        self._pollers: dict[str, asyncio.Task] = {}
+
+    def _publish(self, task_id: str, meta: dict):
+        self._latest[task_id] = meta
+        for event in self._waiters.get(task_id, ()):
+            event.set()
+
+    async def _listen(self):
+        import redis.asyncio as aioredis
+
+        while True:
+            try:
+                client = aioredis.from_url(self.backend.url)
+                async with client.pubsub() as pubsub:
+                    await pubsub.psubscribe(f'{self.prefix}*')
+                    async for message in pubsub.listen():
+                        if message['type'] != 'pmessage':
+                            continue
+                        task_id = message['channel'].decode()[len(self.prefix):]
+                        if task_id in self._waiters:
+                            self._publish(task_id, self.backend.decode_result(message['data']))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f'task event subscription lost, reconnecting: {e}')
+                await asyncio.sleep(1)
+
+    async def _poll(self, task_id: str):
+        while task_id in self._waiters:
+            meta = await asyncio.to_thread(self.backend.get_task_meta, task_id)
+            if meta != self._latest.get(task_id):
+                self._publish(task_id, meta)
+            await asyncio.sleep(1 / cfg.events.max_rate)
+
+    async def subscribe(self, task_id: str) -> AsyncIterator[dict]:
+        """Yield task summaries as the state changes, at most `cfg.events.max_rate` per second.
+
+        Updates arriving faster are coalesced, only the latest is sent. The
+        stream ends after a terminal state.
+        """
+        event = asyncio.Event()
+        self._waiters[task_id].add(event)
+        if self.use_pubsub and (self._listener is None or self._listener.done()):
+            self._listener = asyncio.create_task(self._listen())
+        elif not self.use_pubsub and task_id not in self._pollers:
+            self._pollers[task_id] = asyncio.create_task(self._poll(task_id))
+
+        try:
+            # the current state, in case the task does not change for a while
+            meta = await asyncio.to_thread(self.backend.get_task_meta, task_id)
+            self._latest.setdefault(task_id, meta)
+            event.set()
+
+            interval = 1 / cfg.events.max_rate
+            while True:
+                try:
+                    await asyncio.wait_for(event.wait(), cfg.events.keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                event.clear()
+                meta = self._latest[task_id]
+                yield summarize(task_id, meta)
+                if meta.get('status') in TERMINAL_STATES:
+                    break
+                await asyncio.sleep(interval)
+        finally:
+            self._waiters[task_id].discard(event)
+            if not self._waiters[task_id]:
+                del self._waiters[task_id]
+                self._latest.pop(task_id, None)
+                poller = self._pollers.pop(task_id, None)
+                if poller is not None:
+                    poller.cancel()
@@ -0,0 +1,255 @@
+'''Multi-process inference behind /infer_cls_batch.
+
+Decode, preprocessing and the forward pass of every job run in a pool of worker processes,
+each owning an onnxruntime session with an equal share of the cores, so throughput is not
+capped by the GIL of the api process. Jobs carry image paths, the probabilities come back
+through the worker's shared-memory output buffer. Only small control messages go through
+the queues and pipes.
+'''
+
+import contextlib
+import os
+import math
+import time
+import uuid
+import queue
+import threading
+import multiprocessing
+
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from loguru import logger
+from vinda.api.config import cfg
+
+
+def _serve(index: int, generation: int, model: str, num_threads: int, tasks, results):
+    from vinda.api.onnxinfer import OrtClsInfer
+    from vinda.api.transforms import decode_image
+
+    try:
+        engine = OrtClsInfer(model, num_threads=num_threads)
+    except Exception as e:
+        results.send(('failed', index, generation, f'{type(e).__name__}: {e}'))
+        return
+    results.send(('ready', index, generation, engine._sess.get_outputs()[0].shape[1]))
+
+    outputs = None
+    while (task := tasks.get()) is not None:
+        if task[0] == 'attach':
+            outputs = SharedMemory(name=task[1])
+            continue
+        job, paths, img_size = task
+        try:
+            images = [decode_image(x, img_size, cfg.infer.draft_decode) for x in paths]
+            probs = engine.predict_batch(images, img_size)
+            out = np.ndarray(probs.shape, dtype=np.float32, buffer=outputs.buf)
+            out[:] = probs
+            del out
+            results.send((job, index, len(probs), None))
+        except Exception as e:
+            results.send((job, index, 0, f'{type(e).__name__}: {e}'))
+
+    if outputs is not None:
+        outputs.close()
+
+
+class InferenceExecutor:
+    '''Pool of inference processes for one model, shared by the threads of the api process.'''
+
+    def __init__(self, model: str, num_workers: int = 0, max_batch: int = 0):
+        """
+        Args:
+            model (str): onnx model, its .ort / external data variants are used as by `OrtEngine`
+            num_workers (int): processes, `cfg.executor.workers` by default
+            max_batch (int): images per job, `cfg.executor.max_batch` by default
+        """
+        self.model = model
+        self.num_workers = num_workers or cfg.executor.workers
+        self.max_batch = max_batch or cfg.executor.max_batch
+        self.num_threads = max(1, (os.cpu_count() or 1) // self.num_workers)
+        self.num_classes = None
+
+        # spawn, forking the threaded api process is unsafe
+        self._context = multiprocessing.get_context('spawn')
+        # one result pipe per worker: a worker killed while writing to a shared queue would keep
+        # its lock and block every other worker
+        self._receivers = [None] * self.num_workers
+        # (index, generation) of workers attached and free for a job; `_start` drops the entry of the
+        # worker it restarts, `submit` skips any entry of a previous process left behind
+        self._idle = queue.Queue()
+        self._generations = [0] * self.num_workers
+        # dispatching a job and restarting its worker exclude each other
+        self._lock = threading.Lock()
+        self._jobs: dict[str, Future] = {}
+        self._busy: dict[int, str] = {}
+        self._processes = [None] * self.num_workers
+        self._tasks = [None] * self.num_workers
+        self._outputs: list[SharedMemory | None] = [None] * self.num_workers
+        self._pending = set(range(self.num_workers))
+        self._started = threading.Event()
+        self._error = None
+        self._closed = False
+
+        for i in range(self.num_workers):
+            self._start(i)
+        self._collector = threading.Thread(target=self._collect, name='executor-collector', daemon=True)
+        self._collector.start()
+        if not self._started.wait(cfg.executor.timeout) or self._error:
+            self.close()
+            raise RuntimeError(f'inference workers failed to start: {self._error or "timeout"}')
+        logger.info(f'inference executor: {self.num_workers} workers x {self.num_threads} threads, {model}.')
+
+    def _start(self, index: int):
+        self._generations[index] += 1
+        # drop the idle entry of the previous process, the new one is queued once it is attached
+        idle = []
+        with contextlib.suppress(queue.Empty):
+            while True:
+                idle.append(self._idle.get_nowait())
+        for x in idle:
+            if x[0] != index:
+                self._idle.put(x)
+        self._tasks[index] = self._context.Queue()
+        if self._receivers[index] is not None:
+            self._receivers[index].close()
+        self._receivers[index], sender = self._context.Pipe(duplex=False)
+        self._processes[index] = self._context.Process(
+            target=_serve,
+            args=(index, self._generations[index], self.model, self.num_threads, self._tasks[index], sender),
+            name=f'vinda-infer-{index}', daemon=True,
+        )
+        self._processes[index].start()
+        # only the worker holds the sending end, the pipe reads EOF once it exits
+        sender.close()
+
+    def _on_ready(self, index: int, generation: int, num_classes: int):
+        with self._lock:
+            if generation != self._generations[index]:
+                return
+            self.num_classes = num_classes
+            if self._outputs[index] is None:
+                self._outputs[index] = SharedMemory(create=True, size=self.max_batch * num_classes * 4)
+            # queued before any job, the worker attaches the buffer first
+            self._tasks[index].put(('attach', self._outputs[index].name))
+            self._idle.put((index, generation))
+            self._pending.discard(index)
+            if not self._pending:
+                self._started.set()
+
+    def _on_result(self, job: str, index: int, size: int, error: str | None):
+        with self._lock:
+            # a late result of a worker restarted since, its job has already failed
+            if self._busy.get(index) != job:
+                return
+            del self._busy[index]
+            future = self._jobs.pop(job)
+            if error is not None:
+                future.set_exception(RuntimeError(error))
+            else:
+                # copied out before the worker can take the next job
+                out = np.ndarray((size, self.num_classes), dtype=np.float32, buffer=self._outputs[index].buf)
+                future.set_result(out.copy())
+                del out
+            self._idle.put((index, self._generations[index]))
+
+    def _check_workers(self):
+        for index, process in enumerate(self._processes):
+            if process.is_alive() or self._closed:
+                continue
+            if not self._started.is_set():
+                self._error = f'inference worker {index} exited with {process.exitcode}'
+                self._started.set()
+                return
+            logger.warning(f'inference worker {index} exited with {process.exitcode}, restarting.')
+            with self._lock:
+                job = self._busy.pop(index, None)
+                if job is not None and job in self._jobs:
+                    self._jobs.pop(job).set_exception(RuntimeError(f'inference worker exited with {process.exitcode}'))
+                self._pending.add(index)
+                self._start(index)
+
+    def _collect(self):
+        checked = time.monotonic()
+        while not self._closed:
+            if time.monotonic() - checked > 1:
+                self._check_workers()
+                checked = time.monotonic()
+            receivers = [x for x in self._receivers if x is not None]
+            for receiver in wait(receivers, timeout=0.5):
+                try:
+                    message = receiver.recv()
+                except (EOFError, OSError):
+                    # the worker exited, restarted with a new pipe by _check_workers
+                    self._receivers[self._receivers.index(receiver)] = None
+                    receiver.close()
+                    continue
+                if message[0] == 'ready':
+                    self._on_ready(*message[1:])
+                elif message[0] == 'failed':
+                    self._error = message[3]
+                    self._started.set()
+                else:
+                    self._on_result(*message)
+
+    def submit(self, paths: list[str], img_size: int) -> Future:
+        """Run one job on the next idle worker.
+
+        Args:
+            paths (list[str]): images readable by the workers
+            img_size (int): input size of the network
+
+        Returns:
+            Future: (N, num_classes) probabilities
+
+        Raises:
+            TimeoutError: no worker became idle within `cfg.executor.timeout`
+        """
+        if len(paths) > self.max_batch:
+            raise ValueError(f'{len(paths)} images in a job, at most {self.max_batch}')
+
+        deadline = time.monotonic() + cfg.executor.timeout
+        while True:
+            try:
+                index, generation = self._idle.get(timeout=max(0., deadline - time.monotonic()))
+            except queue.Empty:
+                raise TimeoutError(f'no idle inference worker within {cfg.executor.timeout}s') from None
+            with self._lock:
+                if generation != self._generations[index]:
+                    continue
+                job = uuid.uuid4().hex
+                future = Future()
+                self._jobs[job] = future
+                self._busy[index] = job
+                self._tasks[index].put((job, paths, img_size))
+                return future
+
+    def predict(self, paths: list[str], img_size: int) -> np.ndarray:
+        '''Probabilities of `paths`, in order, split into one job per worker (at most `max_batch` images each).'''
+        size = min(self.max_batch, math.ceil(len(paths) / self.num_workers))
+        futures = [self.submit(paths[i:i + size], img_size) for i in range(0, len(paths), size)]
+        return np.concatenate([x.result(timeout=cfg.executor.timeout) for x in futures])
+
+    def close(self):
+        self._closed = True
+        for tasks in self._tasks:
+            if tasks is not None:
+                tasks.put(None)
+        for process in self._processes:
+            if process is not None:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+        self._collector.join(timeout=5)
+        for job in list(self._jobs):
+            self._jobs.pop(job).set_exception(RuntimeError('inference executor closed'))
+        for shm in self._outputs:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+        for receiver in self._receivers:
+            if receiver is not None:
+                receiver.close()
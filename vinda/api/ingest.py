@@ -0,0 +1,252 @@
+import os
+import json
+import glob
+import pickle
+import shutil
+import multiprocessing
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+
+from PIL import Image
+
+
+## packed layout: `<root>/classes.json` and, per split, `<root>/<split>/images.npy` (N, H, W, 3 uint8)
+## next to `labels.npy` (N int64), read by SimpleData through memory maps
+PACKED_IMAGES = 'images.npy'
+PACKED_LABELS = 'labels.npy'
+PACKED_CLASSES = 'classes.json'
+
+
+def is_packed(root: str) -> bool:
+    return os.path.isfile(os.path.join(root, 'train', PACKED_IMAGES))
+
+
+class Split:
+    '''One split of a source, either decoded images (`images`, N x H x W x 3 uint8)
+    or image files (`files`), with integer `labels` into the class list.'''
+
+    def __init__(self, labels, images: np.ndarray | None = None, files: list[str] | None = None):
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self.images = images
+        self.files = files
+
+    def __len__(self):
+        return len(self.labels)
+
+
+def _to_nhwc(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x)
+    if x.dtype != np.uint8:
+        raise ValueError(f'images should be uint8, got {x.dtype}')
+    if x.ndim == 3:
+        x = np.repeat(x[..., None], 3, axis=-1)
+    elif x.ndim == 4 and x.shape[1] in (1, 3) and x.shape[-1] not in (1, 3):
+        x = x.transpose(0, 2, 3, 1)
+    if x.ndim != 4 or x.shape[-1] not in (1, 3):
+        raise ValueError(f'images should be N x H x W (x 3), got {x.shape}')
+    if x.shape[-1] == 1:
+        x = np.repeat(x, 3, axis=-1)
+    return np.ascontiguousarray(x)
+
+
+def _unpickle(path: str) -> dict:
+    with open(path, 'rb') as fp:
+        return pickle.load(fp, encoding='latin1')
+
+
+def _find(root: str, marker: str) -> str:
+    '''`root` or its subdirectory holding `marker`, so both the archive and its extracted folder work.'''
+    for path in [root] + sorted(glob.glob(os.path.join(root, '*'))):
+        if os.path.exists(os.path.join(path, marker)):
+            return path
+    raise FileNotFoundError(f'{marker} not found under {root}')
+
+
+def load_cifar10(root: str) -> tuple[list[str], dict[str, Split]]:
+    root = _find(root, 'batches.meta')
+    classes = _unpickle(os.path.join(root, 'batches.meta'))['label_names']
+    batches = [_unpickle(os.path.join(root, f'data_batch_{i}')) for i in range(1, 6)]
+    test = _unpickle(os.path.join(root, 'test_batch'))
+    return classes, {
+        'train': Split(
+            np.concatenate([x['labels'] for x in batches]),
+            images=np.concatenate([x['data'] for x in batches]).reshape(-1, 3, 32, 32).transpose(0, 2, 3, 1),
+        ),
+        'val': Split(test['labels'], images=test['data'].reshape(-1, 3, 32, 32).transpose(0, 2, 3, 1)),
+    }
+
+
+def load_cifar100(root: str) -> tuple[list[str], dict[str, Split]]:
+    root = _find(root, 'meta')
+    classes = _unpickle(os.path.join(root, 'meta'))['fine_label_names']
+    splits = {}
+    for split, filename in (('train', 'train'), ('val', 'test')):
+        x = _unpickle(os.path.join(root, filename))
+        splits[split] = Split(x['fine_labels'], images=x['data'].reshape(-1, 3, 32, 32).transpose(0, 2, 3, 1))
+    return classes, splits
+
+
+def load_tinyimagenet(root: str) -> tuple[list[str], dict[str, Split]]:
+    root = _find(root, 'wnids.txt')
+    with open(os.path.join(root, 'wnids.txt'), 'r') as fp:
+        classes = sorted(x.strip() for x in fp if x.strip())
+    class_to_idx = {x: i for i, x in enumerate(classes)}
+
+    train = sorted(glob.glob(os.path.join(root, 'train', '*', 'images', '*.JPEG')))
+    train_labels = [class_to_idx[x.split(os.sep)[-3]] for x in train]
+    val, val_labels = [], []
+    with open(os.path.join(root, 'val', 'val_annotations.txt'), 'r') as fp:
+        for line in fp:
+            filename, wnid = line.split('\t')[:2]
+            val.append(os.path.join(root, 'val', 'images', filename))
+            val_labels.append(class_to_idx[wnid])
+    return classes, {'train': Split(train_labels, files=train), 'val': Split(val_labels, files=val)}
+
+
+def load_arrays(path: str) -> tuple[list[str], dict[str, Split]]:
+    """Load a generic source: a `.npz` file, or a pickle of a dict, with `x_train`,
+    `y_train`, `x_val` (or `x_test`), `y_val` (or `y_test`) and optionally `classes`.
+
+    Images are uint8, N x H x W x C, N x C x H x W or N x H x W (grayscale).
+    """
+    if path.endswith('.npz'):
+        with np.load(path, allow_pickle=False) as npz:
+            data = {k: npz[k] for k in npz.files}
+    else:
+        data = _unpickle(path)
+
+    splits = {}
+    for split, names in (('train', ('train',)), ('val', ('val', 'test'))):
+        name = next((x for x in names if f'x_{x}' in data), None)
+        if name is None:
+            raise KeyError(f"x_{'/x_'.join(names)} not found in {path}")
+        splits[split] = Split(np.asarray(data[f'y_{name}']).reshape(-1), images=_to_nhwc(data[f'x_{name}']))
+    num_classes = int(max(x.labels.max() for x in splits.values())) + 1
+    classes = [str(x) for x in data['classes']] if 'classes' in data else [str(i) for i in range(num_classes)]
+    return classes, splits
+
+
+SOURCES: dict[str, Callable[[str], tuple[list[str], dict[str, Split]]]] = {
+    'cifar10': load_cifar10,
+    'cifar100': load_cifar100,
+    'tinyimagenet': load_tinyimagenet,
+    'array': load_arrays,
+    'pickle': load_arrays,
+}
+
+
+# set in each pool process, inherited without a copy when the pool forks
+_worker_images: dict[str, np.ndarray] = {}
+
+
+def _init_worker(images: dict[str, np.ndarray]):
+    _worker_images.update(images)
+
+
+def _encode_chunk(split: str, paths: list[str], start: int, image_format: str) -> int:
+    images = _worker_images[split]
+    for i, path in enumerate(paths):
+        Image.fromarray(images[start + i]).save(path, format=image_format)
+    return len(paths)
+
+
+def _decode_chunk(files: list[str], size: tuple[int, int] | None) -> np.ndarray:
+    images = []
+    for path in files:
+        with Image.open(path) as img:
+            img = img.convert('RGB')
+            if size is not None and img.size != size:
+                img = img.resize(size, Image.BILINEAR)
+            images.append(np.asarray(img))
+    return np.stack(images)
+
+
+def _pool(num_workers: int, initargs: tuple = ({},)) -> ProcessPoolExecutor:
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    return ProcessPoolExecutor(
+        max_workers=num_workers, mp_context=context, initializer=_init_worker, initargs=initargs
+    )
+
+
+def _chunks(n: int, num_workers: int) -> list[tuple[int, int]]:
+    size = max(1, min(2048, -(-n // (num_workers * 4))))
+    return [(i, min(n, i + size)) for i in range(0, n, size)]
+
+
+def _file_paths(out: str, split: str, classes: list[str], labels: np.ndarray, ext: str) -> list[str]:
+    for name in classes:
+        os.makedirs(os.path.join(out, split, name), exist_ok=True)
+    return [os.path.join(out, split, classes[y], f'{i:06d}{ext}') for i, y in enumerate(labels)]
+
+
+def write_files(
+    out: str, classes: list[str], splits: dict[str, Split], image_format: str = 'png', num_workers: int = 0
+) -> dict:
+    """Write the ImageFolder layout, `<out>/<split>/<class>/<index>.<ext>`.
+
+    Decoded images are encoded by a process pool, image files are hardlinked (or
+    copied) unchanged so JPEG sources are not re-encoded.
+    """
+    num_workers = num_workers or os.cpu_count() or 1
+    ext = '.jpg' if image_format.lower() in ('jpg', 'jpeg') else f'.{image_format.lower()}'
+    counts = {}
+    arrays = {k: x.images for k, x in splits.items() if x.images is not None}
+    with _pool(num_workers, (arrays,)) as executor:
+        futures = []
+        for split, x in splits.items():
+            if x.images is None:
+                paths = _file_paths(out, split, classes, x.labels, os.path.splitext(x.files[0])[1].lower())
+                for src, dest in zip(x.files, paths):
+                    try:
+                        os.link(src, dest)
+                    except OSError:
+                        shutil.copyfile(src, dest)
+            else:
+                paths = _file_paths(out, split, classes, x.labels, ext)
+                fmt = 'JPEG' if ext == '.jpg' else image_format.upper()
+                futures += [executor.submit(_encode_chunk, split, paths[a:b], a, fmt) for a, b in _chunks(len(x), num_workers)]
+            counts[split] = len(x)
+        for future in futures:
+            future.result()
+    return counts
+
+
+def write_packed(
+    out: str, classes: list[str], splits: dict[str, Split], size: int | None = None, num_workers: int = 0
+) -> dict:
+    """Write the packed layout, see `PACKED_IMAGES`. Image files are decoded by a process
+    pool straight into the memory-mapped output, resized to `size` (or the size of the
+    first image) when they differ.
+    """
+    num_workers = num_workers or os.cpu_count() or 1
+    counts = {}
+    for split, x in splits.items():
+        os.makedirs(os.path.join(out, split), exist_ok=True)
+        images_path = os.path.join(out, split, PACKED_IMAGES)
+        if x.images is not None and size is None:
+            np.save(images_path, x.images)
+        else:
+            if x.images is not None:
+                raise ValueError('resizing is only supported for image file sources')
+            with Image.open(x.files[0]) as img:
+                target = (size, size) if size else img.size
+            images = np.lib.format.open_memmap(
+                images_path, mode='w+', dtype=np.uint8, shape=(len(x), target[1], target[0], 3)
+            )
+            with _pool(num_workers) as executor:
+                chunks = _chunks(len(x), num_workers)
+                results = executor.map(_decode_chunk, [x.files[a:b] for a, b in chunks], [target] * len(chunks))
+                for (a, b), result in zip(chunks, results):
+                    images[a:b] = result
+            images.flush()
+            del images
+        np.save(os.path.join(out, split, PACKED_LABELS), x.labels)
+        counts[split] = len(x)
+
+    with open(os.path.join(out, PACKED_CLASSES), 'w') as fp:
+        json.dump(classes, fp)
+    return counts
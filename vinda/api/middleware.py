@@ -0,0 +1,133 @@
+import time
+import uuid
+import bisect
+
+from contextvars import ContextVar
+from collections import defaultdict
+
+from loguru import logger
+from starlette.routing import Match
+
+from vinda.api.config import cfg
+
+
+## set for the duration of an api request or a worker task, sent along in celery task headers
+request_id_var: ContextVar[str | None] = ContextVar('request_id', default=None)
+
+
+class RouteStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(cfg.metrics.buckets_ms) + 1)
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+    def observe(self, elapsed_ms: float, status: int, request_bytes: int, response_bytes: int):
+        self.count += 1
+        self.errors += status >= 500
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.buckets[bisect.bisect_left(cfg.metrics.buckets_ms, elapsed_ms)] += 1
+        self.request_bytes += request_bytes
+        self.response_bytes += response_bytes
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'in_flight': self.in_flight,
+            'avg_ms': self.total_ms / self.count if self.count else 0.0,
+            'max_ms': self.max_ms,
+            # cumulative, like prometheus `le` buckets
+            'buckets_ms': dict(zip(
+                [str(x) for x in cfg.metrics.buckets_ms] + ['+Inf'],
+                [sum(self.buckets[:i + 1]) for i in range(len(self.buckets))],
+            )),
+            'request_bytes': self.request_bytes,
+            'response_bytes': self.response_bytes,
+        }
+
+
+## per (method, route template), for this api process
+route_stats: dict[tuple[str, str], RouteStats] = defaultdict(RouteStats)
+
+
+def snapshot() -> dict:
+    return {f'{method} {path}': x.to_dict() for (method, path), x in sorted(route_stats.items())}
+
+
+class TimingMiddleware:
+    '''Pure ASGI middleware, so streaming responses are timed until their last byte.
+
+    Records per-route latency histograms, in-flight counts and body sizes, tags
+    every request with an `X-Request-ID`, and logs the timing breakdown of
+    requests slower than `cfg.metrics.slow_ms`.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    def route_of(scope) -> str:
+        for route in scope['app'].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return 'unmatched'
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope['headers'])
+        rid = headers.get(b'x-request-id', b'').decode() or uuid.uuid4().hex
+        token = request_id_var.set(rid)
+        stats = route_stats[(scope['method'], self.route_of(scope))]
+        stats.in_flight += 1
+
+        start = time.perf_counter()
+        timing = {'received': None, 'response_start': None}
+        sizes = {'request': 0, 'response': 0}
+        status = 500
+
+        async def receive_wrapper():
+            message = await receive()
+            if message['type'] == 'http.request':
+                sizes['request'] += len(message.get('body', b''))
+                if not message.get('more_body', False):
+                    timing['received'] = time.perf_counter()
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                timing['response_start'] = time.perf_counter()
+                message['headers'] = list(message.get('headers', [])) + [(b'x-request-id', rid.encode())]
+            elif message['type'] == 'http.response.body':
+                sizes['response'] += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            end = time.perf_counter()
+            elapsed_ms = (end - start) * 1000
+            stats.in_flight -= 1
+            stats.observe(elapsed_ms, status, sizes['request'], sizes['response'])
+            request_id_var.reset(token)
+
+            if elapsed_ms > cfg.metrics.slow_ms:
+                received = timing['received'] or start
+                response_start = timing['response_start'] or end
+                logger.warning(
+                    f"slow request {rid}: {scope['method']} {scope['path']} -> {status} "
+                    f"total={elapsed_ms:.1f}ms receive={(received - start) * 1000:.1f}ms "
+                    f"handler={(response_start - received) * 1000:.1f}ms "
+                    f"send={(end - response_start) * 1000:.1f}ms "
+                    f"in={sizes['request']}B out={sizes['response']}B"
+                )
@@ -1,25 +1,101 @@
 import os
+import json
+import time
 # import cv2
 import onnxruntime
 import numpy as np
 
-from vinda.api.utils import Timer
-from vinda.api.trainer import ImageTransform
+from vinda.api.config import cfg
+from vinda.api.utils import Timer, track_peak_rss
+from vinda.api.transforms import EvalTransform, IMAGENET_MEAN, IMAGENET_STD
 from vinda.api.pattern import SingletonBase
 
+
+## graph optimizations applied before saving an ORT format model, see `save_ort_model`
+ORT_OPTIMIZATION_LEVELS = {
+    'basic': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+
+def ort_model_path(onnxfile: str) -> str:
+    return os.path.splitext(onnxfile)[0] + '.ort'
+
+
+def find_ort_model(onnxfile: str) -> str | None:
+    '''The pre-optimized `.ort` next to an onnx model, unless it is older than the model.'''
+    path = ort_model_path(onnxfile)
+    if path != onnxfile and os.path.isfile(path) and os.path.getmtime(path) >= os.path.getmtime(onnxfile):
+        return path
+    return None
+
+
+def external_data_path(onnxfile: str) -> str:
+    '''Weights file of a model exported with `ExportConfig.external_data`.'''
+    return onnxfile + '.data'
+
+
+def save_ort_model(onnxfile: str, ortfile: str | None = None, level: str = 'all') -> str:
+    """Save an onnx model in the ORT format with its graph optimizations already applied,
+    so loading it skips protobuf parsing and the graph transformers.
+
+    Sessions do not re-run the layout optimizations of `all` (NCHWc) on ORT format models,
+    an artifact saved at a lower level therefore runs slower on CPU. `all` artifacts are
+    specific to the CPU they were saved on (vector width), save them on the node class
+    that serves them.
+
+    Args:
+        onnxfile (str): onnx model
+        ortfile (str): output, `ort_model_path(onnxfile)` by default
+        level (str): key of `ORT_OPTIMIZATION_LEVELS`
+
+    Returns:
+        str: path of the ORT format model
+    """
+    ortfile = ortfile or ort_model_path(onnxfile)
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = ORT_OPTIMIZATION_LEVELS[level]
+    options.optimized_model_filepath = ortfile
+    options.add_session_config_entry('session.save_model_format', 'ORT')
+    onnxruntime.InferenceSession(onnxfile, options, providers=['CPUExecutionProvider'])
+    return ortfile
+
+
 class OrtEngine:
     '''模型'''
     _TIMER_STAGE = ('PreProcess', 'Forward', 'PostProcess')
 
-    def __init__(self, onnxfile):
+    def __init__(self, onnxfile, prefer_ort: bool = True, share_weights: bool | None = None, num_threads: int = 0):
         self._file = onnxfile
-        self._sess = onnxruntime.InferenceSession(onnxfile)
+        # the model actually loaded, the pre-optimized ORT format one when it exists
+        self._model_file = (prefer_ort and find_ort_model(onnxfile)) or onnxfile
+        # onnxruntime memory-maps external data, the page cache then holds one copy of the
+        # weights for every process, unless the NCHWc layout transform (level all) or
+        # prepacking copy them into private buffers
+        self._external_data = os.path.isfile(external_data_path(self._model_file))
+        self._shared_weights = self._external_data and (cfg.infer.share_weights if share_weights is None else share_weights)
+        options = onnxruntime.SessionOptions()
+        # 0 lets onnxruntime use every core, processes sharing a node pass their share
+        options.intra_op_num_threads = num_threads
+        if self._shared_weights:
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+            options.add_session_config_entry('session.disable_prepacking', '1')
+        with track_peak_rss() as memory:
+            start = time.perf_counter()
+            self._sess = onnxruntime.InferenceSession(self._model_file, options)
+            self._load_ms = (time.perf_counter() - start) * 1000
+        self._load_peak_mb = memory['peak_mb']
         self._timer = Timer.new(*OrtEngine._TIMER_STAGE)
 
     def computation_metrics(self):
         device = onnxruntime.get_device()
         metrics = {
-            'Evaluating Model': os.path.basename(self._file),
+            'Evaluating Model': os.path.basename(self._model_file),
+            'Model Format': 'ORT' if self._model_file.endswith('.ort') else 'ONNX',
+            'Weights': 'shared (mmap)' if self._shared_weights else 'mmap' if self._external_data else 'private',
+            'Load Time': f'{self._load_ms:.3f} ms',
+            'Load Peak Memory': 'n/a' if self._load_peak_mb is None else f'{self._load_peak_mb:.1f} MB',
             'Inputs': [f'{x.name}={x.shape}' for x in self._sess.get_inputs()],
             'Outputs': [f'{x.name}={x.shape}' for x in self._sess.get_outputs()],
             'Total Calls': self._timer['Forward'].calls,
@@ -65,15 +141,17 @@ class OrtEngine:
     
 
 class OrtClsInfer(OrtEngine):
-    def __init__(self, onnxfile: str):
-        super(OrtClsInfer, self).__init__(onnxfile)
+    def __init__(self, onnxfile: str, prefer_ort: bool = True, share_weights: bool | None = None, num_threads: int = 0):
+        super(OrtClsInfer, self).__init__(onnxfile, prefer_ort, share_weights, num_threads)
         self._x = self._sess.get_inputs()[0].name
         self._y = self._sess.get_outputs()[0].name
+        meta = self._sess.get_modelmeta().custom_metadata_map
+        self._mean = tuple(json.loads(meta['mean'])) if 'mean' in meta else IMAGENET_MEAN
+        self._std = tuple(json.loads(meta['std'])) if 'std' in meta else IMAGENET_STD
 
     def __call__(self, image, img_size: int):
         with self._timer['PreProcess'].tic_and_toc():
-            tensor = ImageTransform(is_train=False, img_size=img_size)(image)
-            tensor = tensor.unsqueeze(0).numpy()
+            tensor = EvalTransform(img_size, self._mean, self._std)(image)[np.newaxis]
    
         with self._timer['Forward'].tic_and_toc():
             preds = self._sess.run([self._y], input_feed={
@@ -85,7 +163,33 @@ class OrtClsInfer(OrtEngine):
    
         return ret
 
+    def predict_batch(self, images: list, img_size: int) -> np.ndarray:
+        """Class probabilities of a batch of images, in one forward pass.
+
+        Args:
+            images (list): PIL images
+            img_size (int): input size of the network
+
+        Returns:
+            np.ndarray: (N, num_classes) softmax probabilities
+        """
+        with self._timer['PreProcess'].tic_and_toc():
+            transform = EvalTransform(img_size, self._mean, self._std)
+            tensor = np.stack([transform(x) for x in images])
+
+        with self._timer['Forward'].tic_and_toc():
+            logits = self._sess.run([self._y], input_feed={self._x: tensor})[0]
+
+        with self._timer['PostProcess'].tic_and_toc():
+            logits = logits - logits.max(axis=1, keepdims=True)
+            probs = np.exp(logits)
+            probs /= probs.sum(axis=1, keepdims=True)
+
+        return probs
+
 
 class OnnxGlobalInfer(metaclass=SingletonBase):
     def __init__(self):
-        self.cls_engine: OrtClsInfer = None
\ No newline at end of file
+        self.cls_engine: OrtClsInfer = None
+        # InferenceExecutor of /infer_cls_batch, see vinda.api.executor
+        self.cls_executor = None
\ No newline at end of file
@@ -4,6 +4,7 @@ from vinda.api import schemas
 from loguru import logger
 from traceback import format_exception
 from fastapi import HTTPException
+from starlette.responses import Response
 
 
 class SingletonBase(type):
@@ -20,8 +21,15 @@ def response_handle(func):
     async def wrapper(*args, **kwargs):
         response = schemas.Response()
         try:
-            response.data = await func(*args, **kwargs)
+            data = await func(*args, **kwargs)
+            # e.g. 304 Not Modified, returned as is
+            if isinstance(data, Response):
+                return data
+            response.data = data
             return response.model_dump()
+        except HTTPException:
+            # a status chosen by the endpoint, e.g. 503 when it is overloaded
+            raise
         except Exception as e:
             response.code = -1
             response.message = str(e)
@@ -38,13 +38,32 @@ class TrainingConfig(BaseModel):
     pretrain_model: str = Field('', description='预训练模型')
     img_size: int = Field(224, description='输入网络的图像尺寸（自动resize）')
     epochs: int = Field(100, description='训练周期数')
+    max_minutes: Optional[float] = Field(default=None, description='训练时间预算（分钟），超时后停止训练并完整验证', gt=0)
+    early_stop_patience: Optional[int] = Field(default=None, description='val_acc 连续多少次完整验证未提升时提前停止', gt=0)
+    val_fraction: float = Field(1.0, description='快速验证使用的验证集比例，1表示每个周期都完整验证', gt=0, le=1)
+    full_val_interval: int = Field(5, description='完整验证的间隔（按周期计算），最后一个周期总是完整验证', gt=0)
     save_interval: int = Field(1, description='保存模型的间隔（按周期计算）')
     batch_size: int = Field(8, description='每批处理的样本数量')
     num_workers: int = Field(0, description='工作进程数')
     gpu_ids: Optional[list] = Field(default=None, description='使用的GPU编号列表')
     n_gpu: Optional[int] = Field(default=None, description='使用的GPU数量')
     seed: int = Field(42, description='随机种子，用于结果的可复现性')
+    cpu_processes: int = Field(1, description='无GPU时每个节点的训练进程数，大于1时以gloo后端DDP训练并为各进程划分CPU核心', ge=1)
+    num_nodes: int = Field(1, description='参与训练的节点数，多机时每个节点各提交一次任务', ge=1)
+    node_rank: int = Field(0, description='当前节点编号', ge=0)
+    master_addr: str = Field('127.0.0.1', description='静态rendezvous地址（node_rank=0的节点）')
+    master_port: int = Field(29500, description='静态rendezvous端口')
     solver: SolverConfig = Field(default_factory=SolverConfig, description='训练过程中使用的优化器配置')
+    teacher_model: str = Field('', description='教师模型checkpoint路径，非空时以知识蒸馏方式训练 name_model')
+    distill_temperature: float = Field(4.0, description='蒸馏温度', gt=0)
+    distill_alpha: float = Field(0.9, description='蒸馏损失权重，其余为交叉熵损失', ge=0, le=1)
+    cache_teacher_logits: bool = Field(True, description='预先计算并缓存教师模型在训练集上的输出（不含数据增强）')
+    use_dataset_stats: bool = Field(False, description='使用 analyze_dataset 的结果：跳过损坏的图片，并以数据集的均值/方差归一化')
+    draft_decode: bool = Field(True, description='JPEG 图片直接以接近输入尺寸的分辨率解码（DCT 缩放），大图解码更快')
+    profile: bool = Field(False, description='开启训练性能分析，结果随任务返回')
+    profile_skip: int = Field(5, description='性能分析开始前跳过的训练步数（预热）', ge=0)
+    profile_steps: int = Field(20, description='性能分析记录的训练步数', gt=0)
+    priority: int = Field(5, description='任务优先级，0最低，9最高，同一队列中优先级高的任务先执行', ge=0, le=9)
 
     # 你需要在初始化时手动检查 gpu_ids 和 n_gpu 的互斥性。
     def __init__(self, **data):
@@ -61,9 +80,61 @@ class ExportConfig(BaseModel):
     path_param: str = Field('/data/output/lightning_logs/version_9/hparams.yaml', description='配置路径')
     tag: str = Field('cls_', description='标签')
     format: str = Field('onnx', description='模型导出格式,目前仅支持onnx')
+    ort: bool = Field(False, description='同时生成图优化后的ORT格式模型（.ort），推理引擎加载时优先使用')
+    external_data: bool = Field(False, description='权重另存为外部数据文件（.onnx.data），推理时内存映射加载，多个API进程共享同一份权重')
+
+    def __init__(self, **data):
+        super().__init__(**data)
+        # ORT格式模型内嵌权重，无法内存映射共享
+        if self.ort and self.external_data:
+            raise ValueError("Only one of 'ort' or 'external_data' should be set.")
 
 
 class InferenceConfig(BaseModel):
     path_model: str = Field('/data/output/exported/model-xx.onnx', description='onnx模型路径')
     path_image: str = Field('/data/output/example.jpg', description='测试图片路径')
-    img_size: int = Field(224, description='输入网络的图像尺寸（自动resize）')
\ No newline at end of file
+    img_size: int = Field(224, description='输入网络的图像尺寸（自动resize）')
+
+
+class BatchInferenceConfig(BaseModel):
+    path_model: str = Field('/data/output/exported/model-xx.onnx', description='onnx模型路径')
+    path_images: List[str] = Field(..., description='测试图片路径列表，一次前向推理', min_length=1, max_length=256)
+    img_size: int = Field(224, description='输入网络的图像尺寸（自动resize）')
+    top_k: int = Field(1, description='每张图片返回的类别数', ge=1)
+
+
+class UploadConfig(BaseModel):
+    filename: str = Field(..., description='上传的数据集压缩包文件名（zip）')
+    size: int = Field(..., description='文件总字节数', gt=0)
+    name: str = Field('', description='解压后的数据集名称，为空时使用压缩包内的顶层目录名')
+
+
+class ManifestEntry(BaseModel):
+    path: str = Field(..., description='相对数据集根目录的文件路径，如 train/cat/001.jpg')
+    size: int = Field(..., description='文件字节数', ge=0)
+    sha256: str = Field(..., description='文件内容的sha256')
+
+
+class SyncConfig(BaseModel):
+    files: List[ManifestEntry] = Field(..., description='客户端数据集清单')
+    delete: bool = Field(True, description='删除服务端存在但清单中没有的文件')
+
+
+class TaskStatesQuery(BaseModel):
+    task_ids: List[str] = Field(..., description='任务ID列表', min_length=1, max_length=1000)
+    include_result: bool = Field(False, description='是否返回完整的任务结果，默认只返回状态')
+
+
+class AnalyzeConfig(BaseModel):
+    dataset: str = Field(..., description='数据集路径')
+    num_workers: int = Field(0, description='扫描进程数，0表示使用配置中的默认值', ge=0)
+    max_distance: int = Field(4, description='感知哈希距离（比特）不超过该值的图片视为近似重复', ge=0, le=8)
+
+
+class BenchmarkConfig(BaseModel):
+    models: List[str] = Field(default_factory=list, description='待测模型名称（支持通配符），为空时使用配置中的候选列表')
+    img_sizes: List[int] = Field(default_factory=list, description='输入尺寸列表，为空时使用配置中的默认值')
+    batch_sizes: List[int] = Field(default_factory=list, description='批大小列表，为空时使用配置中的默认值')
+    num_threads: int = Field(0, description='CPU线程数，0表示使用全部核心', ge=0)
+    repeat: int = Field(10, description='计时重复次数，取中位数', gt=0)
+    force: bool = Field(False, description='忽略缓存，重新测试所有模型')
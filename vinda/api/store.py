@@ -0,0 +1,99 @@
+import os
+import uuid
+import errno
+import shutil
+
+from vinda.api.config import cfg
+
+
+## hardlinks are impossible across filesystems, where unsupported, or past the per-inode link limit
+_LINK_ERRORS = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP)
+
+
+def blob_path(sha256: str) -> str:
+    return os.path.join(cfg.store.blobs, sha256[:2], sha256[2:])
+
+
+def has_blob(sha256: str) -> bool:
+    return os.path.isfile(blob_path(sha256))
+
+
+def _link_or_copy(src: str, dest: str) -> bool:
+    '''Atomically create `dest` as a hardlink of `src`, or a copy when linking fails.
+
+    Returns:
+        bool: whether `dest` shares the inode of `src`
+    '''
+    tmp = f'{dest}.{uuid.uuid4().hex}.tmp'
+    try:
+        os.link(src, tmp)
+        linked = True
+    except OSError as e:
+        if e.errno not in _LINK_ERRORS:
+            raise
+        shutil.copyfile(src, tmp)
+        linked = False
+    os.replace(tmp, dest)
+    return linked
+
+
+def put_file(path: str, sha256: str) -> str:
+    """Store a dataset file in the blob store and make the file a hardlink of its blob.
+
+    A new blob takes the inode of the file, a known one replaces the file, so every
+    copy of the same content is one inode on disk and in the page cache. Blobs are
+    read-only; datasets change by replacing files, never by writing into them.
+
+    Args:
+        path (str): file inside a dataset
+        sha256 (str): its content hash
+
+    Returns:
+        str: 'linked' when the file now shares an existing blob, 'stored' when it
+            became a new blob, 'copied' when the store is not linkable
+    """
+    blob = blob_path(sha256)
+    if os.path.isfile(blob):
+        if os.path.samestat(os.stat(blob), os.stat(path)):
+            return 'linked'
+        return 'linked' if _link_or_copy(blob, path) else 'copied'
+
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    os.chmod(path, 0o444)
+    # a concurrent ingest of the same content may replace the blob, both inodes stay valid
+    _link_or_copy(path, blob)
+    return 'stored'
+
+
+def materialize(sha256: str, dest: str) -> bool:
+    '''Create `dest` from a stored blob, return whether it is a hardlink.'''
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    return _link_or_copy(blob_path(sha256), dest)
+
+
+def gc(dry_run: bool = False) -> dict:
+    """Remove blobs no dataset links to any more (link count 1: only the store itself).
+
+    Args:
+        dry_run (bool): only count what would be removed
+
+    Returns:
+        dict: number of blobs and bytes kept and removed
+    """
+    stats = {'kept': 0, 'kept_bytes': 0, 'removed': 0, 'removed_bytes': 0}
+    if not os.path.isdir(cfg.store.blobs):
+        return stats
+    for prefix in os.scandir(cfg.store.blobs):
+        if not prefix.is_dir():
+            continue
+        for blob in os.scandir(prefix.path):
+            st = blob.stat()
+            if blob.name.endswith('.tmp') or st.st_nlink > 1:
+                stats['kept'] += 1
+                stats['kept_bytes'] += st.st_size
+                continue
+            if not dry_run:
+                os.remove(blob.path)
+            stats['removed'] += 1
+            stats['removed_bytes'] += st.st_size
+    return stats
@@ -1,20 +1,39 @@
 import os
+import json
+import time
+import hashlib
+import functools
+import contextlib
+from datetime import timedelta
 
 import timm
+import yaml
 import torch
+import numpy as np
 import torch.nn as nn
+import torch.nn.functional as F
 import torchvision.transforms as transforms
 from PIL import Image
 from pytorch_lightning import LightningDataModule, LightningModule, Trainer
 from pytorch_lightning.loggers import TensorBoardLogger
-from pytorch_lightning.callbacks import LearningRateMonitor, ModelCheckpoint
+from pytorch_lightning.callbacks import Callback, EarlyStopping, LearningRateMonitor, ModelCheckpoint
+from pytorch_lightning.strategies import DDPStrategy
+from pytorch_lightning.strategies.launchers import _MultiProcessingLauncher
+from pytorch_lightning.trainer.states import TrainerFn
+from lightning_utilities.core.apply_func import apply_to_collection
 # from pytorch_lightning.utilities.seed import seed_everything
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Dataset, DistributedSampler, Subset
 from torchmetrics import Accuracy
 from torchvision.datasets import ImageFolder
 
 from vinda.api import schemas
+from vinda.api import db
 from vinda.api.config import cfg
+from vinda.api.utils import Timer
+from vinda.api.transforms import IMAGENET_MEAN, IMAGENET_STD, decode_image
+from vinda.api.analysis import IMG_EXTENSIONS, load_stats
+from vinda.api.ingest import PACKED_CLASSES, PACKED_IMAGES, PACKED_LABELS, is_packed
+from vinda.api.worker.control import is_cancelled
 from celery import current_task
 
 from loguru import logger
@@ -62,6 +81,8 @@ def get_lr_scheduler_config(solver_config : schemas.SolverConfig, optimizer: tor
             'monitor': 'val_loss',
             'interval': 'epoch',
             'frequency': 1,
+            # val_loss is only logged on full validations
+            'strict': False,
         }
     else:
         raise NotImplementedError
@@ -70,7 +91,7 @@ def get_lr_scheduler_config(solver_config : schemas.SolverConfig, optimizer: tor
 
 
 class ImageTransform:
-    def __init__(self, is_train: bool, img_size: int | tuple = 112):
+    def __init__(self, is_train: bool, img_size: int | tuple = 112, mean: tuple = IMAGENET_MEAN, std: tuple = IMAGENET_STD):
         if isinstance(img_size, int):
             img_size = (img_size, img_size)
 
@@ -82,7 +103,7 @@ class ImageTransform:
                     transforms.Resize(img_size),
                     transforms.ToTensor(),
                     transforms.Normalize(
-                        mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]
+                        mean=mean, std=std
                     ),
                 ]
             )
@@ -92,7 +113,7 @@ class ImageTransform:
                     transforms.Resize(img_size),
                     transforms.ToTensor(),
                     transforms.Normalize(
-                        mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]
+                        mean=mean, std=std
                     ),
                 ]
             )
@@ -101,6 +122,48 @@ class ImageTransform:
         return self.transform(img)
 
 
+class IndexedImageFolder(ImageFolder):
+    '''ImageFolder that also yields the sample index, used to look up cached teacher logits.'''
+
+    def __getitem__(self, index: int):
+        sample, target = super().__getitem__(index)
+        return sample, target, index
+
+
+class PackedImages(Dataset):
+    '''A split written by `vinda ingest --format packed`, read through a memory map.
+
+    Same interface as ImageFolder: `classes`, `class_to_idx`, `samples` and (image, target) items.
+    '''
+
+    def __init__(self, root: str, classes: list[str], transform=None, return_index: bool = False):
+        self.images_path = os.path.join(root, PACKED_IMAGES)
+        self.labels = np.load(os.path.join(root, PACKED_LABELS))
+        self.classes = classes
+        self.class_to_idx = {x: i for i, x in enumerate(classes)}
+        self.samples = [(f'{self.images_path}:{i}', int(y)) for i, y in enumerate(self.labels)]
+        self.transform = transform
+        self.return_index = return_index
+        self._images = None
+
+    def __getstate__(self):
+        # dataloader workers map the file again instead of receiving a copy
+        return {**self.__dict__, '_images': None}
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def __getitem__(self, index: int):
+        if self._images is None:
+            self._images = np.load(self.images_path, mmap_mode='r')
+        sample = Image.fromarray(np.asarray(self._images[index]))
+        if self.transform is not None:
+            sample = self.transform(sample)
+        if self.return_index:
+            return sample, int(self.labels[index]), index
+        return sample, int(self.labels[index])
+
+
 class SimpleData(LightningDataModule):
     def __init__(
         self,
@@ -108,39 +171,104 @@ class SimpleData(LightningDataModule):
         img_size: int = 112,
         batch_size: int = 8,
         num_workers: int = 16,
+        return_index: bool = False,
+        val_fraction: float = 1.,
+        full_val_interval: int = 1,
+        seed: int = 42,
+        use_stats: bool = False,
+        draft_decode: bool = True,
     ):
         super().__init__()
         self.root_dir = root_dir
         self.img_size = img_size
+        # JPEGs decoded near img_size instead of at full resolution, see transforms.decode_image
+        self.loader = functools.partial(decode_image, img_size=img_size, draft=draft_decode)
         self.batch_size = batch_size
         self.num_workers = num_workers
-
-        self.train_dataset = ImageFolder(
-            root=os.path.join(root_dir, 'train'),
-            transform=ImageTransform(is_train=True, img_size=self.img_size),
+        self.val_fraction = val_fraction
+        self.full_val_interval = full_val_interval
+        self.seed = seed
+        # whether the current val_dataloader covers the whole validation set
+        self.full_validation = True
+        self.force_full_validation = False
+
+        # results of the analyze_dataset task: skip corrupt files, normalize with the dataset mean/std
+        self.mean, self.std, self.is_valid_file = IMAGENET_MEAN, IMAGENET_STD, None
+        stats = load_stats(root_dir) if use_stats else None
+        if use_stats and stats is None:
+            logger.warning(f'no dataset stats under {root_dir}, run analyze_dataset first')
+        if stats is not None:
+            corrupt = {os.path.join(root_dir, x['path']) for x in stats['corrupt']}
+            self.is_valid_file = lambda x: x.lower().endswith(IMG_EXTENSIONS) and x not in corrupt
+            if stats['mean'] is not None:
+                self.mean, self.std = tuple(stats['mean']), tuple(stats['std'])
+            logger.info(f'dataset stats: skip {len(corrupt)} corrupt files, mean={self.mean}, std={self.std}')
+
+        self.train_dataset = self.make_dataset(
+            'train', ImageTransform(is_train=True, img_size=self.img_size, mean=self.mean, std=self.std), return_index
         )
-        self.val_dataset = ImageFolder(
-            root=os.path.join(root_dir, 'val'),
-            transform=ImageTransform(is_train=False, img_size=self.img_size),
+        self.val_dataset = self.make_dataset(
+            'val', ImageTransform(is_train=False, img_size=self.img_size, mean=self.mean, std=self.std)
         )
         self.classes = self.train_dataset.classes
         self.class_to_idx = self.train_dataset.class_to_idx
 
+        num_quick = max(1, int(len(self.val_dataset) * val_fraction))
+        generator = torch.Generator().manual_seed(seed)
+        self.quick_val_dataset = Subset(
+            self.val_dataset, torch.randperm(len(self.val_dataset), generator=generator)[:num_quick].tolist()
+        )
+
+    def make_dataset(self, split: str, transform: ImageTransform, return_index: bool = False) -> Dataset:
+        '''ImageFolder of `<root>/<split>`, or its packed arrays when the dataset was ingested packed.'''
+        if is_packed(self.root_dir):
+            with open(os.path.join(self.root_dir, PACKED_CLASSES), 'r') as fp:
+                classes = json.load(fp)
+            return PackedImages(os.path.join(self.root_dir, split), classes, transform, return_index)
+        folder = IndexedImageFolder if return_index else ImageFolder
+        return folder(
+            root=os.path.join(self.root_dir, split), transform=transform, loader=self.loader,
+            is_valid_file=self.is_valid_file,
+        )
+
+    def _is_full_validation(self) -> bool:
+        if self.val_fraction >= 1. or self.force_full_validation or self.trainer is None:
+            return True
+        epoch = self.trainer.current_epoch
+        return (epoch + 1) % self.full_val_interval == 0 or epoch + 1 >= self.trainer.max_epochs
+
+    def _sampler(self, dataset: Dataset, shuffle: bool) -> DistributedSampler | None:
+        # each process of a distributed run reads its own shard
+        if self.trainer is None or self.trainer.world_size <= 1:
+            return None
+        return DistributedSampler(
+            dataset,
+            num_replicas=self.trainer.world_size,
+            rank=self.trainer.global_rank,
+            shuffle=shuffle,
+            drop_last=shuffle,
+        )
+
     def train_dataloader(self) -> DataLoader:
+        sampler = self._sampler(self.train_dataset, shuffle=True)
         dataloader = DataLoader(
             self.train_dataset,
             batch_size=self.batch_size,
-            shuffle=True,
+            shuffle=sampler is None,
+            sampler=sampler,
             drop_last=True,
             num_workers=self.num_workers,
         )
         return dataloader
 
     def val_dataloader(self) -> DataLoader:
+        self.full_validation = self._is_full_validation()
+        dataset = self.val_dataset if self.full_validation else self.quick_val_dataset
         dataloader = DataLoader(
-            self.val_dataset,
+            dataset,
             batch_size=self.batch_size,
             shuffle=False,
+            sampler=self._sampler(dataset, shuffle=False),
             drop_last=False,
             num_workers=self.num_workers,
         )
@@ -190,6 +318,8 @@ class SimpleModel(LightningModule):
         model_name: str = 'resnet18',
         pretrained: bool = False,
         num_classes: int | None = None,
+        mean: tuple = IMAGENET_MEAN,
+        std: tuple = IMAGENET_STD,
     ):
         super().__init__()
         self.solver_config = solver_config
@@ -201,48 +331,63 @@ class SimpleModel(LightningModule):
         self.train_acc = Accuracy(task='multiclass', num_classes=num_classes)
         self.val_loss = nn.CrossEntropyLoss()
         self.val_acc = Accuracy(task='multiclass', num_classes=num_classes)
+        # set by StepProfiler while it records a step
+        self.phase_timers: dict[str, Timer] | None = None
 
     def forward(self, x):
         return self.model(x)
 
+    def phase_timer(self, name: str):
+        if self.phase_timers is None:
+            return contextlib.nullcontext()
+        return self.phase_timers[name].tic_and_toc()
+
+    def training_loss(self, out, batch):
+        return self.train_loss(out, batch[1])
+
     def training_step(self, batch, batch_idx):
-        x, target = batch
+        x, target = batch[0], batch[1]
 
         out = self(x)
         _, pred = out.max(1)
 
-        loss = self.train_loss(out, target)
+        loss = self.training_loss(out, batch)
         acc = self.train_acc(pred, target)
-        self.log_dict({'train_loss': loss, 'train_acc': acc}, prog_bar=True)
 
-        meta_info = {
-            'stage': 'training',
-            'current_epoch': self.current_epoch,
-            'max_epochs': self.trainer.max_epochs,
-            'current_batch': batch_idx,
-            'num_batches': self.trainer.num_training_batches,
-            'loss': loss.item(),
-            'acc': acc.item(),
-        }
-        
-        current_task.update_state(
-            state='PROGRESS',
-            meta=meta_info
-        )
-        
+        with self.phase_timer('logging'):
+            self.log_dict({'train_loss': loss, 'train_acc': acc}, prog_bar=True)
+
+            meta_info = {
+                'stage': 'training',
+                'current_epoch': self.current_epoch,
+                'max_epochs': self.trainer.max_epochs,
+                'current_batch': batch_idx,
+                'num_batches': self.trainer.num_training_batches,
+                'loss': loss.item(),
+                'acc': acc.item(),
+            }
+
+            if self.trainer.is_global_zero:
+                current_task.update_state(
+                    state='PROGRESS',
+                    meta=meta_info
+                )
+
         # logger.debug(meta_info)
 
         return loss
 
     def validation_step(self, batch, batch_idx):
-        x, target = batch
+        x, target = batch[0], batch[1]
 
         out = self(x)
         _, pred = out.max(1)
 
         loss = self.val_loss(out, target)
         acc = self.val_acc(pred, target)
-        self.log_dict({'val_loss': loss, 'val_acc': acc})
+        # quick validations on a subset are logged apart, checkpoints only follow val_acc
+        prefix = 'val' if getattr(self.trainer.datamodule, 'full_validation', True) else 'val_quick'
+        self.log_dict({f'{prefix}_loss': loss, f'{prefix}_acc': acc}, sync_dist=True)
 
         meta_info = {
             'stage': 'validation',
@@ -253,15 +398,16 @@ class SimpleModel(LightningModule):
             'loss': loss.item(),
             'acc': acc.item(),
         }
-        
-        current_task.update_state(
-            state='PROGRESS',
-            meta=meta_info
-        )
+
+        if self.trainer.is_global_zero:
+            current_task.update_state(
+                state='PROGRESS',
+                meta=meta_info
+            )
 
         # logger.debug(meta_info)
 
-        if batch_idx == 1:
+        if batch_idx == 1 and self.trainer.is_global_zero:
             tb_logger = None
             for tlogger in self.trainer.loggers:
                 if isinstance(tlogger, TensorBoardLogger):
@@ -275,14 +421,435 @@ class SimpleModel(LightningModule):
             
 
     def configure_optimizers(self):
-        optimizer = get_optimizer(self.solver_config, self.parameters())
+        optimizer = get_optimizer(self.solver_config, self.model.parameters())
         lr_scheduler_config = get_lr_scheduler_config(self.solver_config, optimizer)
         return {"optimizer": optimizer, "lr_scheduler": lr_scheduler_config}
 
 
-def get_basic_callbacks(checkpoint_interval: int = 1) -> list:
+def load_cls_model(path_model: str, path_param: str | None = None) -> SimpleModel:
+    """Rebuild a trained SimpleModel from a lightning checkpoint.
+
+    Args:
+        path_model (str): checkpoint file, e.g. one listed by /list_trained_models
+        path_param (str | None): hparams.yaml of the run, read from the checkpoint when omitted
+
+    Returns:
+        SimpleModel: model with the checkpoint weights loaded, on cpu
+    """
+    ckpts = torch.load(path_model, map_location='cpu', weights_only=False)
+    if path_param:
+        with open(path_param, 'r') as fp:
+            hparams = yaml.unsafe_load(fp)
+    else:
+        hparams = ckpts['hyper_parameters']
+
+    model = SimpleModel(
+        solver_config=hparams['solver_config'],
+        model_name=hparams['model_name'], pretrained=False, num_classes=hparams['num_classes'],
+        mean=hparams.get('mean', IMAGENET_MEAN), std=hparams.get('std', IMAGENET_STD),
+    )
+    model.load_state_dict(ckpts['state_dict'])
+    return model
+
+
+class DistillModel(SimpleModel):
+    '''Train `model_name` as a student on the soft targets of a finished run's checkpoint.
+
+    The teacher is frozen and excluded from saved checkpoints, so the student exports
+    exactly like a SimpleModel.
+    '''
+
+    def __init__(
+        self,
+        solver_config: schemas.SolverConfig,
+        teacher_model: str,
+        model_name: str = 'resnet18',
+        pretrained: bool = False,
+        num_classes: int | None = None,
+        temperature: float = 4.0,
+        alpha: float = 0.9,
+        mean: tuple = IMAGENET_MEAN,
+        std: tuple = IMAGENET_STD,
+    ):
+        super().__init__(
+            solver_config=solver_config, model_name=model_name, pretrained=pretrained, num_classes=num_classes,
+            mean=mean, std=std,
+        )
+        self.temperature = temperature
+        self.alpha = alpha
+        self.teacher = load_cls_model(teacher_model)
+        self.teacher.requires_grad_(False)
+        self.teacher.eval()
+        if self.teacher.hparams.num_classes != num_classes:
+            raise ValueError(
+                f'teacher has {self.teacher.hparams.num_classes} classes, dataset has {num_classes}'
+            )
+        # kept on cpu and indexed per batch, not registered as a buffer
+        self.teacher_logits: torch.Tensor | None = None
+
+    def train(self, mode: bool = True):
+        super().train(mode)
+        self.teacher.eval()
+        return self
+
+    def teacher_input(self, x: torch.Tensor) -> torch.Tensor:
+        '''Re-normalize a batch from the student's mean/std to the teacher's.'''
+        mean, std = self.hparams.mean, self.hparams.std
+        t_mean, t_std = self.teacher.hparams.get('mean', IMAGENET_MEAN), self.teacher.hparams.get('std', IMAGENET_STD)
+        if tuple(mean) == tuple(t_mean) and tuple(std) == tuple(t_std):
+            return x
+        shape = (1, -1, 1, 1)
+        scale = x.new_tensor(std).view(shape) / x.new_tensor(t_std).view(shape)
+        shift = (x.new_tensor(mean).view(shape) - x.new_tensor(t_mean).view(shape)) / x.new_tensor(t_std).view(shape)
+        return x * scale + shift
+
+    @torch.no_grad()
+    def precompute_teacher_logits(self, data: 'SimpleData') -> torch.Tensor:
+        '''Run the teacher once over the un-augmented training images and cache the logits
+        under `<dataset>/.vinda/teacher_logits`, keyed by teacher, img_size and file list.'''
+        samples = data.train_dataset.samples
+        teacher_model = self.hparams.teacher_model
+        key = hashlib.sha1(repr((
+            os.path.abspath(teacher_model), os.path.getmtime(teacher_model), data.img_size, samples
+        )).encode()).hexdigest()[:16]
+        cache_file = os.path.join(data.root_dir, '.vinda', 'teacher_logits', f'train-{key}.pt')
+
+        if os.path.isfile(cache_file):
+            logits = torch.load(cache_file, map_location='cpu')
+            logger.info(f'load cached teacher logits: {cache_file}')
+        else:
+            dataset = data.make_dataset('train', ImageTransform(
+                is_train=False, img_size=data.img_size,
+                mean=self.teacher.hparams.get('mean', IMAGENET_MEAN), std=self.teacher.hparams.get('std', IMAGENET_STD),
+            ))
+            loader = DataLoader(
+                dataset, batch_size=data.batch_size, shuffle=False, num_workers=data.num_workers
+            )
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+            self.teacher.to(device)
+            logits = torch.cat([self.teacher(x.to(device)).float().cpu() for x, _ in loader])
+            self.teacher.cpu()
+
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            torch.save(logits, cache_file + '.tmp')
+            os.replace(cache_file + '.tmp', cache_file)
+            logger.info(f'save teacher logits: {cache_file}')
+
+        self.teacher_logits = logits
+        return logits
+
+    def training_loss(self, out, batch):
+        x, target = batch[0], batch[1]
+        if self.teacher_logits is not None:
+            soft = self.teacher_logits[batch[2].cpu()].to(out.device)
+        else:
+            with torch.no_grad():
+                soft = self.teacher(self.teacher_input(x))
+
+        t = self.temperature
+        kd_loss = F.kl_div(
+            F.log_softmax(out / t, dim=1), F.softmax(soft / t, dim=1), reduction='batchmean'
+        ) * (t * t)
+        return self.alpha * kd_loss + (1. - self.alpha) * self.train_loss(out, target)
+
+    def on_save_checkpoint(self, checkpoint: dict) -> None:
+        checkpoint['state_dict'] = {
+            k: v for k, v in checkpoint['state_dict'].items() if not k.startswith('teacher.')
+        }
+
+
+class StepProfiler(Callback):
+    '''Break a window of training steps down into data wait, forward, backward, optimizer
+    and logging time, and record the same window with the PyTorch profiler.
+
+    Checkpoint writes are timed over the whole fit. The chrome trace is written to the
+    run's version directory, e.g. lightning_logs/version_9/profile_trace.json.
+    '''
+    _PHASES = ('data_wait', 'forward', 'backward', 'optimizer', 'logging', 'checkpoint')
+
+    def __init__(self, skip_steps: int = 5, num_steps: int = 20):
+        self.skip_steps = skip_steps
+        self.num_steps = num_steps
+        self.timers = Timer.new(*StepProfiler._PHASES)
+        self.trace_file = None
+        self._step = 0
+        self._marks = {}
+        self._window_time = 0.
+        self._fit_start = None
+        self._fit_time = 0.
+        self._profiler = None
+
+    def _recording(self) -> bool:
+        return self.skip_steps <= self._step < self.skip_steps + self.num_steps
+
+    def _now(self) -> float:
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def setup(self, trainer, pl_module, stage):
+        checkpoint_io = trainer.strategy.checkpoint_io
+        save_checkpoint = checkpoint_io.save_checkpoint
+
+        def timed_save_checkpoint(*args, **kwargs):
+            with self.timers['checkpoint'].tic_and_toc():
+                return save_checkpoint(*args, **kwargs)
+
+        checkpoint_io.save_checkpoint = timed_save_checkpoint
+
+    def on_fit_start(self, trainer, pl_module):
+        self._fit_start = time.perf_counter()
+
+    def on_train_epoch_start(self, trainer, pl_module):
+        # data wait is measured from the previous step, not across validation and checkpoints
+        self._marks = {}
+
+    def on_train_batch_start(self, trainer, pl_module, batch, batch_idx):
+        if not self._recording() or not trainer.is_global_zero:
+            return
+        if self._profiler is None:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self._profiler = torch.profiler.profile(activities=activities)
+            self._profiler.start()
+        now = self._now()
+        if 'end' in self._marks:
+            self.timers['data_wait'].add_diff(now - self._marks['end'])
+            self._window_time += now - self._marks['end']
+        self._marks = {'start': now, 'logging': self.timers['logging'].total_time}
+        pl_module.phase_timers = self.timers
+
+    def on_before_backward(self, trainer, pl_module, loss):
+        if 'start' in self._marks:
+            self._marks['before_backward'] = self._now()
+
+    def on_after_backward(self, trainer, pl_module):
+        if 'start' in self._marks:
+            self._marks['after_backward'] = self._now()
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx):
+        marks, now = self._marks, self._now()
+        if 'after_backward' in marks:
+            logging_time = self.timers['logging'].total_time - marks['logging']
+            self.timers['forward'].add_diff(marks['before_backward'] - marks['start'] - logging_time)
+            self.timers['backward'].add_diff(marks['after_backward'] - marks['before_backward'])
+            self.timers['optimizer'].add_diff(now - marks['after_backward'])
+            self._window_time += now - marks['start']
+        pl_module.phase_timers = None
+        self._marks = {'end': now}
+        self._step += 1
+        if self._step == self.skip_steps + self.num_steps:
+            self._stop_profiler(trainer)
+
+    def on_train_end(self, trainer, pl_module):
+        self._stop_profiler(trainer)
+        self._fit_time = time.perf_counter() - self._fit_start
+
+    def _stop_profiler(self, trainer):
+        if self._profiler is None:
+            return
+        self._profiler.stop()
+        # rank 0 only, trainer.log_dir would wait for the other ranks in a broadcast
+        self.trace_file = os.path.join(trainer.logger.log_dir, 'profile_trace.json')
+        self._profiler.export_chrome_trace(self.trace_file)
+        self._profiler = None
+        logger.info(f'profile trace: {self.trace_file}')
+
+    def state_dict(self) -> dict:
+        # sent back to the main process of a forked run by CarryBackLauncher
+        return {
+            'timers': {k: (v.total_time, v.calls) for k, v in self.timers.items()},
+            'window_time': self._window_time,
+            'fit_time': self._fit_time,
+            'trace_file': self.trace_file,
+        }
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        for k, (total_time, calls) in state_dict['timers'].items():
+            timer = self.timers[k]
+            timer.total_time, timer.calls = total_time, calls
+            timer.average_time = total_time / max(calls, 1)
+        self._window_time = state_dict['window_time']
+        self._fit_time = state_dict['fit_time']
+        self.trace_file = state_dict['trace_file']
+
+    def summary(self) -> dict:
+        steps = self.timers['forward'].calls
+        phases = {k: self.timers[k].total_time for k in ('data_wait', 'forward', 'backward', 'optimizer', 'logging')}
+        window = self._window_time or 1.
+        compute = phases['forward'] + phases['backward'] + phases['optimizer']
+        return {
+            'steps': steps,
+            'step_time_ms': self._window_time / max(steps, 1) * 1000,
+            'phases_ms': {k: v / max(steps, 1) * 1000 for k, v in phases.items()},
+            'percent': {
+                'data_wait': phases['data_wait'] / window * 100,
+                'compute': compute / window * 100,
+                'logging': phases['logging'] / window * 100,
+                'other': max(window - sum(phases.values()), 0.) / window * 100,
+            },
+            'checkpoint': {
+                'saves': self.timers['checkpoint'].calls,
+                'total_s': self.timers['checkpoint'].total_time,
+                'percent_of_fit': self.timers['checkpoint'].total_time / (self._fit_time or 1.) * 100,
+            },
+            'trace': self.trace_file,
+        }
+
+
+class CpuAffinity(Callback):
+    '''Pin each local process of a CPU distributed run to its own slice of cores.
+
+    Intra-op threads are sized to the slice minus the DataLoader workers forked from
+    the process, so processes, threads and loader workers do not oversubscribe the node.
+    '''
+
+    def __init__(self, num_workers: int = 0):
+        self.num_workers = num_workers
+
+    def setup(self, trainer, pl_module, stage):
+        if not hasattr(os, 'sched_setaffinity'):
+            return
+        cores = sorted(os.sched_getaffinity(0))
+        nprocs, rank = trainer.num_devices, trainer.local_rank
+        if len(cores) >= nprocs:
+            cores = cores[rank * len(cores) // nprocs:(rank + 1) * len(cores) // nprocs]
+            os.sched_setaffinity(0, cores)
+        num_threads = max(1, len(cores) - self.num_workers)
+        torch.set_num_threads(num_threads)
+        logger.info(f'rank {trainer.global_rank}: cores={cores}, threads={num_threads}')
+
+
+class CancellationCallback(Callback):
+    '''Stop training at the next step boundary once the task is flagged by /cancel_task.
+
+    Rank 0 reads the flag at most every `check_seconds`, the decision is shared with
+    all ranks so they stop at the same step. The current weights are saved to
+    `cancelled.ckpt` and the remaining validation is skipped.
+    '''
+
+    def __init__(self, task_id: str, check_seconds: float = 2.0):
+        self.task_id = task_id
+        self.check_seconds = check_seconds
+        self.last_check = 0.0
+        self.cancelled = False
+        self.checkpoint = ''
+
+    def state_dict(self) -> dict:
+        # sent back to the main process of a forked run by CarryBackLauncher
+        return {'cancelled': self.cancelled, 'checkpoint': self.checkpoint}
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        self.cancelled = state_dict['cancelled']
+        self.checkpoint = state_dict['checkpoint']
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx):
+        flag = False
+        now = time.monotonic()
+        if trainer.is_global_zero and now - self.last_check >= self.check_seconds:
+            self.last_check = now
+            flag = is_cancelled(self.task_id)
+        if not trainer.strategy.reduce_boolean_decision(flag, all=False):
+            return
+
+        self.cancelled = True
+        self.checkpoint = os.path.join(trainer.checkpoint_callback.dirpath, 'cancelled.ckpt')
+        trainer.save_checkpoint(self.checkpoint)
+        logger.info(f'task {self.task_id} cancelled at step {trainer.global_step}, saved {self.checkpoint}')
+        trainer.should_stop = True
+        # Trainer.should_stop alone runs one more validation before leaving the loop
+        trainer.limit_val_batches = 0
+
+
+def _is_quick_validation(trainer: Trainer) -> bool:
+    return not getattr(trainer.datamodule, 'full_validation', True)
+
+
+class FullValCheckpoint(ModelCheckpoint):
+    '''ModelCheckpoint that only ranks checkpoints on full validations, and keeps the
+    run registry in sync with the checkpoints it saves and removes.'''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # global step of the weights scored by the latest full validation
+        self.last_full_val_step = -1
+
+    def state_dict(self) -> dict:
+        return {**super().state_dict(), 'last_full_val_step': self.last_full_val_step}
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        # the main process of a forked run never resolved the directory, take the one of rank 0
+        self.dirpath = self.dirpath or state_dict.get('dirpath')
+        super().load_state_dict(state_dict)
+        self.last_full_val_step = state_dict.get('last_full_val_step', self.last_full_val_step)
+
+    def setup(self, trainer, pl_module, stage):
+        super().setup(trainer, pl_module, stage)
+        if trainer.is_global_zero:
+            db.init_db()
+
+    def _save_checkpoint(self, trainer: Trainer, filepath: str) -> None:
+        super()._save_checkpoint(trainer, filepath)
+        if trainer.is_global_zero:
+            val_acc = trainer.callback_metrics.get('val_acc')
+            db.record_checkpoint(
+                # not trainer.log_dir, it broadcasts from rank 0 and the other ranks never join
+                run=os.path.basename(trainer.logger.log_dir),
+                hparams=trainer.lightning_module.hparams,
+                epoch=trainer.current_epoch,
+                val_acc=None if val_acc is None else val_acc.item(),
+                path=filepath,
+            )
+
+    def _remove_checkpoint(self, trainer: Trainer, filepath: str) -> None:
+        super()._remove_checkpoint(trainer, filepath)
+        if trainer.is_global_zero:
+            db.remove_checkpoint(filepath)
+
+    def _should_skip_saving_checkpoint(self, trainer: Trainer) -> bool:
+        return super()._should_skip_saving_checkpoint(trainer) or _is_quick_validation(trainer)
+
+    def on_validation_end(self, trainer, pl_module):
+        if not trainer.sanity_checking and not _is_quick_validation(trainer):
+            self.last_full_val_step = trainer.global_step
+        super().on_validation_end(trainer, pl_module)
+
+
+class FullValEarlyStopping(EarlyStopping):
+    '''EarlyStopping that counts patience in full validations.'''
+
+    def _should_skip_check(self, trainer: Trainer) -> bool:
+        return super()._should_skip_check(trainer) or _is_quick_validation(trainer)
+
+
+def finish_validation(trainer: Trainer, model: LightningModule, data: SimpleData) -> str:
+    """Fully validate the final weights when the last validation was quick or training was
+    cut short by the time budget, and keep them if they beat the best checkpoint.
+
+    Returns:
+        str: best model path
+    """
+    ckpt_callback = trainer.checkpoint_callback
+    if ckpt_callback.last_full_val_step == trainer.global_step:
+        return ckpt_callback.best_model_path
+
+    data.force_full_validation = True
+    val_acc = trainer.validate(model, datamodule=data, verbose=False)[0]['val_acc']
+    logger.info(f'final full validation at step {trainer.global_step}: val_acc={val_acc:.3f}')
+    best_score = ckpt_callback.best_model_score
+    if best_score is None or val_acc > best_score.item():
+        path = os.path.join(ckpt_callback.dirpath, f'model-{trainer.current_epoch:03d}-{val_acc:.3f}-final.ckpt')
+        trainer.save_checkpoint(path)
+        db.record_checkpoint(os.path.basename(trainer.log_dir), model.hparams, trainer.current_epoch, val_acc, path)
+        ckpt_callback.best_model_path = path
+        ckpt_callback.best_model_score = torch.tensor(val_acc)
+    return ckpt_callback.best_model_path
+
+
+def get_basic_callbacks(checkpoint_interval: int = 1, early_stop_patience: int | None = None) -> list:
     lr_callback = LearningRateMonitor(logging_interval='epoch')
-    ckpt_callback = ModelCheckpoint(
+    ckpt_callback = FullValCheckpoint(
         filename='model-{epoch:03d}-{val_acc:.3f}',
         monitor='val_acc',
         auto_insert_metric_name=False,
@@ -290,28 +857,68 @@ def get_basic_callbacks(checkpoint_interval: int = 1) -> list:
         mode='max',
         every_n_epochs=checkpoint_interval,
     )
-    return [ckpt_callback, lr_callback]
+    callbacks = [ckpt_callback, lr_callback]
+    if early_stop_patience:
+        callbacks.append(FullValEarlyStopping(monitor='val_acc', mode='max', patience=early_stop_patience))
+    return callbacks
+
+
+class CarryBackLauncher(_MultiProcessingLauncher):
+    '''Send the callback states and the fit loop progress of rank 0 back to the main process,
+    which otherwise only gets the best model path and the callback metrics of the forked run.'''
+
+    def get_extra_results(self, trainer: Trainer) -> dict:
+        extra = super().get_extra_results(trainer)
+        # as numpy like the callback metrics, tensors would be sent through shared memory
+        extra['callbacks'] = apply_to_collection(
+            {x.state_key: x.state_dict() for x in trainer.callbacks}, torch.Tensor, lambda x: x.cpu().numpy()
+        )
+        extra['fit_loop'] = trainer.fit_loop.state_dict()
+        return extra
+
+    def update_main_process_results(self, trainer: Trainer, extra: dict) -> None:
+        super().update_main_process_results(trainer, extra)
+        states = apply_to_collection(extra['callbacks'], np.ndarray, torch.tensor)
+        for callback in trainer.callbacks:
+            if states.get(callback.state_key):
+                callback.load_state_dict(states[callback.state_key])
+        if trainer.state.fn == TrainerFn.FITTING:
+            # global_step and current_epoch of the main process
+            trainer.fit_loop.load_state_dict(extra['fit_loop'])
+
+
+class ForkDDPStrategy(DDPStrategy):
+    '''DDP over processes forked from the celery task, which keeps the task context in every rank.'''
+
+    def __init__(self, **kwargs):
+        super().__init__(start_method='fork', **kwargs)
+
+    def _configure_launcher(self) -> None:
+        self._launcher = CarryBackLauncher(self, start_method=self._start_method)
 
 
 def get_gpu_settings(
-    gpu_ids: list[int], n_gpu: int
-) -> tuple[str, int | list[int] | None, str | None]:
+    gpu_ids: list[int], n_gpu: int, cpu_processes: int = 1
+) -> tuple[str, int | list[int], str | DDPStrategy]:
     """Get gpu settings for pytorch-lightning trainer:
     https://pytorch-lightning.readthedocs.io/en/stable/common/trainer.html#trainer-flags
 
     Args:
         gpu_ids (list[int])
         n_gpu (int)
+        cpu_processes (int): processes per node when cuda is unavailable
 
     Returns:
         tuple[str, int, str]: accelerator, devices, strategy
     """
     if not torch.cuda.is_available():
-        return "cpu", None, None
+        if cpu_processes > 1:
+            return "cpu", cpu_processes, ForkDDPStrategy(process_group_backend='gloo')
+        return "cpu", 1, 'auto'
 
     if gpu_ids is not None:
         devices = gpu_ids
-        strategy = "ddp" if len(gpu_ids) > 1 else None
+        strategy = "ddp" if len(gpu_ids) > 1 else 'auto'
     elif n_gpu is not None:
         # int
         devices = n_gpu
@@ -323,19 +930,45 @@ def get_gpu_settings(
     return "gpu", devices, strategy
 
 
-def get_trainer(trainning_config : schemas.TrainingConfig) -> Trainer:
-    callbacks = get_basic_callbacks(checkpoint_interval=trainning_config.save_interval)
-    accelerator, devices, strategy = get_gpu_settings(trainning_config.gpu_ids, trainning_config.n_gpu)
+def get_trainer(trainning_config : schemas.TrainingConfig, task_id: str | None = None) -> Trainer:
+    callbacks = get_basic_callbacks(
+        checkpoint_interval=trainning_config.save_interval,
+        early_stop_patience=trainning_config.early_stop_patience,
+    )
+    if task_id is not None:
+        callbacks.append(CancellationCallback(task_id, cfg.control.check_seconds))
+    if trainning_config.profile:
+        callbacks.append(StepProfiler(trainning_config.profile_skip, trainning_config.profile_steps))
+    accelerator, devices, strategy = get_gpu_settings(
+        trainning_config.gpu_ids, trainning_config.n_gpu, trainning_config.cpu_processes
+    )
+    if accelerator == 'cpu' and devices > 1:
+        callbacks.append(CpuAffinity(trainning_config.num_workers))
+    if trainning_config.num_nodes > 1:
+        # static rendezvous, read by lightning's cluster environment
+        os.environ['MASTER_ADDR'] = trainning_config.master_addr
+        os.environ['MASTER_PORT'] = str(trainning_config.master_port)
+        os.environ['NODE_RANK'] = str(trainning_config.node_rank)
+
     trainer = Trainer(
         max_epochs=trainning_config.epochs,
+        max_time=timedelta(minutes=trainning_config.max_minutes) if trainning_config.max_minutes else None,
         callbacks=callbacks,
         default_root_dir=cfg.trainer.output,
         accelerator=accelerator,
         devices=devices,
         strategy=strategy,
+        num_nodes=trainning_config.num_nodes,
+        # SimpleData shards with its own DistributedSampler
+        use_distributed_sampler=False,
+        # quick and full validations alternate between epochs
+        reload_dataloaders_every_n_epochs=1 if trainning_config.val_fraction < 1 else 0,
         logger=True,
         deterministic=True,
     )
+    if isinstance(strategy, ForkDDPStrategy):
+        # the version is picked on first use: before forking, so the main process and the ranks share it
+        logger.info(f'run directory: {trainer.logger.log_dir}')
     return trainer
 
 
@@ -0,0 +1,50 @@
+import numpy as np
+
+from PIL import Image
+
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+def decode_image(src, img_size: int | tuple | None = None, draft: bool = True) -> Image.Image:
+    """Decode an image as RGB, JPEGs directly near the input size of the network.
+
+    libjpeg scales by 1/2, 1/4 or 1/8 in the DCT domain while it decodes (PIL draft mode), which
+    skips most of the IDCT and color conversion of a full-resolution decode. The smallest scale
+    still covering `img_size` is used, so the resize that follows only downsamples. Other formats
+    are decoded at full resolution.
+
+    Args:
+        src: path or file object
+        img_size (int | tuple): (h, w) the image is resized to afterwards, None decodes at full resolution
+        draft (bool): allow the reduced-resolution JPEG decode
+
+    Returns:
+        Image.Image: loaded RGB image
+    """
+    with Image.open(src) as img:
+        if draft and img_size is not None and img.format == 'JPEG':
+            h, w = (img_size, img_size) if isinstance(img_size, int) else img_size
+            img.draft('RGB', (w, h))
+        return img.convert('RGB')
+
+
+class EvalTransform:
+    '''Eval preprocessing of `trainer.ImageTransform` in numpy, so inference does not import torch.
+
+    Resize (bilinear) -> scale to [0, 1] -> normalize -> CHW float32.
+    '''
+
+    def __init__(self, img_size: int | tuple = 112, mean: tuple = IMAGENET_MEAN, std: tuple = IMAGENET_STD):
+        if isinstance(img_size, int):
+            img_size = (img_size, img_size)
+        self.img_size = img_size
+        self.mean = np.asarray(mean, dtype=np.float32).reshape(3, 1, 1)
+        self.std = np.asarray(std, dtype=np.float32).reshape(3, 1, 1)
+
+    def __call__(self, img: Image.Image) -> np.ndarray:
+        h, w = self.img_size
+        img = img.convert('RGB').resize((w, h), Image.BILINEAR)
+        x = np.asarray(img, dtype=np.float32).transpose(2, 0, 1) / 255.0
+        return (x - self.mean) / self.std
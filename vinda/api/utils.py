@@ -120,6 +120,64 @@ def export_onnx_model(model, file):
     pass
 
 
+def _proc_status_kb(field: str) -> int | None:
+    try:
+        with open('/proc/self/status', 'r') as fp:
+            for line in fp:
+                if line.startswith(f'{field}:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def memory_usage() -> dict | None:
+    """Resident memory of this process split by sharing, from /proc/self/smaps_rollup (Linux).
+
+    Returns:
+        dict: `rss_mb`, `pss_mb` (shared pages divided among the processes mapping them),
+            `private_mb` and `shared_mb`, None where smaps_rollup is not available
+    """
+    fields = {}
+    try:
+        with open('/proc/self/smaps_rollup', 'r') as fp:
+            for line in fp:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == 'kB':
+                    fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    except OSError:
+        return None
+    return {
+        'rss_mb': fields.get('Rss', 0.),
+        'pss_mb': fields.get('Pss', 0.),
+        'private_mb': fields.get('Private_Clean', 0.) + fields.get('Private_Dirty', 0.),
+        'shared_mb': fields.get('Shared_Clean', 0.) + fields.get('Shared_Dirty', 0.),
+    }
+
+
+@contextlib.contextmanager
+def track_peak_rss():
+    """Measure the resident memory peak of a block, above the resident memory at its start.
+
+    Yields a dict whose `peak_mb` is set when the block exits, None where it cannot be
+    measured. Resets the kernel's high-water mark of the process (Linux clear_refs), so
+    `VmHWM` and `ru_maxrss` read later start over from this block.
+    """
+    stats = {'peak_mb': None}
+    start = _proc_status_kb('VmRSS')
+    try:
+        with open('/proc/self/clear_refs', 'w') as fp:
+            fp.write('5')
+    except OSError:
+        start = None
+    try:
+        yield stats
+    finally:
+        peak = _proc_status_kb('VmHWM') if start is not None else None
+        if peak is not None:
+            stats['peak_mb'] = max(0, peak - start) / 1024
+
+
 # def cv2pil(image):
 #     '''
 #     将bgr格式的numpy的图像转换为pil
@@ -1,16 +1,34 @@
 from celery import Celery
+from celery.signals import before_task_publish, task_prerun, task_postrun
+from loguru import logger
 
 from vinda.api.config import cfg
+from vinda.api.middleware import request_id_var
 
 
 celery_app = Celery(__name__)
 
-# celery_app.conf.task_routes = {
-#     "flap.app.worker.main": "main_queue"
-# }
-
+# queues and routing are in cfg.celery, pool and concurrency are set per worker (see launch_worker.sh)
 celery_app.conf.update(cfg.celery)
 
-# 设置并发模型和数量
-# celery_app.conf.worker_concurrency = 4  # 根据你的 CPU 核心数调整
-# celery_app.conf.worker_pool = 'prefork'  # 或者使用 'eventlet'
\ No newline at end of file
+@before_task_publish.connect
+def propagate_request_id(headers=None, **kwargs):
+    rid = request_id_var.get()
+    if rid is not None and headers is not None:
+        headers['request_id'] = rid
+        logger.info(f"request {rid} -> task {headers.get('task')}[{headers.get('id')}]")
+
+
+@task_prerun.connect
+def bind_request_id(task_id=None, task=None, **kwargs):
+    rid = getattr(task.request, 'request_id', None)
+    task.request.request_id_token = request_id_var.set(rid)
+    logger.info(f'task {task.name}[{task_id}] started, request {rid}')
+
+
+@task_postrun.connect
+def unbind_request_id(task_id=None, task=None, state=None, **kwargs):
+    token = getattr(task.request, 'request_id_token', None)
+    if token is not None:
+        request_id_var.reset(token)
+    logger.info(f'task {task.name}[{task_id}] {state}, request {getattr(task.request, "request_id", None)}')
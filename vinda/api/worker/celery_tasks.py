@@ -1,40 +1,91 @@
 import os
-import yaml
+import json
+import time
+import onnx
+import timm
 import torch
 
 from vinda.api.worker.celery_app import celery_app as celery
-from vinda.api.trainer import SimpleData, SimpleModel, get_trainer, ImageTransform
+from vinda.api.worker.resources import ResourceTask, TrainTask
+from vinda.api.worker.control import CANCELLED, is_cancelled
+from vinda.api.trainer import (
+    SimpleData, SimpleModel, DistillModel, StepProfiler, CancellationCallback, get_trainer, load_cls_model,
+    finish_validation,
+)
 from vinda.api import schemas
+from vinda.api import store
+from vinda.api.catalog import LatencyCatalog, benchmark_model
+from vinda.api.onnxinfer import external_data_path, ort_model_path, save_ort_model
+from vinda.api.datasets import install_dataset
+from vinda.api.analysis import analyze_dataset as analyze
 from loguru import logger
 from vinda.api.config import cfg
 
+from celery.exceptions import Ignore
 from traceback import format_exception
 
 
-@celery.task
-def train_cls_model(trainning_config: dict):
+def _cancel(task, meta: dict):
+    # a custom terminal state, Ignore keeps celery from overwriting it with SUCCESS
+    task.update_state(state=CANCELLED, meta=meta)
+    logger.info(f'task {task.request.id} cancelled: {meta}')
+    raise Ignore()
+
+
+@celery.task(bind=True, base=TrainTask)
+def train_cls_model(self, trainning_config: dict):
+    if is_cancelled(self.request.id):
+        _cancel(self, {'checkpoint': None, 'global_step': 0})
     try:
         cfg = schemas.TrainingConfig(**trainning_config)
+        distill = bool(cfg.teacher_model)
         data = SimpleData(
             root_dir=cfg.dataset,
             img_size=cfg.img_size,
             batch_size=cfg.batch_size,
             num_workers=cfg.num_workers,
+            return_index=distill and cfg.cache_teacher_logits,
+            val_fraction=cfg.val_fraction,
+            full_val_interval=cfg.full_val_interval,
+            seed=cfg.seed,
+            use_stats=cfg.use_dataset_stats,
+            draft_decode=cfg.draft_decode,
         )
         pretrain_model = cfg.pretrain_model and os.path.exists(cfg.pretrain_model)
-        model = SimpleModel(
-            solver_config=cfg.solver,
-            model_name=cfg.name_model, pretrained=not pretrain_model, num_classes=len(data.classes)
-        )
+        if distill:
+            model = DistillModel(
+                solver_config=cfg.solver, teacher_model=cfg.teacher_model,
+                model_name=cfg.name_model, pretrained=not pretrain_model, num_classes=len(data.classes),
+                temperature=cfg.distill_temperature, alpha=cfg.distill_alpha, mean=data.mean, std=data.std,
+            )
+            if cfg.cache_teacher_logits:
+                model.precompute_teacher_logits(data)
+        else:
+            model = SimpleModel(
+                solver_config=cfg.solver,
+                model_name=cfg.name_model, pretrained=not pretrain_model, num_classes=len(data.classes),
+                mean=data.mean, std=data.std,
+            )
         if pretrain_model:
-            ckpts = torch.load(cfg.pretrain_model)
-            model.load_state_dict(ckpts['state_dict'])
-        trainer = get_trainer(cfg)
+            ckpts = torch.load(cfg.pretrain_model, weights_only=False)
+            # the teacher of a distillation run is loaded separately
+            model.load_state_dict(ckpts['state_dict'], strict=not distill)
+        trainer = get_trainer(cfg, self.request.id)
         trainer.fit(model, data)
-        message = {'best_model_path': trainer.checkpoint_callback.best_model_path}
+        for callback in trainer.callbacks:
+            if isinstance(callback, CancellationCallback) and callback.cancelled:
+                meta = {'checkpoint': callback.checkpoint, 'global_step': trainer.global_step,
+                        'best_model_path': trainer.checkpoint_callback.best_model_path}
+                _cancel(self, meta)
+        message = {'best_model_path': finish_validation(trainer, model, data)}
+        for callback in trainer.callbacks:
+            if isinstance(callback, StepProfiler):
+                message['profile'] = callback.summary()
         logger.debug(message)
         return message
 
+    except Ignore:
+        raise
     except Exception as e:
         logger.error(e)
         for x in format_exception(e):
@@ -42,17 +93,10 @@ def train_cls_model(trainning_config: dict):
         return {'message': str(e), 'traceback': format_exception(e)}
 
 
-def export_cls_model(export_config: schemas.ExportConfig, save_path):
-    with open(export_config.path_param, 'r') as fp:
-        hparams = yaml.unsafe_load(fp)
-
-    model = SimpleModel(
-        solver_config=hparams['solver_config'],
-        model_name=hparams['model_name'], pretrained=False, num_classes=hparams['num_classes']
-    )
-
-    ckpts = torch.load(export_config.path_model, map_location='cpu')
-    model.load_state_dict(ckpts['state_dict'])
+@celery.task(base=ResourceTask, resource_class='export')
+def export_cls_model(export_config: dict, save_path: str):
+    export_config = schemas.ExportConfig(**export_config)
+    model = load_cls_model(export_config.path_model, export_config.path_param)
     model.cpu()
     model.eval()
 
@@ -71,6 +115,105 @@ def export_cls_model(export_config: schemas.ExportConfig, save_path):
                         'output' : {0 : 'N', 2: 'H', 3: 'W'}}
         )
 
+    # the normalization the model was trained with, read back by OrtClsInfer
+    onnx_model = onnx.load(save_path)
+    onnx.helper.set_model_props(onnx_model, {
+        'mean': json.dumps(list(model.hparams.mean)), 'std': json.dumps(list(model.hparams.std)),
+    })
+    data_path = external_data_path(save_path)
+    if os.path.isfile(data_path):
+        # onnx appends to an existing data file, and a stale one would be memory-mapped by the engine
+        os.remove(data_path)
+    if export_config.external_data:
+        onnx.save(
+            onnx_model, save_path, save_as_external_data=True, all_tensors_to_one_file=True,
+            location=os.path.basename(data_path), size_threshold=1024,
+        )
+    else:
+        onnx.save(onnx_model, save_path)
+
+    ort_path = ort_model_path(save_path)
+    if export_config.ort:
+        save_ort_model(save_path, ort_path, cfg.export.ort_optimization)
+    elif os.path.isfile(ort_path):
+        # an artifact of a previous export, the engine would load it instead of the new model
+        os.remove(ort_path)
+
+
+@celery.task(bind=True, base=ResourceTask, resource_class='inference')
+def benchmark_models(self, benchmark_config: dict | None = None):
+    config = schemas.BenchmarkConfig(**(benchmark_config or {}))
+    img_sizes = config.img_sizes or cfg.catalog.img_sizes
+    batch_sizes = config.batch_sizes or cfg.catalog.batch_sizes
+
+    names = []
+    for pattern in config.models or cfg.catalog.candidates:
+        for name in timm.list_models(pattern) or [pattern]:
+            if name not in names:
+                names.append(name)
+
+    catalog = LatencyCatalog()
+    benchmarked = []
+    for i, name in enumerate(names):
+        if not config.force and catalog.is_fresh(name, img_sizes, batch_sizes, cfg.catalog.refresh_hours * 3600):
+            continue
+        self.update_state(state='PROGRESS', meta={
+            'stage': 'benchmark', 'model': name, 'current': i, 'total': len(names),
+        })
+        try:
+            entry = benchmark_model(
+                name, img_sizes, batch_sizes, num_threads=config.num_threads, repeat=config.repeat
+            )
+        except Exception as e:
+            logger.warning(f'benchmark {name} failed: {e}')
+            entry = {'model': name, 'error': str(e), 'timestamp': time.time()}
+        catalog.update(entry)
+        benchmarked.append(name)
+
+    return {'benchmarked': benchmarked, 'catalog': catalog.path}
+
+
+@celery.task(bind=True, base=ResourceTask, resource_class='dataset')
+def extract_dataset(self, zip_file: str, name: str = '', filename: str = ''):
+    def progress(done, total):
+        self.update_state(state='PROGRESS', meta={'stage': 'extract', 'current': done, 'total': total})
+
+    try:
+        return install_dataset(zip_file, name or None, filename or None, progress=progress)
+    finally:
+        # a failed install is uploaded again, the archive would otherwise stay in cfg.datasets.uploads
+        os.remove(zip_file)
+
+
+@celery.task(bind=True, base=ResourceTask, resource_class='dataset')
+def analyze_dataset(self, analyze_config: dict):
+    config = schemas.AnalyzeConfig(**analyze_config)
+    last = [0.]
+
+    def progress(done, total):
+        # at most one backend write per second on million-image sets
+        if time.time() - last[0] > 1 or done == total:
+            last[0] = time.time()
+            self.update_state(state='PROGRESS', meta={'stage': 'analyze', 'current': done, 'total': total})
+
+    stats = analyze(config.dataset, config.num_workers, config.max_distance, progress=progress)
+    return {
+        'dataset': config.dataset,
+        'num_files': stats['num_files'],
+        'corrupt': len(stats['corrupt']),
+        'exact_duplicates': len(stats['exact_duplicates']),
+        'near_duplicates': len(stats['near_duplicates']),
+        'mean': stats['mean'],
+        'std': stats['std'],
+    }
+
+
+@celery.task(base=ResourceTask, resource_class='dataset')
+def gc_store(dry_run: bool = False):
+    stats = store.gc(dry_run)
+    logger.info(f'dataset store gc: {stats}')
+    return stats
+
 
 def inference_cls_model(inference_config: schemas.InferenceConfig):
     pass
@@ -0,0 +1,28 @@
+from vinda.api.worker.celery_app import celery_app
+
+
+## terminal state of a task stopped by /cancel_task, next to celery's SUCCESS / FAILURE / REVOKED
+CANCELLED = 'CANCELLED'
+
+## celery priorities on redis run 0 first, the api takes 0 (lowest) to 9 (highest) like rabbitmq
+MAX_PRIORITY = 9
+DEFAULT_PRIORITY = 5
+
+
+def to_broker_priority(priority: int) -> int:
+    return MAX_PRIORITY - priority
+
+
+def _cancel_key(task_id: str) -> str:
+    return f'vinda:cancel:{task_id}'
+
+
+def request_cancel(task_id: str):
+    '''Flag a task for cancellation, it expires with the task results.'''
+    celery_app.backend.set(_cancel_key(task_id), b'1')
+
+
+def is_cancelled(task_id: str | None) -> bool:
+    if task_id is None:
+        return False
+    return celery_app.backend.get(_cancel_key(task_id)) is not None
@@ -0,0 +1,141 @@
+import os
+import json
+import socket
+
+from celery import Task
+from celery.signals import worker_ready
+from loguru import logger
+
+from vinda.api import schemas
+from vinda.api.config import cfg
+
+
+# check and reserve in one step, so concurrent workers of a node never over-commit it
+_RESERVE = '''
+local cap = redis.call('HMGET', KEYS[1], 'cpu', 'memory_gb', 'gpu')
+if not cap[1] then
+    return -1
+end
+local used = {0, 0, 0}
+for _, v in ipairs(redis.call('HVALS', KEYS[2])) do
+    local r = cjson.decode(v)
+    used[1] = used[1] + r.cpu
+    used[2] = used[2] + r.memory_gb
+    used[3] = used[3] + r.gpu
+end
+local req = {tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5])}
+for i = 1, 3 do
+    if used[i] + req[i] > tonumber(cap[i]) then
+        return 0
+    end
+end
+redis.call('HSET', KEYS[2], ARGV[1], cjson.encode({worker = ARGV[2], cpu = req[1], memory_gb = req[2], gpu = req[3]}))
+return 1
+'''
+
+
+def node_name() -> str:
+    return os.getenv('NODE_NAME', socket.gethostname())
+
+
+def node_capacity() -> dict:
+    '''Resources of this node, overridable with WORKER_CPUS / WORKER_MEMORY_GB / WORKER_GPUS.'''
+    memory_gb = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024 ** 3
+    if os.getenv('WORKER_GPUS') is not None:
+        gpu = int(os.getenv('WORKER_GPUS'))
+    else:
+        import torch
+        gpu = torch.cuda.device_count()
+    return {
+        'cpu': float(os.getenv('WORKER_CPUS', os.cpu_count())),
+        'memory_gb': float(os.getenv('WORKER_MEMORY_GB', round(memory_gb, 1))),
+        'gpu': float(gpu),
+    }
+
+
+def _redis(app):
+    # the reservations live next to the task results, only a redis backend supports them
+    client = getattr(app.backend, 'client', None)
+    return client if hasattr(client, 'register_script') else None
+
+
+def _keys(node: str) -> tuple[str, str]:
+    return f'vinda:node:{node}:capacity', f'vinda:node:{node}:reservations'
+
+
+class ResourceTask(Task):
+    '''Celery task that only starts when its resource request fits the free capacity of the node.
+
+    Each task sets `resource_class`, a key of `cfg.resources.requests`. When the node
+    is full the task is retried after `cfg.resources.retry_seconds`, so short jobs
+    queued behind it on other queues keep flowing.
+    '''
+
+    resource_class = 'default'
+
+    def resource_request(self, args: tuple, kwargs: dict) -> dict:
+        return dict(cfg.resources.requests.get(self.resource_class, cfg.resources.requests['default']))
+
+    def __call__(self, *args, **kwargs):
+        if self.request.id is None:
+            # called directly, not traced by a worker or apply()
+            return super().__call__(*args, **kwargs)
+        client = _redis(self.app)
+        if self.request.is_eager or client is None:
+            # the tracer already pushed this request, Task.__call__ would replace it
+            return self.run(*args, **kwargs)
+
+        request = self.resource_request(args, kwargs)
+        capacity_key, reservations_key = _keys(node_name())
+        granted = client.register_script(_RESERVE)(
+            keys=[capacity_key, reservations_key],
+            args=[self.request.id, self.request.hostname or '', request['cpu'], request['memory_gb'], request['gpu']],
+        )
+        if granted == -1:
+            logger.warning(f'node {node_name()} has not advertised its capacity, running {self.name} unchecked')
+        elif granted == 0:
+            capacity = {k.decode(): float(v) for k, v in client.hgetall(capacity_key).items()}
+            if any(request[k] > capacity.get(k, 0) for k in request):
+                raise ValueError(f'{self.name} requests {request}, more than node capacity {capacity}')
+            logger.info(f'{self.name}[{self.request.id}] waits for {request} on {node_name()}')
+            raise self.retry(countdown=cfg.resources.retry_seconds, max_retries=None)
+
+        try:
+            return self.run(*args, **kwargs)
+        finally:
+            if granted == 1:
+                client.hdel(reservations_key, self.request.id)
+
+
+class TrainTask(ResourceTask):
+    '''Training requests one core per training process and dataloader worker, and its GPUs.'''
+
+    resource_class = 'train'
+
+    def resource_request(self, args: tuple, kwargs: dict) -> dict:
+        request = super().resource_request(args, kwargs)
+        config = schemas.TrainingConfig(**(args[0] if args else kwargs['trainning_config']))
+        gpus = len(config.gpu_ids) if config.gpu_ids else config.n_gpu or 0
+        processes = gpus or config.cpu_processes
+        request['cpu'] = max(request['cpu'], processes * (config.num_workers + 1))
+        request['gpu'] = gpus
+        return request
+
+
+@worker_ready.connect
+def advertise_capacity(sender=None, **kwargs):
+    client = _redis(sender.app)
+    if client is None:
+        return
+    capacity_key, reservations_key = _keys(node_name())
+    capacity = node_capacity()
+    # the workers of a node share its hash: one without GPUs (e.g. WORKER_GPUS=0 for the light
+    # queues) must not overwrite the GPUs advertised by another, whichever starts last
+    client.hset(capacity_key, mapping={k: v for k, v in capacity.items() if k != 'gpu' or v > 0})
+    client.hsetnx(capacity_key, 'gpu', capacity['gpu'])
+    # reservations left behind by this worker before a restart
+    hostname = getattr(sender, 'hostname', '')
+    for task_id, value in client.hgetall(reservations_key).items():
+        if json.loads(value)['worker'] == hostname:
+            client.hdel(reservations_key, task_id)
+    logger.info(f'node {node_name()} capacity {capacity}')
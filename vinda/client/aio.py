@@ -0,0 +1,99 @@
+'''
+Usage:
+
+from vinda.client.aio import AsyncClient
+
+async with AsyncClient('http://127.0.0.1:8081') as client:
+    states = await client.task_states(task_ids)
+    async for state in client.follow_task(task_id):
+        print(state['task_state'], state['task_result'])
+'''
+
+import os
+import asyncio
+
+from typing import AsyncIterator
+
+import httpx
+
+from vinda.client.base import TERMINAL_STATES, BaseClient, batches, decode_sse, unwrap
+
+
+class AsyncClient(BaseClient):
+    '''asyncio api client, every method of `BaseClient` is a coroutine here. Create it inside the event loop.'''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._http = httpx.AsyncClient(**self._options)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        await self._http.aclose()
+
+    async def _call(self, method: str, path: str, key: str | None = None, idempotent: bool = True, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                response = await self._http.request(method, path, **kwargs)
+            except httpx.TransportError as e:
+                if not self.retry.should_retry(attempt, idempotent, error=e):
+                    raise
+            else:
+                if not self.retry.should_retry(attempt, idempotent, status_code=response.status_code):
+                    return unwrap(response, key)
+            await asyncio.sleep(self.retry.delay(attempt))
+            attempt += 1
+
+    async def upload_dataset(self, path: str, name: str = ''):
+        '''Upload a zipped dataset in one request and start its extraction, see `Client.upload_dataset`.'''
+        with open(path, 'rb') as fp:
+            return await self.upload_fileobj(fp, os.path.basename(path), name)
+
+    async def infer_batch(self, path_model: str, path_images: list[str], img_size: int = 224,
+                          top_k: int = 1) -> list[dict]:
+        '''Predictions of /infer_cls_batch, in order; batches over `MAX_BATCH` images are sent concurrently.'''
+        chunks = await asyncio.gather(*[
+            self._call('POST', '/infer_cls_batch', key='predictions', json={
+                'path_model': path_model, 'path_images': chunk, 'img_size': img_size, 'top_k': top_k,
+            })
+            for chunk in batches(path_images)
+        ])
+        return [x for chunk in chunks for x in chunk]
+
+    async def follow_task(self, task_id: str) -> AsyncIterator[dict]:
+        '''Yield the task summaries pushed by /task_events until the task finishes, see `Client.follow_task`.'''
+        attempt = 0
+        while True:
+            try:
+                timeout = httpx.Timeout(self._http.timeout.connect, read=None)
+                async with self._http.stream('GET', f'/task_events/{task_id}', timeout=timeout) as response:
+                    if response.status_code >= 400:
+                        await response.aread()
+                        unwrap(response)
+                    async for line in response.aiter_lines():
+                        state = decode_sse(line)
+                        if state is None:
+                            continue
+                        attempt = 0
+                        yield state
+                        if state['task_state'] in TERMINAL_STATES:
+                            return
+            except httpx.TransportError as e:
+                if not self.retry.should_retry(attempt, True, error=e):
+                    raise
+            else:
+                if attempt >= self.retry.retries:
+                    return
+            await asyncio.sleep(self.retry.delay(attempt))
+            attempt += 1
+
+    async def wait_task(self, task_id: str) -> dict:
+        state = None
+        async for state in self.follow_task(task_id):
+            pass
+        return state
@@ -0,0 +1,176 @@
+import os
+import json
+import random
+
+import httpx
+
+from vinda.api import schemas
+
+
+## address of the api, e.g. http://127.0.0.1:8081
+DEFAULT_URL = os.environ.get('VINDA_API_URL', 'http://127.0.0.1:8081')
+
+## task states after which a task does not change any more, mirrors `events.TERMINAL_STATES`
+## without importing celery into clients
+TERMINAL_STATES = frozenset({'SUCCESS', 'FAILURE', 'REVOKED', 'CANCELLED'})
+
+## responses of a proxy or a restarting server, the request did not run
+RETRY_STATUS = frozenset({502, 503, 504})
+
+## images per /infer_cls_batch request, the `max_length` of `BatchInferenceConfig.path_images`
+MAX_BATCH = 256
+
+
+class VindaError(Exception):
+    '''An error reported by the api, either as an HTTP status or as a non-zero `code` in the body.'''
+
+    def __init__(self, code: int, message: str, status_code: int | None = None, traceback: list | None = None):
+        super().__init__(f'[{code}] {message}')
+        self.code = code
+        self.message = message
+        self.status_code = status_code
+        self.traceback = traceback
+
+
+class RetryPolicy:
+    '''Exponential backoff with jitter.
+
+    Connection failures are always retried, the request never reached the server.
+    Timeouts, dropped connections and 502/503/504 are retried only for idempotent
+    calls, so a retry never submits a second training task.
+    '''
+
+    def __init__(self, retries: int = 3, backoff: float = 0.2, max_backoff: float = 5.0):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt: int) -> float:
+        return min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def should_retry(self, attempt: int, idempotent: bool, error: Exception | None = None,
+                     status_code: int | None = None) -> bool:
+        if attempt >= self.retries:
+            return False
+        if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+            return True
+        if isinstance(error, httpx.TransportError):
+            return idempotent
+        return idempotent and status_code in RETRY_STATUS
+
+
+def unwrap(response: httpx.Response, key: str | None = None):
+    '''The `data` of an api response, or `data[key]`; raises `VindaError` on failures.'''
+    try:
+        body = response.json()
+    except ValueError:
+        body = {}
+    if response.status_code >= 400:
+        # @response_handle raises HTTPException, the message is in `detail`
+        message = body.get('detail') or body.get('message') or response.text or response.reason_phrase
+        raise VindaError(response.status_code, str(message), response.status_code)
+    if body.get('code', 0) != 0:
+        raise VindaError(body['code'], body.get('message', ''), response.status_code, body.get('traceback'))
+    data = body.get('data')
+    return data if key is None else data[key]
+
+
+def decode_sse(line: str) -> dict | None:
+    '''The task summary of a `data:` line of /task_events, None for other lines.'''
+    if line.startswith('data:'):
+        return json.loads(line[len('data:'):].strip())
+    return None
+
+
+def dump(config, schema: type) -> dict:
+    '''Validate a dict (or pass a model) against an api schema, so bad configs fail before sending.'''
+    if isinstance(config, schema):
+        return config.model_dump()
+    return schema(**config).model_dump()
+
+
+def batches(paths: list[str], size: int = MAX_BATCH) -> list[list[str]]:
+    return [paths[i:i + size] for i in range(0, len(paths), size)]
+
+
+class BaseClient:
+    '''Endpoints shared by `Client` and `AsyncClient`.
+
+    Every method returns `self._call(...)`: the result for `Client`, an awaitable for
+    `AsyncClient`. Only streaming and fan-out calls are implemented per client.
+    '''
+
+    def __init__(self, url: str = DEFAULT_URL, timeout: float = 30., max_connections: int = 32,
+                 retry: RetryPolicy | None = None, headers: dict | None = None):
+        """
+        Args:
+            url (str): address of the api
+            timeout (float): seconds to connect, and between bytes of a response
+            max_connections (int): pooled keep-alive connections
+            retry (RetryPolicy): retry policy, `RetryPolicy()` by default
+            headers (dict): headers sent with every request
+        """
+        self.url = url.rstrip('/')
+        self.retry = retry or RetryPolicy()
+        self._options = {
+            'base_url': self.url,
+            'timeout': timeout,
+            'headers': headers,
+            'limits': httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        }
+
+    def _call(self, method: str, path: str, key: str | None = None, idempotent: bool = True, **kwargs):
+        raise NotImplementedError
+
+    def train(self, config: schemas.TrainingConfig | dict):
+        '''Submit a training task, returns `{'task_state', 'task_id'}`.'''
+        return self._call('POST', '/train_cls_model', json=dump(config, schemas.TrainingConfig), idempotent=False)
+
+    def export_model(self, config: schemas.ExportConfig | dict):
+        '''Submit an export task, returns `{'exported_path', 'task_id'}`.'''
+        return self._call('POST', '/export_model', json=dump(config, schemas.ExportConfig), idempotent=False)
+
+    def infer(self, config: schemas.InferenceConfig | dict):
+        '''Fire-and-forget inference of /infer_cls_engine, the predictions are only logged by the server.'''
+        return self._call('POST', '/infer_cls_engine', json=dump(config, schemas.InferenceConfig))
+
+    def free_cls_engine(self):
+        return self._call('GET', '/free_cls_engine')
+
+    def task_state(self, task_id: str):
+        return self._call('GET', f'/task_state/{task_id}')
+
+    def task_states(self, task_ids: list[str], include_result: bool = False):
+        '''States of many tasks in one request.'''
+        query = schemas.TaskStatesQuery(task_ids=task_ids, include_result=include_result)
+        return self._call('POST', '/task_states', key='tasks', json=query.model_dump())
+
+    def cancel_task(self, task_id: str):
+        return self._call('POST', f'/cancel_task/{task_id}')
+
+    def list_datasets(self):
+        return self._call('GET', '/list_datasets', key='datasets')
+
+    def list_models(self, pattern: str = '*', pretrained: bool = False, page: int = 1, page_size: int = 0):
+        params = {'pattern': pattern, 'pretrained': pretrained, 'page': page, 'page_size': page_size}
+        return self._call('GET', '/list_models', params=params)
+
+    def list_trained_models(self, **filters):
+        '''Registered checkpoints, `filters` are the query parameters of /list_trained_models.'''
+        return self._call('GET', '/list_trained_models', params=filters)
+
+    def model_catalog(self, **filters):
+        return self._call('GET', '/model_catalog', key='models', params=filters)
+
+    def dataset_stats(self, dataset: str):
+        return self._call('GET', '/dataset_stats', params={'dataset': dataset})
+
+    def upload_fileobj(self, fp, filename: str, name: str = ''):
+        '''Upload a zipped dataset from a binary file object, see `upload_dataset`.'''
+        return self._call(
+            'POST', '/upload_datasets', params={'name': name}, files={'file': (filename, fp, 'application/zip')},
+            idempotent=False,
+        )
+
+    def metrics(self):
+        return self._call('GET', '/metrics', key='routes')
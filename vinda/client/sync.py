@@ -0,0 +1,113 @@
+'''
+Usage:
+
+from vinda.client.sync import Client
+
+with Client('http://127.0.0.1:8081') as client:
+    task = client.train({'dataset': '/data/output/datasets/flowers', 'epochs': 10})
+    for state in client.follow_task(task['task_id']):
+        print(state['task_state'], state['task_result'])
+    preds = client.infer_batch('/data/output/exported/cls_model.onnx', ['a.jpg', 'b.jpg'])
+'''
+
+import os
+import time
+
+from typing import Iterator
+
+import httpx
+
+from vinda.client.base import TERMINAL_STATES, BaseClient, batches, decode_sse, unwrap
+
+
+class Client(BaseClient):
+    '''Blocking api client, one pooled keep-alive connection set per instance; share the instance.'''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._http = httpx.Client(**self._options)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._http.close()
+
+    def _call(self, method: str, path: str, key: str | None = None, idempotent: bool = True, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                response = self._http.request(method, path, **kwargs)
+            except httpx.TransportError as e:
+                if not self.retry.should_retry(attempt, idempotent, error=e):
+                    raise
+            else:
+                if not self.retry.should_retry(attempt, idempotent, status_code=response.status_code):
+                    return unwrap(response, key)
+            time.sleep(self.retry.delay(attempt))
+            attempt += 1
+
+    def upload_dataset(self, path: str, name: str = ''):
+        """Upload a zipped dataset in one request and start its extraction.
+
+        Args:
+            path (str): path of the zip
+            name (str): dataset name, empty uses the top directory of the zip
+
+        Returns:
+            dict: `{'task_state', 'task_id'}` of the extraction task
+        """
+        with open(path, 'rb') as fp:
+            return self.upload_fileobj(fp, os.path.basename(path), name)
+
+    def infer_batch(self, path_model: str, path_images: list[str], img_size: int = 224, top_k: int = 1) -> list[dict]:
+        '''Predictions of /infer_cls_batch, in order, split into requests of at most `MAX_BATCH` images.'''
+        predictions = []
+        for chunk in batches(path_images):
+            predictions += self._call('POST', '/infer_cls_batch', key='predictions', json={
+                'path_model': path_model, 'path_images': chunk, 'img_size': img_size, 'top_k': top_k,
+            })
+        return predictions
+
+    def follow_task(self, task_id: str) -> Iterator[dict]:
+        """Yield the task summaries pushed by /task_events until the task finishes.
+
+        Reconnects with backoff when the stream drops before a terminal state; the
+        server sends the current state first, so nothing is missed.
+        """
+        attempt = 0
+        while True:
+            try:
+                # the server sends keep-alive comments, no read timeout on the stream
+                timeout = httpx.Timeout(self._http.timeout.connect, read=None)
+                with self._http.stream('GET', f'/task_events/{task_id}', timeout=timeout) as response:
+                    if response.status_code >= 400:
+                        response.read()
+                        unwrap(response)
+                    for line in response.iter_lines():
+                        state = decode_sse(line)
+                        if state is None:
+                            continue
+                        attempt = 0
+                        yield state
+                        if state['task_state'] in TERMINAL_STATES:
+                            return
+            except httpx.TransportError as e:
+                if not self.retry.should_retry(attempt, True, error=e):
+                    raise
+            else:
+                # the stream closed before the task finished, e.g. the api restarted
+                if attempt >= self.retry.retries:
+                    return
+            time.sleep(self.retry.delay(attempt))
+            attempt += 1
+
+    def wait_task(self, task_id: str) -> dict:
+        '''Block until the task finishes, returns its last summary.'''
+        state = None
+        for state in self.follow_task(task_id):
+            pass
+        return state